@@ -0,0 +1,243 @@
+"""Общий каркас функций: маршрутизация по таблице действий, JSON и сжатие ответов
+
+Файл одинаковый во всех функциях, как db.py и auth_token.py. Функция описывает
+ROUTES = {(метод, action): обработчик}; обработчик получает Request и возвращает данные
+для ответа 200 либо Response, ошибки - через HttpError. Соединение с БД берётся из пула
+при первом обращении к request.cursor и возвращается после ответа; курсор считает
+запросы для metrics.py, метрики процесса отдаются по GET ?action=metrics.
+JSON сериализуется через orjson (datetime - ISO 8601), без него - через json с тем же
+форматом. Тела больше COMPRESS_MIN_BYTES сжимаются br или gzip по Accept-Encoding.
+"""
+import base64
+import datetime
+import gzip
+import json
+import os
+import time
+from psycopg2.extras import RealDictCursor
+from db import get_connection, release_connection, pool_stats
+from auth_token import AuthError
+from metrics import InstrumentedCursor, QueryStats, observe, render
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+METRICS_HEADERS = {'Content-Type': 'text/plain; version=0.0.4', 'Access-Control-Allow-Origin': '*'}
+JSON_HEADERS = {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}
+ENCODED_HEADERS = {
+    encoding: {**JSON_HEADERS, 'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+    for encoding in ('br', 'gzip')
+}
+OPTIONS_RESPONSE = {
+    'statusCode': 200,
+    'headers': {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token, If-None-Match',
+        'Access-Control-Expose-Headers': 'ETag',
+    },
+    'body': '',
+    'isBase64Encoded': False
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class Response:
+    """Ответ с нестандартным статусом или заголовками; data=None - пустое тело"""
+    __slots__ = ('status', 'data', 'headers')
+
+    def __init__(self, status: int, data=None, headers: dict = None):
+        self.status = status
+        self.data = data
+        self.headers = headers
+
+
+class Request:
+    def __init__(self, event: dict, default_action=None, stats: QueryStats = None):
+        self.event = event
+        self.stats = stats or QueryStats()
+        self.method = event.get('httpMethod', 'GET')
+        self.params = event.get('queryStringParameters') or {}
+        self.headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+        try:
+            self.body = loads(event.get('body') or '{}') if self.method == 'POST' else {}
+        except ValueError:
+            raise HttpError(400, 'Тело запроса должно быть JSON')
+        if not isinstance(self.body, dict):
+            raise HttpError(400, 'Тело запроса должно быть JSON-объектом')
+        source = self.body if self.method == 'POST' else self.params
+        self.action = source.get('action', default_action)
+        # action - ключ таблицы маршрутов: список или объект из JSON упал бы на хешировании
+        if self.action is not None and not isinstance(self.action, str):
+            raise HttpError(400, 'action должен быть строкой')
+        self.stats.action = self.action
+        self.auth_user_id = None
+        self._conn = None
+        self._cursor = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = get_connection()
+        return self._conn
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = InstrumentedCursor(self.conn.cursor(cursor_factory=RealDictCursor), self.stats)
+        return self._cursor
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+        if self._conn is not None:
+            release_connection(self._conn)
+
+
+def _default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(raw):
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def accepted_encodings(header: str) -> set:
+    """Кодировки из Accept-Encoding, кроме явно запрещённых через q=0"""
+    accepted = set()
+    for part in header.split(','):
+        name, _, params = part.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def compress(body: bytes, accept_encoding: str):
+    """(тело, кодировка) - сжатое, если клиент согласен и тело стоит сжимать, иначе (body, None)"""
+    if len(body) < COMPRESS_MIN_BYTES or not accept_encoding:
+        return body, None
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in accepted or '*' in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), 'gzip'
+    return body, None
+
+
+def respond(status: int, data, accept_encoding: str = '', headers: dict = None) -> dict:
+    if data is None:
+        return {'statusCode': status, 'headers': headers or CORS_HEADERS, 'body': '', 'isBase64Encoded': False}
+
+    body, encoding = compress(dumps(data), accept_encoding)
+    if encoding is None:
+        return {
+            'statusCode': status,
+            'headers': {**JSON_HEADERS, **headers} if headers else JSON_HEADERS,
+            'body': body.decode(),
+            'isBase64Encoded': False
+        }
+    return {
+        'statusCode': status,
+        'headers': {**ENCODED_HEADERS[encoding], **headers} if headers else ENCODED_HEADERS[encoding],
+        'body': base64.b64encode(body).decode(),
+        'isBase64Encoded': True
+    }
+
+
+def error(status: int, message: str) -> dict:
+    return respond(status, {'error': message})
+
+
+def _route(request: Request, routes: dict, before, errors: dict) -> dict:
+    route = routes.get((request.method, request.action))
+    if route is None:
+        if not any(m == request.method for m, _ in routes):
+            return error(405, 'Метод не поддерживается')
+        return error(400, 'Неверный запрос')
+
+    try:
+        if before is not None:
+            before(request)
+        result = route(request)
+        accept_encoding = request.headers.get('accept-encoding', '')
+        if isinstance(result, Response):
+            return respond(result.status, result.data, accept_encoding, result.headers)
+        return respond(200, result, accept_encoding)
+
+    except HttpError as e:
+        return error(e.status, str(e))
+    except AuthError as e:
+        return error(e.status, str(e))
+    except Exception as e:
+        for error_class, status in (errors or {}).items():
+            if isinstance(e, error_class):
+                return error(status, str(e))
+        return error(500, str(e))
+
+
+def dispatch(event: dict, routes: dict, before=None, errors: dict = None, default_action=None) -> dict:
+    """Находит обработчик (метод, action) в routes и превращает результат или исключение в ответ
+
+    before(request) вызывается перед обработчиком - для авторизации и проверок схемы;
+    errors - {класс исключения: статус} для ошибок функции, которые не нужно отдавать как 500.
+    """
+    method = event.get('httpMethod', 'GET')
+    if method == 'OPTIONS':
+        return OPTIONS_RESPONSE
+    if method == 'GET':
+        action = (event.get('queryStringParameters') or {}).get('action')
+        if action == 'pool_stats':
+            return respond(200, {'pool': pool_stats()})
+        if action == 'metrics':
+            return {'statusCode': 200, 'headers': METRICS_HEADERS, 'body': render(pool_stats()), 'isBase64Encoded': False}
+
+    started = time.perf_counter()
+    stats = QueryStats()
+    request = None
+    try:
+        request = Request(event, default_action, stats)
+        response = _route(request, routes, before, errors)
+    except HttpError as e:
+        response = error(e.status, str(e))
+    finally:
+        if request is not None:
+            request.close()
+
+    # Метка действия только из таблицы маршрутов, чтобы произвольный action не раздувал метрики
+    known = request is not None and (request.method, request.action) in routes
+    observe(
+        method, (request.action or 'default') if known else 'unknown', response['statusCode'],
+        time.perf_counter() - started, stats, len(response['body'])
+    )
+    return response
@@ -1,203 +1,151 @@
-import json
-import os
 import hashlib
+import os
 import time
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from core import dispatch, HttpError
+from auth_token import issue_token, authorize, revoke_token, token_from_event, AuthError, SECRET
+
+PRESENCE_TTL_SECONDS = int(os.environ.get('PRESENCE_TTL_SECONDS', '70'))
+
+# Вход отмечает присутствие в user_presence (как heartbeat в messages), строка users не переписывается
+PRESENCE_UPSERT = """
+    INSERT INTO user_presence (user_id, last_seen, online_until)
+    VALUES (%s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + make_interval(secs => %s))
+    ON CONFLICT (user_id) DO UPDATE
+    SET last_seen = EXCLUDED.last_seen, online_until = EXCLUDED.online_until
+"""
+
+USER_QUERY = """
+    SELECT u.id, u.phone, u.name, u.avatar_url, u.bio,
+           COALESCE(COALESCE(us.show_online_status, TRUE) AND p.online_until > CURRENT_TIMESTAMP, FALSE) AS is_online,
+           CASE WHEN COALESCE(us.show_online_status, TRUE) THEN COALESCE(p.last_seen, u.last_seen) END AS last_seen
+    FROM users u
+    LEFT JOIN user_presence p ON p.user_id = u.id
+    LEFT JOIN user_settings us ON us.user_id = u.id
+    WHERE u.id = %s
+"""
+
+
+def session_token(user: dict) -> dict:
+    """Подписанный токен; без AUTH_TOKEN_SECRET - прежний непроверяемый токен, чтобы вход не ломался"""
+    if SECRET:
+        return issue_token(user['id'])
+    return {'token': hashlib.sha256(f"{user['id']}:{user['phone']}:{time.time()}".encode()).hexdigest(), 'expires_at': None}
+
+
+def register(request):
+    phone = request.body.get('phone', '').strip()
+    name = request.body.get('name', '').strip()
+
+    if not phone or not name:
+        raise HttpError(400, 'Телефон и имя обязательны')
+
+    cursor = request.cursor
+    cursor.execute("SELECT id FROM users WHERE phone = %s", (phone,))
+
+    if cursor.fetchone():
+        raise HttpError(400, 'Пользователь с таким телефоном уже существует')
+
+    cursor.execute(
+        "INSERT INTO users (phone, name) VALUES (%s, %s) RETURNING id, phone, name, avatar_url, bio, created_at",
+        (phone, name)
+    )
+    user = cursor.fetchone()
+    cursor.execute(PRESENCE_UPSERT, (user['id'], PRESENCE_TTL_SECONDS))
+    request.conn.commit()
+
+    session = session_token(user)
+    return {'user': dict(user), 'token': session['token'], 'expires_at': session['expires_at']}
+
+
+def login(request):
+    phone = request.body.get('phone', '').strip()
+
+    if not phone:
+        raise HttpError(400, 'Телефон обязателен')
+
+    cursor = request.cursor
+    cursor.execute("SELECT id, phone, name, avatar_url, bio, created_at FROM users WHERE phone = %s", (phone,))
+    user = cursor.fetchone()
+
+    if not user:
+        raise HttpError(404, 'Пользователь не найден')
+
+    cursor.execute(PRESENCE_UPSERT, (user['id'], PRESENCE_TTL_SECONDS))
+    request.conn.commit()
+
+    session = session_token(user)
+    return {'user': dict(user), 'token': session['token'], 'expires_at': session['expires_at']}
+
+
+def logout(request):
+    token = token_from_event(request.event) or request.body.get('token')
+
+    try:
+        revoke_token(request.cursor, token)
+    except AuthError:
+        # Истёкший или старый токен отзывать не нужно
+        pass
+    request.conn.commit()
+    return {'success': True}
+
+
+def update_profile(request):
+    body = request.body
+    user_id = body.get('user_id')
+    authorize(request.event, user_id, request.cursor)
+
+    if not user_id:
+        raise HttpError(400, 'user_id обязателен')
+
+    updates = []
+    params = []
+
+    if body.get('name'):
+        updates.append("name = %s")
+        params.append(body['name'])
+    if body.get('bio') is not None:
+        updates.append("bio = %s")
+        params.append(body['bio'])
+    if body.get('avatar_url') is not None:
+        updates.append("avatar_url = %s")
+        params.append(body['avatar_url'])
+
+    if not updates:
+        raise HttpError(400, 'Неверный запрос')
+
+    params.append(user_id)
+    request.cursor.execute(
+        f"UPDATE users SET {', '.join(updates)} WHERE id = %s RETURNING id, phone, name, avatar_url, bio",
+        params
+    )
+    user = request.cursor.fetchone()
+    request.conn.commit()
+    return {'user': dict(user)}
+
+
+def get_user(request):
+    user_id = request.params.get('user_id')
+
+    if not user_id:
+        raise HttpError(400, 'Неверный запрос')
+
+    request.cursor.execute(USER_QUERY, (user_id,))
+    user = request.cursor.fetchone()
+
+    if not user:
+        raise HttpError(404, 'Пользователь не найден')
+    return {'user': dict(user)}
+
+
+ROUTES = {
+    ('POST', 'register'): register,
+    ('POST', 'login'): login,
+    ('POST', 'logout'): logout,
+    ('POST', 'update_profile'): update_profile,
+    ('GET', None): get_user,
+}
+
 
 def handler(event: dict, context) -> dict:
     """API для регистрации и авторизации пользователей мессенджера"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id, X-Auth-Token'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'register':
-                phone = body.get('phone', '').strip()
-                name = body.get('name', '').strip()
-                
-                if not phone or not name:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Телефон и имя обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("SELECT id FROM users WHERE phone = %s", (phone,))
-                existing_user = cursor.fetchone()
-                
-                if existing_user:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь с таким телефоном уже существует'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    "INSERT INTO users (phone, name, is_online) VALUES (%s, %s, TRUE) RETURNING id, phone, name, avatar_url, bio, created_at",
-                    (phone, name)
-                )
-                user = cursor.fetchone()
-                conn.commit()
-                
-                token = hashlib.sha256(f"{user['id']}:{phone}:{time.time()}".encode()).hexdigest()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': dict(user),
-                        'token': token
-                    }, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'login':
-                phone = body.get('phone', '').strip()
-                
-                if not phone:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Телефон обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    "SELECT id, phone, name, avatar_url, bio, created_at FROM users WHERE phone = %s",
-                    (phone,)
-                )
-                user = cursor.fetchone()
-                
-                if not user:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    "UPDATE users SET is_online = TRUE, last_seen = CURRENT_TIMESTAMP WHERE id = %s",
-                    (user['id'],)
-                )
-                conn.commit()
-                
-                token = hashlib.sha256(f"{user['id']}:{phone}:{time.time()}".encode()).hexdigest()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'user': dict(user),
-                        'token': token
-                    }, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'update_profile':
-                user_id = body.get('user_id')
-                name = body.get('name')
-                bio = body.get('bio')
-                avatar_url = body.get('avatar_url')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'user_id обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                updates = []
-                params = []
-                
-                if name:
-                    updates.append("name = %s")
-                    params.append(name)
-                if bio is not None:
-                    updates.append("bio = %s")
-                    params.append(bio)
-                if avatar_url is not None:
-                    updates.append("avatar_url = %s")
-                    params.append(avatar_url)
-                
-                if updates:
-                    params.append(user_id)
-                    cursor.execute(
-                        f"UPDATE users SET {', '.join(updates)} WHERE id = %s RETURNING id, phone, name, avatar_url, bio",
-                        params
-                    )
-                    user = cursor.fetchone()
-                    conn.commit()
-                    
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'user': dict(user)}, default=str),
-                        'isBase64Encoded': False
-                    }
-        
-        elif method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if user_id:
-                cursor.execute(
-                    "SELECT id, phone, name, avatar_url, bio, is_online, last_seen FROM users WHERE id = %s",
-                    (user_id,)
-                )
-                user = cursor.fetchone()
-                
-                if user:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'user': dict(user)}, default=str),
-                        'isBase64Encoded': False
-                    }
-                else:
-                    return {
-                        'statusCode': 404,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Пользователь не найден'}),
-                        'isBase64Encoded': False
-                    }
-        
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный запрос'}),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+    return dispatch(event, ROUTES)
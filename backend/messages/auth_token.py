@@ -0,0 +1,172 @@
+"""Подписанные токены сессии: HMAC-SHA256 со сроком жизни, проверяются без запроса к БД
+
+Токен: <user_id>.<exp>.<jti>.<подпись>. Проверенные токены держатся в LRU процесса,
+отозванные (logout) читаются из revoked_tokens не чаще раза в REVOCATION_REFRESH_SECONDS.
+Файл одинаковый во всех функциях; секрет общий - AUTH_TOKEN_SECRET.
+Пока AUTH_ENFORCE выключен, запросы без токена проходят как раньше, но валидный токен
+с чужим user_id отклоняется всегда. Служебные действия (таймеры, вызовы между функциями)
+требуют заголовок X-Service-Key со значением SERVICE_KEY независимо от AUTH_ENFORCE.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+SECRET = os.environ.get('AUTH_TOKEN_SECRET', '').encode()
+TOKEN_TTL_SECONDS = int(os.environ.get('AUTH_TOKEN_TTL_SECONDS', str(30 * 24 * 3600)))
+REVOCATION_REFRESH_SECONDS = float(os.environ.get('AUTH_REVOCATION_REFRESH_SECONDS', '60'))
+ENFORCE = os.environ.get('AUTH_ENFORCE', '').lower() in ('1', 'true', 'yes')
+SERVICE_KEY = os.environ.get('SERVICE_KEY', '').encode()
+CACHE_SIZE = 10000
+
+REVOKED_QUERY = "SELECT jti FROM revoked_tokens WHERE expires_at > CURRENT_TIMESTAMP"
+REVOKE_QUERY = """
+    INSERT INTO revoked_tokens (jti, user_id, expires_at)
+    VALUES (%s, %s, to_timestamp(%s))
+    ON CONFLICT (jti) DO NOTHING
+"""
+
+_verified = OrderedDict()
+_revoked = set()
+_revoked_loaded_at = None
+_lock = threading.Lock()
+
+
+class AuthError(Exception):
+    def __init__(self, message: str, status: int = 401):
+        super().__init__(message)
+        self.status = status
+
+
+def _sign(message: str) -> str:
+    digest = hmac.new(SECRET, message.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def issue_token(user_id) -> dict:
+    """Новый токен для пользователя; без AUTH_TOKEN_SECRET выдавать токены нельзя"""
+    if not SECRET:
+        raise AuthError('AUTH_TOKEN_SECRET не задан', 503)
+    expires_at = int(time.time()) + TOKEN_TTL_SECONDS
+    message = f'{int(user_id)}.{expires_at}.{secrets.token_hex(8)}'
+    return {'token': f'{message}.{_sign(message)}', 'expires_at': expires_at}
+
+
+def _parse(token: str) -> tuple:
+    """(user_id, exp, jti) из токена с проверкой подписи и срока; AuthError при ошибке"""
+    with _lock:
+        cached = _verified.get(token)
+        if cached is not None:
+            _verified.move_to_end(token)
+    if cached is None:
+        try:
+            message, signature = token.rsplit('.', 1)
+            user_id, expires_at, jti = message.split('.')
+            cached = (int(user_id), int(expires_at), jti)
+        except (AttributeError, ValueError):
+            raise AuthError('Неверный токен')
+        # Байты, а не str: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(signature.encode(), _sign(message).encode()):
+            raise AuthError('Неверный токен')
+        with _lock:
+            _verified[token] = cached
+            if len(_verified) > CACHE_SIZE:
+                _verified.popitem(last=False)
+
+    if cached[1] < time.time():
+        raise AuthError('Срок действия токена истёк')
+    return cached
+
+
+def revocation_due() -> bool:
+    return _revoked_loaded_at is None or time.monotonic() - _revoked_loaded_at >= REVOCATION_REFRESH_SECONDS
+
+
+def needs_cursor(event: dict) -> bool:
+    """authorize для этого запроса перечитает список отзыва: токен есть, секрет задан и срок вышел
+
+    Без токена или секрета список не читается вовсе, поэтому cursor таким запросам не нужен.
+    """
+    return bool(SECRET) and token_from_event(event) is not None and revocation_due()
+
+
+def _refresh_revoked(cursor):
+    global _revoked, _revoked_loaded_at
+    if cursor is None or not revocation_due():
+        return
+    now = time.monotonic()
+    cursor.execute(REVOKED_QUERY)
+    revoked = {row['jti'] for row in cursor.fetchall()}
+    with _lock:
+        _revoked = revoked
+        _revoked_loaded_at = now
+
+
+def verify_token(token: str, cursor=None) -> int:
+    """user_id владельца токена; cursor нужен только для периодического обновления списка отзыва"""
+    if not SECRET:
+        raise AuthError('AUTH_TOKEN_SECRET не задан', 503)
+    user_id, _, jti = _parse(token)
+    _refresh_revoked(cursor)
+    if jti in _revoked:
+        raise AuthError('Токен отозван')
+    return user_id
+
+
+def token_from_event(event: dict):
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    token = headers.get('x-auth-token')
+    if not token and headers.get('authorization', '').startswith('Bearer '):
+        token = headers['authorization'][len('Bearer '):]
+    return token or None
+
+
+def is_service_request(event: dict) -> bool:
+    """Запрос несёт служебный ключ; без SERVICE_KEY служебных запросов нет"""
+    if not SERVICE_KEY:
+        return False
+    headers = {k.lower(): v for k, v in (event.get('headers') or {}).items()}
+    return hmac.compare_digest((headers.get('x-service-key') or '').encode(), SERVICE_KEY)
+
+
+def authorize_service(event: dict):
+    if not is_service_request(event):
+        raise AuthError('Требуется служебный ключ', 403)
+
+
+def authorize(event: dict, claimed_user_id=None, cursor=None):
+    """Проверяет токен запроса и что он принадлежит claimed_user_id
+
+    Возвращает user_id из токена или None, если токена нет и AUTH_ENFORCE выключен.
+    """
+    token = token_from_event(event)
+    if not token or not SECRET:
+        if ENFORCE:
+            raise AuthError('Требуется авторизация')
+        return None
+
+    try:
+        user_id = verify_token(token, cursor)
+    except AuthError:
+        # Старые токены без подписи не ломают сессии, пока проверка не включена
+        if ENFORCE:
+            raise
+        return None
+
+    if claimed_user_id not in (None, '') and str(claimed_user_id) != str(user_id):
+        raise AuthError('Токен принадлежит другому пользователю', 403)
+    return user_id
+
+
+def revoke_token(cursor, token: str) -> bool:
+    """Отзывает токен: сразу в этом процессе, в остальных - после обновления списка"""
+    user_id, expires_at, jti = _parse(token)
+    cursor.execute(REVOKE_QUERY, (jti, user_id, expires_at))
+    with _lock:
+        _revoked.add(jti)
+        _verified.pop(token, None)
+    return True
@@ -0,0 +1,83 @@
+"""Список чатов пользователя одним запросом по сводкам чатов с курсорной пагинацией по updated_at"""
+from datetime import datetime
+from presence import PRESENCE_JOIN, IS_ONLINE_SQL, LAST_SEEN_SQL
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+CHAT_PAGE_QUERY = """
+    WITH page AS (
+        SELECT c.id, c.name, c.is_group, c.avatar_url, c.updated_at,
+               c.last_message_id, c.last_message_preview AS last_message, c.last_message_type,
+               c.last_message_sender_id, c.last_message_at AS last_message_time,
+               c.participant_count AS participants_count, cp.unread_count
+        FROM chat_participants cp
+        JOIN chats c ON c.id = cp.chat_id
+        WHERE cp.user_id = %(user_id)s {cursor_condition}
+        ORDER BY c.updated_at DESC, c.id DESC
+        LIMIT %(limit)s
+    )
+    SELECT page.*,
+           peer.name AS peer_name,
+           peer.avatar_url AS peer_avatar,
+           peer.is_online AS peer_is_online,
+           peer.last_seen AS peer_last_seen
+    FROM page
+    LEFT JOIN LATERAL (
+        SELECT u.name, u.avatar_url, {is_online} AS is_online, {last_seen} AS last_seen
+        FROM chat_participants p
+        JOIN users u ON u.id = p.user_id
+        {presence_join}
+        WHERE p.chat_id = page.id AND p.user_id != %(user_id)s
+        LIMIT 1
+    ) peer ON NOT page.is_group
+    ORDER BY page.updated_at DESC, page.id DESC
+"""
+
+CURSOR_CONDITION = "AND (c.updated_at, c.id) < (%(cursor_ts)s, %(cursor_id)s)"
+
+
+def encode_cursor(chat: dict) -> str:
+    return f"{chat['updated_at'].isoformat()}|{chat['id']}"
+
+
+def decode_cursor(cursor: str):
+    ts, chat_id = cursor.rsplit('|', 1)
+    return datetime.fromisoformat(ts), int(chat_id)
+
+
+def fetch_chat_page(cursor, user_id, limit=DEFAULT_LIMIT, after=None):
+    """Возвращает (чаты, next_cursor) за один запрос к БД"""
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    cursor_ts, cursor_id = decode_cursor(after) if after else (None, None)
+    query = CHAT_PAGE_QUERY.format(
+        cursor_condition=CURSOR_CONDITION if after else '',
+        is_online=IS_ONLINE_SQL,
+        last_seen=LAST_SEEN_SQL,
+        presence_join=PRESENCE_JOIN
+    )
+
+    cursor.execute(query, {
+        'user_id': user_id,
+        'cursor_ts': cursor_ts,
+        'cursor_id': cursor_id,
+        'limit': limit,
+    })
+    rows = cursor.fetchall()
+
+    chats = []
+    for row in rows:
+        chat = dict(row)
+        peer_name = chat.pop('peer_name')
+        peer_avatar = chat.pop('peer_avatar')
+        peer_is_online = chat.pop('peer_is_online')
+        peer_last_seen = chat.pop('peer_last_seen')
+        if not chat['is_group'] and peer_name is not None:
+            chat['name'] = peer_name
+            chat['avatar_url'] = peer_avatar
+            chat['is_online'] = peer_is_online
+            chat['last_seen'] = peer_last_seen
+        chats.append(chat)
+
+    next_cursor = encode_cursor(chats[-1]) if len(chats) == limit else None
+    return chats, next_cursor
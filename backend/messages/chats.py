@@ -0,0 +1,72 @@
+"""Создание чатов: личный чат ищется и создаётся одним upsert по паре участников"""
+
+CREATE_DIRECT_QUERY = """
+    WITH new_chat AS (
+        INSERT INTO chats (is_group, participant_count, direct_user_low, direct_user_high)
+        VALUES (FALSE, cardinality(%(participants)s::int[]), %(low)s, %(high)s)
+        ON CONFLICT (direct_user_low, direct_user_high) WHERE direct_user_low IS NOT NULL DO NOTHING
+        RETURNING id
+    ), members AS (
+        INSERT INTO chat_participants (chat_id, user_id, is_admin)
+        SELECT new_chat.id, p.user_id, p.ord = 1
+        FROM new_chat, unnest(%(participants)s::int[]) WITH ORDINALITY AS p(user_id, ord)
+    )
+    SELECT id, TRUE AS created FROM new_chat
+    UNION ALL
+    SELECT id, FALSE FROM chats
+    WHERE direct_user_low = %(low)s AND direct_user_high = %(high)s
+      AND NOT EXISTS (SELECT 1 FROM new_chat)
+"""
+
+FIND_DIRECT_QUERY = """
+    SELECT id, FALSE AS created FROM chats
+    WHERE direct_user_low = %(low)s AND direct_user_high = %(high)s
+"""
+
+CREATE_CHAT_QUERY = """
+    WITH new_chat AS (
+        INSERT INTO chats (name, is_group, participant_count)
+        VALUES (%(name)s, %(is_group)s, cardinality(%(participants)s::int[]))
+        RETURNING id
+    ), members AS (
+        INSERT INTO chat_participants (chat_id, user_id, is_admin)
+        SELECT new_chat.id, p.user_id, p.ord = 1
+        FROM new_chat, unnest(%(participants)s::int[]) WITH ORDINALITY AS p(user_id, ord)
+    )
+    SELECT id, TRUE AS created FROM new_chat
+"""
+
+
+def create_chat(cursor, user_id, participant_ids, is_group=False, name=None):
+    """Возвращает (chat_id, created); создатель чата становится администратором"""
+    participants = list(dict.fromkeys(int(pid) for pid in [user_id] + list(participant_ids)))
+
+    if not is_group and len(participants) == 2:
+        params = {'participants': participants, 'low': min(participants), 'high': max(participants)}
+        cursor.execute(CREATE_DIRECT_QUERY, params)
+        row = cursor.fetchone()
+        if not row:
+            # Параллельный запрос создал этот чат после снимка нашего запроса
+            cursor.execute(FIND_DIRECT_QUERY, params)
+            row = cursor.fetchone()
+        return row['id'], row['created']
+
+    cursor.execute(CREATE_CHAT_QUERY, {'name': name, 'is_group': bool(is_group), 'participants': participants})
+    return cursor.fetchone()['id'], True
+
+
+def set_muted(cursor, chat_id, user_id, muted: bool):
+    """Включает или выключает push-уведомления чата для участника; None, если он не в чате"""
+    cursor.execute(
+        """UPDATE chat_participants SET muted = %s
+           WHERE chat_id = %s AND user_id = %s
+           RETURNING chat_id, user_id, muted""",
+        (bool(muted), int(chat_id), int(user_id))
+    )
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+def is_participant(cursor, chat_id, user_id) -> bool:
+    cursor.execute('SELECT 1 FROM chat_participants WHERE chat_id = %s AND user_id = %s', (int(chat_id), int(user_id)))
+    return cursor.fetchone() is not None
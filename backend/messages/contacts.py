@@ -0,0 +1,82 @@
+"""Справочник контактов: keyset-пагинация по (name, id), поиск по имени и телефону"""
+import re
+from presence import PRESENCE_JOIN, IS_ONLINE_SQL, LAST_SEEN_SQL
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+MODES = ('all', 'shared')
+
+CONTACTS_QUERY = """
+    SELECT u.id, u.name, u.phone, u.avatar_url,
+           {is_online} AS is_online, {last_seen} AS last_seen
+    FROM users u
+    {shared_join}
+    {presence_join}
+    WHERE u.id != %(user_id)s {search_condition} {cursor_condition}
+    ORDER BY u.name, u.id
+    LIMIT %(limit)s
+"""
+
+SHARED_JOIN = """
+    JOIN (
+        SELECT DISTINCT other.user_id
+        FROM chat_participants mine
+        JOIN chat_participants other ON other.chat_id = mine.chat_id
+        WHERE mine.user_id = %(user_id)s
+    ) shared ON shared.user_id = u.id
+"""
+
+NAME_SEARCH = "u.name ILIKE %(name_pattern)s"
+PHONE_SEARCH = r"regexp_replace(u.phone, '\D', '', 'g') LIKE %(phone_pattern)s"
+CURSOR_CONDITION = "AND (u.name, u.id) > (%(cursor_name)s, %(cursor_id)s)"
+
+
+def _like_pattern(value: str) -> str:
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+
+def encode_cursor(contact: dict) -> str:
+    return f"{contact['name']}|{contact['id']}"
+
+
+def decode_cursor(cursor: str):
+    name, contact_id = cursor.rsplit('|', 1)
+    return name, int(contact_id)
+
+
+def fetch_contacts(cursor, user_id, q=None, limit=DEFAULT_LIMIT, after=None, mode='all'):
+    """Возвращает (контакты, next_cursor); mode='shared' - только собеседники по общим чатам"""
+    if mode not in MODES:
+        raise ValueError(f'Неизвестный mode: {mode}')
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    params = {'user_id': user_id, 'limit': limit}
+
+    search_condition = ''
+    q = (q or '').strip()
+    if q:
+        conditions = [NAME_SEARCH]
+        params['name_pattern'] = _like_pattern(q)
+        digits = re.sub(r'\D', '', q)
+        if len(digits) >= 3:
+            conditions.append(PHONE_SEARCH)
+            params['phone_pattern'] = f'%{digits}%'
+        search_condition = f"AND ({' OR '.join(conditions)})"
+
+    cursor_condition = ''
+    if after:
+        params['cursor_name'], params['cursor_id'] = decode_cursor(after)
+        cursor_condition = CURSOR_CONDITION
+
+    cursor.execute(CONTACTS_QUERY.format(
+        shared_join=SHARED_JOIN if mode == 'shared' else '',
+        search_condition=search_condition,
+        cursor_condition=cursor_condition,
+        is_online=IS_ONLINE_SQL,
+        last_seen=LAST_SEEN_SQL,
+        presence_join=PRESENCE_JOIN
+    ), params)
+    contacts = [dict(c) for c in cursor.fetchall()]
+
+    next_cursor = encode_cursor(contacts[-1]) if len(contacts) == limit else None
+    return contacts, next_cursor
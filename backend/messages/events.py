@@ -0,0 +1,195 @@
+"""Журнал событий пользователей и long-poll ожидание через LISTEN/NOTIFY
+
+Курсор - "<xid>.<id>" последнего отданного события. Отдаются только события транзакций
+старше pg_snapshot_xmin: более ранний id ещё открытой транзакции иначе оказался бы за курсором.
+Открытая транзакция задерживает доставку до своего завершения, но не теряет событий.
+"""
+import json
+import os
+import select
+import time
+
+CHANNEL = 'user_events'
+MAX_NOTIFY_PAYLOAD = 7000
+MAX_WAIT_SECONDS = float(os.environ.get('LONG_POLL_MAX_SECONDS', '25'))
+HELD_BACK_RECHECK_SECONDS = 1.0
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+RETENTION_DAYS = int(os.environ.get('USER_EVENTS_RETENTION_DAYS', '7'))
+
+PUBLISH_QUERY = """
+    WITH ev AS (
+        INSERT INTO user_events (user_id, event_type, chat_id, payload)
+        SELECT r.user_id, %(event_type)s, %(chat_id)s, %(payload)s::jsonb
+        FROM ({recipients}) r
+        RETURNING user_id
+    )
+    SELECT string_agg(DISTINCT user_id::text, ',') AS user_ids FROM ev
+"""
+
+CHAT_RECIPIENTS = "SELECT user_id FROM chat_participants WHERE chat_id = %(chat_id)s AND user_id != ALL(%(exclude)s)"
+USER_RECIPIENTS = "SELECT unnest(%(user_ids)s::int[]) AS user_id"
+CONTACT_RECIPIENTS = """
+    SELECT DISTINCT other.user_id
+    FROM chat_participants mine
+    JOIN chat_participants other ON other.chat_id = mine.chat_id
+    WHERE mine.user_id = %(user_id)s AND other.user_id != %(user_id)s
+"""
+
+FETCH_QUERY = """
+    SELECT id, xid::text AS xid, event_type AS type, chat_id, payload, created_at
+    FROM user_events
+    WHERE user_id = %(user_id)s
+      AND (xid, id) > (%(xid)s::xid8, %(id)s)
+      AND xid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY xid, id
+    LIMIT %(limit)s
+"""
+
+LATEST_QUERY = """
+    SELECT xid::text AS xid, id
+    FROM user_events
+    WHERE user_id = %s AND xid < pg_snapshot_xmin(pg_current_snapshot())
+    ORDER BY xid DESC, id DESC
+    LIMIT 1
+"""
+
+
+def _publish(cursor, recipients: str, params: dict):
+    cursor.execute(PUBLISH_QUERY.format(recipients=recipients), params)
+    row = cursor.fetchone()
+    user_ids = row['user_ids'] if row else None
+    if user_ids:
+        # Уведомление доставляется слушателям только после COMMIT
+        payload = user_ids if len(user_ids) <= MAX_NOTIFY_PAYLOAD else '*'
+        cursor.execute('SELECT pg_notify(%s, %s)', (CHANNEL, payload))
+
+
+def publish_to_chat(cursor, chat_id, event_type: str, payload: dict, exclude=()):
+    """Пишет событие всем участникам чата (кроме exclude) в текущей транзакции"""
+    _publish(cursor, CHAT_RECIPIENTS, {
+        'chat_id': chat_id,
+        'event_type': event_type,
+        'payload': json.dumps(payload, default=str),
+        'exclude': [int(u) for u in exclude],
+    })
+
+
+def publish_to_users(cursor, user_ids, event_type: str, payload: dict, chat_id=None):
+    """Пишет событие перечисленным пользователям в текущей транзакции"""
+    _publish(cursor, USER_RECIPIENTS, {
+        'user_ids': [int(u) for u in user_ids],
+        'chat_id': chat_id,
+        'event_type': event_type,
+        'payload': json.dumps(payload, default=str),
+    })
+
+
+def publish_to_contacts(cursor, user_id, event_type: str, payload: dict):
+    """Пишет событие всем собеседникам пользователя по общим чатам в текущей транзакции"""
+    _publish(cursor, CONTACT_RECIPIENTS, {
+        'user_id': int(user_id),
+        'chat_id': None,
+        'event_type': event_type,
+        'payload': json.dumps(payload, default=str),
+    })
+
+
+def latest_cursor(cursor, user_id) -> str:
+    cursor.execute(LATEST_QUERY, (user_id,))
+    row = cursor.fetchone()
+    return f"{row['xid']}.{row['id']}" if row else '0.0'
+
+
+def parse_cursor(cursor, user_id, since: str) -> tuple:
+    """(xid, id) из курсора; ValueError при неверном формате"""
+    if '.' in since:
+        xid, event_id = (int(part) for part in since.split('.'))
+        if xid < 0:
+            raise ValueError('xid не может быть отрицательным')
+        return xid, event_id
+    # Курсор из одного id выдавался до V0020: продолжаем с xid этого события
+    event_id = int(since)
+    cursor.execute('SELECT xid::text AS xid FROM user_events WHERE id = %s', (event_id,))
+    row = cursor.fetchone()
+    return parse_cursor(cursor, user_id, f"{row['xid']}.{event_id}" if row else latest_cursor(cursor, user_id))
+
+
+def fetch_events(cursor, user_id, since: tuple, limit: int) -> tuple:
+    """(события после since, курсор после них)"""
+    cursor.execute(FETCH_QUERY, {'user_id': user_id, 'xid': str(since[0]), 'id': since[1], 'limit': limit})
+    events = [dict(r) for r in cursor.fetchall()]
+    next_cursor = f"{events[-1]['xid']}.{events[-1]['id']}" if events else f'{since[0]}.{since[1]}'
+    for event in events:
+        del event['xid']
+    return events, next_cursor
+
+
+def _wait_for_notify(conn, user_id, timeout: float) -> bool:
+    """Ждёт NOTIFY для пользователя не дольше timeout секунд"""
+    user_key = str(user_id)
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        if select.select([conn], [], [], remaining) == ([], [], []):
+            return False
+        conn.poll()
+        notifies = list(conn.notifies)
+        conn.notifies.clear()
+        for notify in notifies:
+            if notify.payload == '*' or user_key in notify.payload.split(','):
+                return True
+
+
+def get_updates(conn, cursor, user_id, since=None, timeout=0, limit=DEFAULT_LIMIT):
+    """Возвращает (события после since, новый курсор), при необходимости ожидая их до timeout секунд"""
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    timeout = max(0.0, min(float(timeout), MAX_WAIT_SECONDS))
+
+    if since is None:
+        return [], latest_cursor(cursor, user_id)
+    since = parse_cursor(cursor, user_id, str(since))
+
+    events, next_cursor = fetch_events(cursor, user_id, since, limit)
+    if events or timeout == 0:
+        return events, next_cursor
+
+    conn.commit()
+    conn.autocommit = True
+    deadline = time.monotonic() + timeout
+    held_back = False
+    try:
+        # LISTEN до повторной выборки, чтобы не пропустить событие между ними
+        cursor.execute(f'LISTEN {CHANNEL}')
+        events, next_cursor = fetch_events(cursor, user_id, since, limit)
+        while not events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if held_back:
+                # Событие зафиксировано, но ждёт завершения более ранних транзакций - NOTIFY о нём уже был
+                _wait_for_notify(conn, user_id, min(remaining, HELD_BACK_RECHECK_SECONDS))
+            elif not _wait_for_notify(conn, user_id, remaining):
+                break
+            events, next_cursor = fetch_events(cursor, user_id, since, limit)
+            held_back = True
+    finally:
+        cursor.execute(f'UNLISTEN {CHANNEL}')
+        conn.autocommit = False
+
+    return events, next_cursor
+
+
+def prune_events(cursor, batch_size: int = 10000) -> int:
+    """Удаляет события старше RETENTION_DAYS порциями, чтобы не держать долгих блокировок"""
+    cursor.execute(
+        """DELETE FROM user_events WHERE id IN (
+               SELECT id FROM user_events
+               WHERE created_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+               LIMIT %s
+           )""",
+        (RETENTION_DAYS, batch_size)
+    )
+    return cursor.rowcount
@@ -0,0 +1,93 @@
+"""История сообщений чата с курсорной (keyset) пагинацией по id
+
+Курсор - "id:epoch", где epoch - created_at сообщения в секундах. По нему запрос получает
+границу created_at, и Postgres отбрасывает месячные секции messages ещё при планировании.
+Старые курсоры из одного id принимаются и просматривают все секции.
+"""
+from datetime import datetime, timedelta
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# id выдаются внутри транзакции, а created_at - время её начала, поэтому порядок id и created_at
+# может расходиться на длительность транзакции отправки; граница секций берётся с запасом
+CURSOR_SLACK = timedelta(minutes=5)
+EPOCH = datetime(1970, 1, 1)
+
+MESSAGE_PAGE_QUERY = """
+    SELECT m.id, m.chat_id, m.sender_id, m.content, m.message_type, m.file_url, m.file_name,
+           m.file_size, m.duration, m.created_at, m.reply_to_id, m.client_msg_id,
+           u.name as sender_name, u.avatar_url as sender_avatar,
+           EXISTS (
+               SELECT 1 FROM chat_participants p
+               WHERE p.chat_id = m.chat_id AND p.user_id != m.sender_id AND p.read_receipt_message_id >= m.id
+           ) as is_read
+    FROM messages m
+    JOIN users u ON m.sender_id = u.id
+    WHERE m.chat_id = %(chat_id)s {cursor_condition}
+    ORDER BY m.id {direction}
+    LIMIT %(limit)s
+"""
+
+BEFORE_CONDITION = 'AND m.id < %(cursor_id)s'
+AFTER_CONDITION = 'AND m.id > %(cursor_id)s'
+BEFORE_TIME_CONDITION = 'AND m.created_at < %(cursor_ts)s'
+AFTER_TIME_CONDITION = 'AND m.created_at > %(cursor_ts)s'
+
+
+def encode_cursor(message: dict) -> str:
+    if message['created_at'] is None:
+        return str(message['id'])
+    return f"{message['id']}:{int((message['created_at'] - EPOCH).total_seconds())}"
+
+
+def decode_cursor(cursor: str):
+    """(id, created_at или None для старого курсора из одного id); ValueError при неверном формате"""
+    message_id, _, epoch = str(cursor).partition(':')
+    return int(message_id), EPOCH + timedelta(seconds=int(epoch)) if epoch else None
+
+
+def fetch_message_page(cursor, chat_id, limit=DEFAULT_LIMIT, before_id=None, after_id=None):
+    """Возвращает (сообщения по возрастанию id, next_cursor, prev_cursor)
+
+    next_cursor передаётся как before_id для более старых сообщений,
+    prev_cursor - как after_id для более новых.
+    """
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    before = decode_cursor(before_id) if before_id else None
+    after = decode_cursor(after_id) if after_id else None
+
+    cursor_ts = None
+    if after is not None:
+        (cursor_id, created_at), direction = after, 'ASC'
+        condition = AFTER_CONDITION
+        if created_at is not None:
+            condition, cursor_ts = f'{condition} {AFTER_TIME_CONDITION}', created_at - CURSOR_SLACK
+    elif before is not None:
+        (cursor_id, created_at), direction = before, 'DESC'
+        condition = BEFORE_CONDITION
+        if created_at is not None:
+            # epoch округлён вниз до секунды, запас покрывает и это
+            condition, cursor_ts = f'{condition} {BEFORE_TIME_CONDITION}', created_at + CURSOR_SLACK
+    else:
+        condition, direction, cursor_id = '', 'DESC', None
+
+    cursor.execute(
+        MESSAGE_PAGE_QUERY.format(cursor_condition=condition, direction=direction),
+        {'chat_id': chat_id, 'cursor_id': cursor_id, 'cursor_ts': cursor_ts, 'limit': limit + 1}
+    )
+    rows = [dict(r) for r in cursor.fetchall()]
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == 'DESC':
+        rows.reverse()
+
+    if not rows:
+        if before is not None:
+            return [], None, None
+        return [], None, str(after_id) if after is not None else '0'
+
+    oldest, newest = encode_cursor(rows[0]), encode_cursor(rows[-1])
+    if direction == 'ASC':
+        return rows, oldest, newest
+    return rows, oldest if has_more else None, newest
@@ -1,265 +1,301 @@
-import json
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from core import dispatch, HttpError
+from chat_list import fetch_chat_page, DEFAULT_LIMIT as CHATS_DEFAULT_LIMIT
+from history import fetch_message_page, DEFAULT_LIMIT as MESSAGES_DEFAULT_LIMIT
+from receipts import mark_read
+from events import publish_to_chat, publish_to_users, get_updates, prune_events, DEFAULT_LIMIT as EVENTS_DEFAULT_LIMIT
+from send import send_messages, MAX_BATCH_SIZE, NOT_ALLOWED_ERROR
+from chats import create_chat, set_muted, is_participant
+from contacts import fetch_contacts, DEFAULT_LIMIT as CONTACTS_DEFAULT_LIMIT
+from search import search_messages, DEFAULT_LIMIT as SEARCH_DEFAULT_LIMIT
+from presence import heartbeat, go_offline, fetch_presence
+from partitions import ensure_partitions
+from auth_token import authorize, authorize_service, AuthError
+
+# Обслуживание по расписанию: вызывается таймером со служебным ключом, не пользователями
+SERVICE_ACTIONS = ('prune_events', 'maintain_partitions')
+
+
+def authorize_request(request):
+    if request.action in SERVICE_ACTIONS:
+        authorize_service(request.event)
+        return
+    source = request.body if request.method == 'POST' else request.params
+    request.auth_user_id = authorize(request.event, None, request.cursor)
+    if request.auth_user_id is None:
+        return
+    # Отправитель проверяется так же, как user_id: иначе user_id=свой, sender_id=чужой проходил бы
+    for key in ('user_id', 'sender_id'):
+        if source.get(key) not in (None, '') and str(source[key]) != str(request.auth_user_id):
+            raise AuthError('Токен принадлежит другому пользователю', 403)
+
+
+def send_message(request):
+    sent, errors = send_messages(request.cursor, [request.body])
+
+    if errors:
+        raise HttpError(403 if errors[0]['error'] == NOT_ALLOWED_ERROR else 400, errors[0]['error'])
+
+    request.conn.commit()
+
+    result = sent[0]
+    result.pop('index')
+    return {'message': result}
+
+
+def send_batch(request):
+    body = request.body
+    items = body.get('messages')
+
+    if not isinstance(items, list) or not items or len(items) > MAX_BATCH_SIZE:
+        raise HttpError(400, f'messages должен быть непустым списком до {MAX_BATCH_SIZE} элементов')
+
+    defaults = {key: body[key] for key in ('chat_id', 'sender_id') if key in body}
+    batch = [{**defaults, **item} if isinstance(item, dict) else item for item in items]
+    if request.auth_user_id is not None and any(
+        isinstance(item, dict) and str(item.get('sender_id')) != str(request.auth_user_id) for item in batch
+    ):
+        raise AuthError('Токен принадлежит другому пользователю', 403)
+    sent, errors = send_messages(request.cursor, batch)
+    request.conn.commit()
+
+    return {'messages': sent, 'errors': errors}
+
+
+def new_chat(request):
+    body = request.body
+    user_id = body.get('user_id')
+    participant_ids = body.get('participant_ids', [])
+
+    if not user_id or not participant_ids:
+        raise HttpError(400, 'user_id и participant_ids обязательны')
+
+    try:
+        chat_id, created = create_chat(
+            request.cursor, user_id, participant_ids, body.get('is_group', False), body.get('name')
+        )
+    except (TypeError, ValueError):
+        raise HttpError(400, 'user_id и participant_ids должны быть числами')
+
+    request.conn.commit()
+    return {'chat_id': chat_id, 'created': created}
+
+
+def read_chat(request):
+    chat_id = request.body.get('chat_id')
+    user_id = request.body.get('user_id')
+
+    if not chat_id or not user_id:
+        raise HttpError(400, 'chat_id и user_id обязательны')
+
+    cursor = request.cursor
+    try:
+        receipt = mark_read(cursor, chat_id, user_id, request.body.get('message_id'))
+    except (TypeError, ValueError):
+        raise HttpError(400, 'chat_id, user_id и message_id должны быть числами')
+
+    if not receipt:
+        raise HttpError(404, 'Пользователь не состоит в чате')
+
+    publish_to_users(cursor, [user_id], 'read', {
+        'chat_id': receipt['chat_id'],
+        'last_read_message_id': receipt['last_read_message_id'],
+        'unread_count': receipt['unread_count']
+    }, chat_id=receipt['chat_id'])
+    if receipt['read_receipt_message_id'] == receipt['last_read_message_id']:
+        publish_to_chat(cursor, chat_id, 'read_receipt', {
+            'chat_id': receipt['chat_id'],
+            'user_id': receipt['user_id'],
+            'message_id': receipt['read_receipt_message_id']
+        }, exclude=[user_id])
+    request.conn.commit()
+
+    return {
+        'chat_id': receipt['chat_id'],
+        'last_read_message_id': receipt['last_read_message_id'],
+        'unread_count': receipt['unread_count']
+    }
+
+
+def mute_chat(request):
+    chat_id = request.body.get('chat_id')
+    user_id = request.body.get('user_id')
+
+    if not chat_id or not user_id:
+        raise HttpError(400, 'chat_id и user_id обязательны')
+
+    try:
+        participant = set_muted(request.cursor, chat_id, user_id, request.body.get('muted', True))
+    except (TypeError, ValueError):
+        raise HttpError(400, 'chat_id и user_id должны быть числами')
+
+    if not participant:
+        raise HttpError(404, 'Пользователь не состоит в чате')
+    request.conn.commit()
+    return participant
+
+
+def presence_action(update):
+    def action(request):
+        try:
+            presence = update(request.cursor, request.body.get('user_id'))
+        except (TypeError, ValueError):
+            raise HttpError(400, 'user_id обязателен и должен быть числом')
+        request.conn.commit()
+        return presence
+    return action
+
+
+def prune(request):
+    deleted = prune_events(request.cursor)
+    request.conn.commit()
+    return {'deleted': deleted}
+
+
+def maintain_partitions(request):
+    created = ensure_partitions(request.cursor)
+    request.conn.commit()
+    return {'created_partitions': created}
+
+
+def get_chats(request):
+    params = request.params
+    user_id = params.get('user_id')
+
+    if not user_id:
+        raise HttpError(400, 'user_id обязателен')
+
+    try:
+        chats, next_cursor = fetch_chat_page(
+            request.cursor,
+            user_id,
+            limit=params.get('limit', CHATS_DEFAULT_LIMIT),
+            after=params.get('cursor')
+        )
+    except ValueError:
+        raise HttpError(400, 'Неверный cursor или limit')
+
+    return {'chats': chats, 'next_cursor': next_cursor}
+
+
+def get_messages(request):
+    params = request.params
+    chat_id = params.get('chat_id')
+
+    if not chat_id:
+        raise HttpError(400, 'chat_id обязателен')
+
+    try:
+        # Историю читает только участник чата; без токена (AUTH_ENFORCE выключен) проверять некого
+        if request.auth_user_id is not None and not is_participant(request.cursor, chat_id, request.auth_user_id):
+            raise HttpError(403, 'Пользователь не состоит в чате')
+        messages, next_cursor, prev_cursor = fetch_message_page(
+            request.cursor,
+            chat_id,
+            limit=params.get('limit', MESSAGES_DEFAULT_LIMIT),
+            before_id=params.get('before_id'),
+            after_id=params.get('after_id')
+        )
+    except ValueError:
+        raise HttpError(400, 'Неверный before_id, after_id или limit')
+
+    return {'messages': messages, 'next_cursor': next_cursor, 'prev_cursor': prev_cursor}
+
+
+def updates(request):
+    params = request.params
+    user_id = params.get('user_id')
+
+    if not user_id:
+        raise HttpError(400, 'user_id обязателен')
+
+    try:
+        events, next_cursor = get_updates(
+            request.conn,
+            request.cursor,
+            user_id,
+            since=params.get('since'),
+            timeout=params.get('timeout', 0),
+            limit=params.get('limit', EVENTS_DEFAULT_LIMIT)
+        )
+    except ValueError:
+        raise HttpError(400, 'Неверный since, timeout или limit')
+
+    return {'events': events, 'cursor': next_cursor}
+
+
+def search(request):
+    params = request.params
+    user_id = params.get('user_id')
+    q = params.get('q')
+
+    if not user_id or not q:
+        raise HttpError(400, 'user_id и q обязательны')
+
+    try:
+        results, next_cursor = search_messages(
+            request.cursor,
+            user_id,
+            q,
+            chat_id=params.get('chat_id'),
+            limit=params.get('limit', SEARCH_DEFAULT_LIMIT),
+            after=params.get('cursor')
+        )
+    except ValueError:
+        raise HttpError(400, 'Неверный q, chat_id, cursor или limit')
+
+    return {'results': results, 'next_cursor': next_cursor}
+
+
+def get_contacts(request):
+    params = request.params
+    user_id = params.get('user_id')
+
+    if not user_id:
+        raise HttpError(400, 'user_id обязателен')
+
+    try:
+        contacts, next_cursor = fetch_contacts(
+            request.cursor,
+            user_id,
+            q=params.get('q'),
+            limit=params.get('limit', CONTACTS_DEFAULT_LIMIT),
+            after=params.get('cursor'),
+            mode=params.get('mode', 'all')
+        )
+    except ValueError:
+        raise HttpError(400, 'Неверный cursor, limit или mode')
+
+    return {'contacts': contacts, 'next_cursor': next_cursor}
+
+
+def get_presence(request):
+    try:
+        presence = fetch_presence(request.cursor, (request.params.get('user_ids') or '').split(','))
+    except ValueError:
+        raise HttpError(400, 'user_ids: список чисел через запятую, не больше 500')
+
+    return {'presence': presence}
+
+
+ROUTES = {
+    ('POST', 'send_message'): send_message,
+    ('POST', 'send_messages'): send_batch,
+    ('POST', 'create_chat'): new_chat,
+    ('POST', 'mark_read'): read_chat,
+    ('POST', 'mute_chat'): mute_chat,
+    ('POST', 'heartbeat'): presence_action(heartbeat),
+    ('POST', 'offline'): presence_action(go_offline),
+    ('POST', 'prune_events'): prune,
+    ('POST', 'maintain_partitions'): maintain_partitions,
+    ('GET', 'get_chats'): get_chats,
+    ('GET', 'get_messages'): get_messages,
+    ('GET', 'get_updates'): updates,
+    ('GET', 'search_messages'): search,
+    ('GET', 'get_contacts'): get_contacts,
+    ('GET', 'get_presence'): get_presence,
+}
+
 
 def handler(event: dict, context) -> dict:
     """API для работы с сообщениями, чатами и контактами"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'send_message':
-                chat_id = body.get('chat_id')
-                sender_id = body.get('sender_id')
-                content = body.get('content', '')
-                message_type = body.get('message_type', 'text')
-                file_url = body.get('file_url')
-                file_name = body.get('file_name')
-                file_size = body.get('file_size')
-                duration = body.get('duration')
-                reply_to_id = body.get('reply_to_id')
-                
-                if not chat_id or not sender_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'chat_id и sender_id обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    """INSERT INTO messages (chat_id, sender_id, content, message_type, file_url, file_name, file_size, duration, reply_to_id)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-                       RETURNING id, chat_id, sender_id, content, message_type, file_url, file_name, file_size, duration, created_at, is_read, reply_to_id""",
-                    (chat_id, sender_id, content, message_type, file_url, file_name, file_size, duration, reply_to_id)
-                )
-                message = cursor.fetchone()
-                
-                cursor.execute("UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = %s", (chat_id,))
-                conn.commit()
-                
-                cursor.execute("SELECT name, avatar_url FROM users WHERE id = %s", (sender_id,))
-                sender = cursor.fetchone()
-                
-                result = dict(message)
-                if sender:
-                    result['sender_name'] = sender['name']
-                    result['sender_avatar'] = sender['avatar_url']
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'message': result}, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'create_chat':
-                user_id = body.get('user_id')
-                participant_ids = body.get('participant_ids', [])
-                is_group = body.get('is_group', False)
-                name = body.get('name')
-                
-                if not user_id or not participant_ids:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'user_id и participant_ids обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                if not is_group and len(participant_ids) == 1:
-                    cursor.execute(
-                        """SELECT c.id FROM chats c
-                           JOIN chat_participants cp1 ON c.id = cp1.chat_id AND cp1.user_id = %s
-                           JOIN chat_participants cp2 ON c.id = cp2.chat_id AND cp2.user_id = %s
-                           WHERE c.is_group = FALSE
-                           GROUP BY c.id
-                           HAVING COUNT(DISTINCT cp1.user_id) = 2""",
-                        (user_id, participant_ids[0])
-                    )
-                    existing_chat = cursor.fetchone()
-                    
-                    if existing_chat:
-                        return {
-                            'statusCode': 200,
-                            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                            'body': json.dumps({'chat_id': existing_chat['id']}),
-                            'isBase64Encoded': False
-                        }
-                
-                cursor.execute(
-                    "INSERT INTO chats (name, is_group) VALUES (%s, %s) RETURNING id",
-                    (name, is_group)
-                )
-                chat = cursor.fetchone()
-                chat_id = chat['id']
-                
-                all_participants = [user_id] + participant_ids
-                for idx, pid in enumerate(all_participants):
-                    cursor.execute(
-                        "INSERT INTO chat_participants (chat_id, user_id, is_admin) VALUES (%s, %s, %s)",
-                        (chat_id, pid, idx == 0)
-                    )
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'chat_id': chat_id}),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'GET':
-            params = event.get('queryStringParameters', {})
-            action = params.get('action')
-            
-            if action == 'get_chats':
-                user_id = params.get('user_id')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'user_id обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    """SELECT c.id, c.name, c.is_group, c.avatar_url, c.updated_at,
-                              (SELECT content FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
-                              (SELECT created_at FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message_time,
-                              (SELECT COUNT(*) FROM messages WHERE chat_id = c.id AND is_read = FALSE AND sender_id != %s) as unread_count,
-                              (SELECT COUNT(*) FROM chat_participants WHERE chat_id = c.id) as participants_count
-                       FROM chats c
-                       JOIN chat_participants cp ON c.id = cp.chat_id
-                       WHERE cp.user_id = %s
-                       ORDER BY c.updated_at DESC""",
-                    (user_id, user_id)
-                )
-                chats = cursor.fetchall()
-                
-                result = []
-                for chat in chats:
-                    chat_dict = dict(chat)
-                    
-                    if not chat_dict['is_group']:
-                        cursor.execute(
-                            """SELECT u.id, u.name, u.avatar_url, u.is_online
-                               FROM users u
-                               JOIN chat_participants cp ON u.id = cp.user_id
-                               WHERE cp.chat_id = %s AND u.id != %s
-                               LIMIT 1""",
-                            (chat_dict['id'], user_id)
-                        )
-                        other_user = cursor.fetchone()
-                        if other_user:
-                            chat_dict['name'] = other_user['name']
-                            chat_dict['avatar_url'] = other_user['avatar_url']
-                            chat_dict['is_online'] = other_user['is_online']
-                    
-                    result.append(chat_dict)
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'chats': result}, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'get_messages':
-                chat_id = params.get('chat_id')
-                limit = int(params.get('limit', 50))
-                offset = int(params.get('offset', 0))
-                
-                if not chat_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'chat_id обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    """SELECT m.*, u.name as sender_name, u.avatar_url as sender_avatar
-                       FROM messages m
-                       JOIN users u ON m.sender_id = u.id
-                       WHERE m.chat_id = %s
-                       ORDER BY m.created_at DESC
-                       LIMIT %s OFFSET %s""",
-                    (chat_id, limit, offset)
-                )
-                messages = cursor.fetchall()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'messages': [dict(m) for m in reversed(messages)]}, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'get_contacts':
-                user_id = params.get('user_id')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'user_id обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    """SELECT DISTINCT u.id, u.name, u.phone, u.avatar_url, u.is_online, u.last_seen
-                       FROM users u
-                       WHERE u.id != %s
-                       ORDER BY u.name""",
-                    (user_id,)
-                )
-                contacts = cursor.fetchall()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'contacts': [dict(c) for c in contacts]}, default=str),
-                    'isBase64Encoded': False
-                }
-        
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный запрос'}),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+    return dispatch(event, ROUTES, before=authorize_request)
@@ -0,0 +1,218 @@
+"""Помесячные секции messages: создание вперёд, перенос из старой таблицы и архив старых секций в S3
+
+Запуск: DATABASE_URL=... python partitions.py                    # секции на MESSAGES_PARTITIONS_AHEAD месяцев вперёд
+        DATABASE_URL=... python partitions.py --migrate          # перенести историю и поменять таблицы местами
+        DATABASE_URL=... python partitions.py --archive-months 24 [--dry-run]
+
+Секции вперёд создаёт и действие maintain_partitions (POST по расписанию, только с X-Service-Key).
+--migrate запускается после выкладки кода, который пишет client_msg_id в message_client_ids
+(до замены таблиц их за старый код заносит триггер V0018):
+пачки копируются из старой таблицы без долгих блокировок, затем таблицы меняются местами,
+прежняя остаётся как messages_legacy и удаляется вручную после проверки.
+--archive-months выгружает секции старше N месяцев в S3 (CSV в gzip) и удаляет их из базы;
+для него нужен boto3 и те же AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY, что у функции upload.
+"""
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import time
+from datetime import date
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+MONTHS_AHEAD = int(os.environ.get('MESSAGES_PARTITIONS_AHEAD', '3'))
+ARCHIVE_BUCKET = os.environ.get('MESSAGES_ARCHIVE_BUCKET', 'files')
+ARCHIVE_PREFIX = 'archive/messages'
+DEFAULT_ENDPOINT_URL = 'https://bucket.poehali.dev'
+SPOOL_BYTES = 64 * 1024 * 1024
+
+ARCHIVE_COLUMNS = ('id', 'chat_id', 'sender_id', 'content', 'message_type', 'file_url', 'file_name',
+                   'file_size', 'duration', 'created_at', 'is_read', 'reply_to_id', 'client_msg_id')
+
+# До замены таблиц секционирована messages_partitioned, после - сама messages
+ENSURE_QUERY = """
+    SELECT ensure_message_partitions(
+        COALESCE(to_regclass('messages_partitioned'), 'messages'::regclass), CURRENT_DATE, %s
+    ) AS created
+"""
+
+COPY_BATCH_QUERY = """
+    WITH state AS (
+        SELECT copied_through, LEAST(copied_through + %(batch)s, target_id) AS upto
+        FROM message_partition_migration
+        WHERE swapped_at IS NULL AND copied_through < target_id
+        FOR UPDATE
+    ), source AS (
+        SELECT m.* FROM messages m, state
+        WHERE m.id > state.copied_through AND m.id <= state.upto
+    ), copied AS (
+        INSERT INTO messages_partitioned (id, chat_id, sender_id, content, message_type, file_url, file_name,
+                                          file_size, duration, created_at, is_read, reply_to_id, client_msg_id)
+        SELECT id, chat_id, sender_id, content, message_type, file_url, file_name,
+               file_size, duration, COALESCE(created_at, TIMESTAMP 'epoch'), is_read, reply_to_id, client_msg_id
+        FROM source
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    UPDATE message_partition_migration s
+    SET copied_through = state.upto
+    FROM state
+    RETURNING s.copied_through, s.target_id, (SELECT COUNT(*) FROM copied) AS copied
+"""
+
+# Секции messages_pYYYY_MM, целиком лежащие раньше первого месяца, который нужно оставить
+ARCHIVABLE_QUERY = """
+    SELECT c.relname AS name
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'messages'::regclass
+      AND c.relname ~ '^messages_p[0-9]{4}_[0-9]{2}$'
+      AND to_date(substr(c.relname, 11), 'YYYY_MM')
+          < date_trunc('month', CURRENT_DATE) - make_interval(months => %s)
+    ORDER BY c.relname
+"""
+
+
+def ensure_partitions(cursor, months_ahead: int = MONTHS_AHEAD) -> int:
+    """Создаёт недостающие секции до текущего месяца + months_ahead; возвращает число созданных"""
+    cursor.execute(ENSURE_QUERY, (months_ahead,))
+    return cursor.fetchone()['created']
+
+
+def copy_batch(cursor, batch_size: int):
+    """Переносит следующую пачку старой таблицы; None, если переносить нечего"""
+    cursor.execute(COPY_BATCH_QUERY, {'batch': batch_size})
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+def swap(cursor) -> bool:
+    """Меняет messages и messages_partitioned местами; False, если это уже сделано"""
+    cursor.execute('SELECT swap_messages_partitioned() AS swapped')
+    return cursor.fetchone()['swapped']
+
+
+def migrate(conn, cursor, batch_size: int = 20000, pause: float = 0.0):
+    """Переносит историю пачками с фиксацией после каждой и меняет таблицы местами"""
+    cursor.execute('SELECT swapped_at FROM message_partition_migration')
+    state = cursor.fetchone()
+    conn.commit()
+    if state is None or state['swapped_at'] is not None:
+        return False
+
+    while True:
+        progress = copy_batch(cursor, batch_size)
+        conn.commit()
+        if progress is None:
+            break
+        print(json.dumps(progress), flush=True)
+        if pause:
+            time.sleep(pause)
+    swapped = swap(cursor)
+    conn.commit()
+    return swapped
+
+
+def partition_range(name: str) -> tuple:
+    """[начало, конец) месяца секции messages_pYYYY_MM"""
+    year, month = int(name[10:14]), int(name[15:17])
+    return date(year, month, 1), date(year + month // 12, month % 12 + 1, 1)
+
+
+def s3_client():
+    import boto3
+
+    return boto3.session.Session(
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+    ).client('s3', endpoint_url=os.environ.get('S3_ENDPOINT_URL', DEFAULT_ENDPOINT_URL))
+
+
+def archive_partition(conn, cursor, s3, name: str) -> dict:
+    """Выгружает секцию в S3 как CSV в gzip, затем отсоединяет и удаляет её
+
+    Секция удаляется только после того, как объект в S3 совпал по размеру с выгрузкой.
+    В старые месяцы ничего не пишется, поэтому выгрузка и удаление не расходятся.
+    """
+    start, end = partition_range(name)
+    key = f'{ARCHIVE_PREFIX}/{name}.csv.gz'
+    cursor.execute(f'SELECT COUNT(*) AS cnt FROM {name}')
+    row_count = cursor.fetchone()['cnt']
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as spool:
+        with gzip.GzipFile(fileobj=spool, mode='wb') as gz:
+            cursor.copy_expert(
+                f"COPY (SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {name} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)",
+                gz
+            )
+        size = spool.tell()
+        spool.seek(0)
+        s3.upload_fileobj(spool, ARCHIVE_BUCKET, key, ExtraArgs={
+            'ContentType': 'text/csv',
+            'ContentEncoding': 'gzip',
+            'Metadata': {'rows': str(row_count), 'range': f'{start.isoformat()}/{end.isoformat()}'},
+        })
+    conn.commit()
+
+    if s3.head_object(Bucket=ARCHIVE_BUCKET, Key=key)['ContentLength'] != size:
+        raise RuntimeError(f'Архив {key} в S3 не совпал по размеру с выгрузкой, секция {name} не удалена')
+
+    cursor.execute(f'ALTER TABLE messages DETACH PARTITION {name}')
+    cursor.execute(f'DROP TABLE {name}')
+    cursor.execute(
+        'DELETE FROM message_client_ids WHERE message_created_at >= %s AND message_created_at < %s',
+        (start, end)
+    )
+    cursor.execute(
+        """INSERT INTO message_archives (partition_name, range_start, range_end, object_key, row_count, size_bytes)
+           VALUES (%s, %s, %s, %s, %s, %s)""",
+        (name, start, end, key, row_count, size)
+    )
+    conn.commit()
+    return {'partition': name, 'key': key, 'rows': row_count, 'size_bytes': size}
+
+
+def archive(conn, cursor, older_than_months: int, dry_run: bool = False) -> list:
+    """Архивирует секции старше older_than_months полных месяцев, по одной за транзакцию"""
+    cursor.execute(ARCHIVABLE_QUERY, (older_than_months,))
+    names = [r['name'] for r in cursor.fetchall()]
+    conn.commit()
+    if dry_run:
+        return [{'partition': name, 'dry_run': True} for name in names]
+
+    s3 = s3_client()
+    return [archive_partition(conn, cursor, s3, name) for name in names]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD)
+    parser.add_argument('--migrate', action='store_true', help='перенести старую таблицу и поменять местами')
+    parser.add_argument('--batch', type=int, default=20000)
+    parser.add_argument('--pause', type=float, default=0.0, help='пауза между пачками, секунды')
+    parser.add_argument('--archive-months', type=int, default=None, help='архивировать секции старше N месяцев')
+    parser.add_argument('--dry-run', action='store_true', help='только показать секции для архивации')
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        created = ensure_partitions(cursor, args.months_ahead)
+        conn.commit()
+        print(json.dumps({'created_partitions': created}))
+
+        if args.migrate:
+            print(json.dumps({'swapped': migrate(conn, cursor, args.batch, args.pause)}))
+
+        if args.archive_months is not None:
+            for result in archive(conn, cursor, args.archive_months, args.dry_run):
+                print(json.dumps(result))
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Присутствие: heartbeat в UNLOGGED-таблицу user_presence со схлопыванием частых записей
+
+Пользователь в сети, пока online_until в будущем: каждый heartbeat продлевает его на
+PRESENCE_TTL_SECONDS, offline обнуляет сразу. Повторные heartbeat одного пользователя
+в пределах HEARTBEAT_COALESCE_SECONDS не доходят до БД - TTL всё равно покрывает этот интервал.
+Скрытый статус (user_settings.show_online_status = FALSE) отдаётся как не в сети без last_seen.
+"""
+import os
+import threading
+import time
+from events import publish_to_contacts
+
+PRESENCE_TTL_SECONDS = int(os.environ.get('PRESENCE_TTL_SECONDS', '70'))
+HEARTBEAT_COALESCE_SECONDS = float(os.environ.get('HEARTBEAT_COALESCE_SECONDS', '25'))
+MAX_CACHED_USERS = 50000
+MAX_BATCH_SIZE = 500
+
+# Фрагменты для запросов, которым нужен статус пользователя u: get_chats, get_contacts
+PRESENCE_JOIN = """
+    LEFT JOIN user_presence pr ON pr.user_id = u.id
+    LEFT JOIN user_settings prs ON prs.user_id = u.id
+"""
+IS_ONLINE_SQL = "COALESCE(COALESCE(prs.show_online_status, TRUE) AND pr.online_until > CURRENT_TIMESTAMP, FALSE)"
+LAST_SEEN_SQL = "CASE WHEN COALESCE(prs.show_online_status, TRUE) THEN COALESCE(pr.last_seen, u.last_seen) END"
+
+HEARTBEAT_QUERY = """
+    WITH previous AS (
+        SELECT online_until > CURRENT_TIMESTAMP AS was_online FROM user_presence WHERE user_id = %(user_id)s
+    ), upsert AS (
+        INSERT INTO user_presence (user_id, last_seen, online_until)
+        VALUES (%(user_id)s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + make_interval(secs => %(ttl)s))
+        ON CONFLICT (user_id) DO UPDATE
+        SET last_seen = EXCLUDED.last_seen, online_until = EXCLUDED.online_until
+        RETURNING last_seen
+    )
+    SELECT upsert.last_seen,
+           NOT COALESCE((SELECT was_online FROM previous), FALSE) AS came_online,
+           COALESCE((SELECT show_online_status FROM user_settings WHERE user_id = %(user_id)s), TRUE) AS visible
+    FROM upsert
+"""
+
+OFFLINE_QUERY = """
+    WITH previous AS (
+        SELECT online_until > CURRENT_TIMESTAMP AS was_online FROM user_presence WHERE user_id = %(user_id)s
+    ), upsert AS (
+        INSERT INTO user_presence (user_id, last_seen, online_until)
+        VALUES (%(user_id)s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE
+        SET last_seen = EXCLUDED.last_seen, online_until = EXCLUDED.online_until
+        RETURNING last_seen
+    )
+    SELECT upsert.last_seen,
+           COALESCE((SELECT was_online FROM previous), FALSE) AS went_offline,
+           COALESCE((SELECT show_online_status FROM user_settings WHERE user_id = %(user_id)s), TRUE) AS visible
+    FROM upsert
+"""
+
+PRESENCE_QUERY = """
+    SELECT u.id AS user_id, {is_online} AS is_online, {last_seen} AS last_seen
+    FROM users u
+    {presence_join}
+    WHERE u.id = ANY(%s)
+""".format(is_online=IS_ONLINE_SQL, last_seen=LAST_SEEN_SQL, presence_join=PRESENCE_JOIN)
+
+_last_written = {}
+_lock = threading.Lock()
+
+
+def _should_write(user_id: int) -> bool:
+    now = time.monotonic()
+    with _lock:
+        written = _last_written.get(user_id)
+        if written is not None and now - written < HEARTBEAT_COALESCE_SECONDS:
+            return False
+        if len(_last_written) >= MAX_CACHED_USERS:
+            _last_written.clear()
+        _last_written[user_id] = now
+        return True
+
+
+def _forget(user_id: int):
+    with _lock:
+        _last_written.pop(user_id, None)
+
+
+def heartbeat(cursor, user_id) -> dict:
+    """Продлевает присутствие; при переходе в сеть рассылает событие presence собеседникам"""
+    user_id = int(user_id)
+    if not _should_write(user_id):
+        return {'user_id': user_id, 'is_online': True, 'written': False}
+
+    try:
+        cursor.execute(HEARTBEAT_QUERY, {'user_id': user_id, 'ttl': PRESENCE_TTL_SECONDS})
+        row = cursor.fetchone()
+        if row['came_online'] and row['visible']:
+            publish_to_contacts(cursor, user_id, 'presence', {
+                'user_id': user_id, 'is_online': True, 'last_seen': row['last_seen']
+            })
+    except Exception:
+        # Запись не состоялась: следующий heartbeat должен дойти до БД
+        _forget(user_id)
+        raise
+    return {'user_id': user_id, 'is_online': True, 'written': True, 'last_seen': row['last_seen']}
+
+
+def go_offline(cursor, user_id) -> dict:
+    """Сразу помечает пользователя не в сети и фиксирует last_seen"""
+    user_id = int(user_id)
+    _forget(user_id)
+    cursor.execute(OFFLINE_QUERY, {'user_id': user_id})
+    row = cursor.fetchone()
+    if row['went_offline'] and row['visible']:
+        publish_to_contacts(cursor, user_id, 'presence', {
+            'user_id': user_id, 'is_online': False, 'last_seen': row['last_seen']
+        })
+    return {'user_id': user_id, 'is_online': False, 'last_seen': row['last_seen']}
+
+
+def fetch_presence(cursor, user_ids) -> list:
+    """Статусы пачки пользователей одним запросом с учётом show_online_status"""
+    user_ids = list(dict.fromkeys(int(u) for u in user_ids))
+    if len(user_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'Не больше {MAX_BATCH_SIZE} пользователей за запрос')
+    if not user_ids:
+        return []
+    cursor.execute(PRESENCE_QUERY, (user_ids,))
+    return [dict(r) for r in cursor.fetchall()]
@@ -0,0 +1,42 @@
+"""Отметки прочтения: один UPDATE на участника независимо от числа непрочитанных"""
+
+MARK_READ_QUERY = """
+    WITH target AS (
+        SELECT cp.id,
+               GREATEST(
+                   COALESCE(cp.last_read_message_id, 0),
+                   LEAST(COALESCE(%(message_id)s, c.last_message_id, 0), COALESCE(c.last_message_id, 0))
+               ) AS watermark
+        FROM chat_participants cp
+        JOIN chats c ON c.id = cp.chat_id
+        WHERE cp.chat_id = %(chat_id)s AND cp.user_id = %(user_id)s
+    ), prefs AS (
+        SELECT COALESCE(
+            (SELECT send_read_receipts FROM user_settings WHERE user_id = %(user_id)s), TRUE
+        ) AS send_read_receipts
+    )
+    UPDATE chat_participants cp
+    SET last_read_message_id = t.watermark,
+        unread_count = (
+            SELECT COUNT(*) FROM messages m
+            WHERE m.chat_id = cp.chat_id AND m.id > t.watermark AND m.sender_id != cp.user_id
+        ),
+        read_receipt_message_id = CASE
+            WHEN prefs.send_read_receipts THEN t.watermark
+            ELSE cp.read_receipt_message_id
+        END
+    FROM target t, prefs
+    WHERE cp.id = t.id
+    RETURNING cp.chat_id, cp.user_id, cp.last_read_message_id, cp.unread_count, cp.read_receipt_message_id
+"""
+
+
+def mark_read(cursor, chat_id, user_id, message_id=None):
+    """Сдвигает отметку прочтения участника; None, если пользователь не состоит в чате"""
+    cursor.execute(MARK_READ_QUERY, {
+        'chat_id': int(chat_id),
+        'user_id': int(user_id),
+        'message_id': int(message_id) if message_id else None,
+    })
+    row = cursor.fetchone()
+    return dict(row) if row else None
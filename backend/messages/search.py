@@ -0,0 +1,66 @@
+"""Полнотекстовый поиск по сообщениям в чатах пользователя с ранжированием и keyset-пагинацией"""
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_QUERY_LENGTH = 256
+
+SEARCH_QUERY = """
+    WITH q AS (
+        SELECT websearch_to_tsquery('russian', %(q)s) || websearch_to_tsquery('english', %(q)s) AS query
+    ), hits AS (
+        SELECT m.id, m.chat_id, m.created_at, ts_rank_cd(m.search_tsv, q.query) AS rank
+        FROM q, chat_participants cp
+        JOIN messages m ON m.chat_id = cp.chat_id
+        WHERE cp.user_id = %(user_id)s {chat_condition}
+          AND m.search_tsv @@ q.query
+    ), page AS (
+        SELECT * FROM hits
+        WHERE TRUE {cursor_condition}
+        ORDER BY rank DESC, id DESC
+        LIMIT %(limit)s
+    )
+    SELECT m.id, m.chat_id, m.sender_id, m.content, m.message_type, m.created_at,
+           u.name AS sender_name, u.avatar_url AS sender_avatar, page.rank,
+           ts_headline('russian', m.content, q.query, 'MaxFragments=1, MaxWords=20, MinWords=5') AS highlight
+    FROM page
+    -- created_at в условии: из секционированной messages читается только секция найденного сообщения
+    JOIN messages m ON m.id = page.id AND m.created_at = page.created_at
+    LEFT JOIN users u ON u.id = m.sender_id
+    CROSS JOIN q
+    ORDER BY page.rank DESC, page.id DESC
+"""
+
+CHAT_CONDITION = "AND cp.chat_id = %(chat_id)s"
+CURSOR_CONDITION = "AND (rank, id) < (%(cursor_rank)s::real, %(cursor_id)s)"
+
+
+def encode_cursor(hit: dict) -> str:
+    return f"{hit['rank']!r}|{hit['id']}"
+
+
+def decode_cursor(cursor: str):
+    rank, message_id = cursor.split('|', 1)
+    return float(rank), int(message_id)
+
+
+def search_messages(cursor, user_id, q: str, chat_id=None, limit=DEFAULT_LIMIT, after=None):
+    """Возвращает (найденные сообщения по убыванию релевантности, next_cursor)"""
+    q = (q or '').strip()[:MAX_QUERY_LENGTH]
+    if not q:
+        raise ValueError('Пустой поисковый запрос')
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    params = {'user_id': user_id, 'q': q, 'limit': limit}
+
+    if chat_id:
+        params['chat_id'] = int(chat_id)
+    if after:
+        params['cursor_rank'], params['cursor_id'] = decode_cursor(after)
+
+    cursor.execute(SEARCH_QUERY.format(
+        chat_condition=CHAT_CONDITION if chat_id else '',
+        cursor_condition=CURSOR_CONDITION if after else ''
+    ), params)
+    hits = [dict(r) for r in cursor.fetchall()]
+
+    next_cursor = encode_cursor(hits[-1]) if len(hits) == limit else None
+    return hits, next_cursor
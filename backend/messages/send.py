@@ -0,0 +1,260 @@
+"""Запись сообщений: вставка пачкой, сводки чатов, счётчики, события и очередь push за один запрос"""
+from events import CHANNEL, MAX_NOTIFY_PAYLOAD
+
+MAX_BATCH_SIZE = 500
+PREVIEW_LENGTH = 200
+MESSAGE_TYPES = ('text', 'audio', 'image', 'video', 'file')
+NOT_ALLOWED_ERROR = 'Отправитель не состоит в чате или reply_to_id из другого чата'
+
+CLIENT_MSG_ID_MAX_LENGTH = 64
+FILE_NAME_MAX_LENGTH = 255
+# Границы INTEGER: значение за ними роняло бы SEND_QUERY целиком, а не одно сообщение
+INT_MIN, INT_MAX = -2 ** 31, 2 ** 31 - 1
+INT_FIELDS = ('chat_id', 'sender_id', 'file_size', 'duration', 'reply_to_id')
+TEXT_FIELDS = ('content', 'file_url', 'file_name')
+
+MESSAGE_COLUMNS = ('id', 'chat_id', 'sender_id', 'content', 'message_type', 'file_url', 'file_name',
+                   'file_size', 'duration', 'created_at', 'reply_to_id', 'client_msg_id')
+
+SEND_QUERY = """
+    WITH input AS (
+        SELECT * FROM unnest(
+            %(ord)s::int[], %(chat_id)s::int[], %(sender_id)s::int[], %(content)s::text[],
+            %(message_type)s::text[], %(file_url)s::text[], %(file_name)s::text[],
+            %(file_size)s::int[], %(duration)s::int[], %(reply_to_id)s::int[], %(client_msg_id)s::text[]
+        ) AS v(ord, chat_id, sender_id, content, message_type, file_url, file_name, file_size, duration, reply_to_id, client_msg_id)
+    ), allowed AS (
+        SELECT input.*, nextval(pg_get_serial_sequence('messages', 'id'))::int AS id
+        FROM input
+        JOIN chat_participants cp ON cp.chat_id = input.chat_id AND cp.user_id = input.sender_id
+        LEFT JOIN messages r ON r.chat_id = input.chat_id AND r.id = input.reply_to_id
+        WHERE input.reply_to_id IS NULL OR r.id IS NOT NULL
+    ), claimed AS (
+        -- client_msg_id занимается в message_client_ids: уникальность по секциям messages не проверить
+        INSERT INTO message_client_ids (chat_id, sender_id, client_msg_id, message_id, message_created_at)
+        SELECT chat_id, sender_id, client_msg_id, id, CURRENT_TIMESTAMP
+        FROM allowed
+        WHERE client_msg_id IS NOT NULL
+        ORDER BY id
+        ON CONFLICT (chat_id, sender_id, client_msg_id) DO NOTHING
+        RETURNING message_id
+    ), ins AS (
+        INSERT INTO messages (id, chat_id, sender_id, content, message_type, file_url, file_name, file_size, duration, reply_to_id, client_msg_id)
+        SELECT id, chat_id, sender_id, content, message_type, file_url, file_name, file_size, duration, reply_to_id, client_msg_id
+        FROM allowed
+        WHERE client_msg_id IS NULL OR id IN (SELECT message_id FROM claimed)
+        ORDER BY id
+        RETURNING {columns}
+    ), per_chat AS (
+        SELECT DISTINCT ON (chat_id) chat_id, id, content, message_type, sender_id, created_at,
+               COUNT(*) OVER (PARTITION BY chat_id) AS cnt
+        FROM ins
+        ORDER BY chat_id, id DESC
+    ), chat_summary AS (
+        UPDATE chats c
+        SET updated_at = CURRENT_TIMESTAMP,
+            message_count = c.message_count + p.cnt,
+            last_message_id = CASE WHEN COALESCE(c.last_message_id, 0) < p.id THEN p.id ELSE c.last_message_id END,
+            last_message_preview = CASE WHEN COALESCE(c.last_message_id, 0) < p.id THEN LEFT(p.content, {preview_length}) ELSE c.last_message_preview END,
+            last_message_type = CASE WHEN COALESCE(c.last_message_id, 0) < p.id THEN p.message_type ELSE c.last_message_type END,
+            last_message_sender_id = CASE WHEN COALESCE(c.last_message_id, 0) < p.id THEN p.sender_id ELSE c.last_message_sender_id END,
+            last_message_at = CASE WHEN COALESCE(c.last_message_id, 0) < p.id THEN p.created_at ELSE c.last_message_at END
+        FROM per_chat p
+        WHERE c.id = p.chat_id
+        RETURNING c.id
+    ), unread AS (
+        UPDATE chat_participants cp
+        SET unread_count = cp.unread_count + x.cnt
+        FROM (
+            SELECT p.id, COUNT(*) AS cnt
+            FROM ins
+            JOIN chat_participants p ON p.chat_id = ins.chat_id AND p.user_id != ins.sender_id
+            GROUP BY p.id
+        ) x
+        WHERE cp.id = x.id
+        RETURNING cp.id
+    ), result AS (
+        SELECT allowed.ord, ins.*, FALSE AS is_read, u.name AS sender_name, u.avatar_url AS sender_avatar,
+               FALSE AS duplicate
+        FROM ins
+        JOIN allowed ON allowed.id = ins.id
+        LEFT JOIN users u ON u.id = ins.sender_id
+        UNION ALL
+        -- Повтор с тем же client_msg_id: возвращаем исходное сообщение без записи
+        SELECT allowed.ord, {existing_columns},
+               EXISTS (
+                   SELECT 1 FROM chat_participants p
+                   WHERE p.chat_id = m.chat_id AND p.user_id != m.sender_id AND p.read_receipt_message_id >= m.id
+               ),
+               u.name, u.avatar_url, TRUE
+        FROM allowed
+        JOIN message_client_ids k ON k.chat_id = allowed.chat_id
+                                 AND k.sender_id = allowed.sender_id
+                                 AND k.client_msg_id = allowed.client_msg_id
+        JOIN messages m ON m.id = k.message_id AND m.created_at = k.message_created_at
+        LEFT JOIN users u ON u.id = m.sender_id
+        WHERE allowed.client_msg_id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM ins WHERE ins.id = allowed.id)
+    ), outbox AS (
+        -- Push-уведомления рассылает воркер notifications после COMMIT, отправка их не ждёт
+        INSERT INTO notification_outbox (chat_id, message_id, sender_id, message_type, preview)
+        SELECT chat_id, id, sender_id, message_type, LEFT(content, {preview_length})
+        FROM ins
+        ORDER BY id
+    ), ev AS (
+        INSERT INTO user_events (user_id, event_type, chat_id, payload)
+        SELECT p.user_id, 'message', result.chat_id, to_jsonb(result) - 'ord' - 'duplicate'
+        FROM result
+        JOIN chat_participants p ON p.chat_id = result.chat_id
+        WHERE NOT result.duplicate
+        ORDER BY result.id
+        RETURNING user_id
+    ), notified AS (
+        SELECT pg_notify(%(channel)s, CASE WHEN length(ids) > {max_notify} THEN '*' ELSE ids END)
+        FROM (SELECT string_agg(DISTINCT user_id::text, ',') AS ids FROM ev) recipients
+        WHERE ids IS NOT NULL
+    )
+    SELECT result.*, (SELECT COUNT(*) FROM notified) AS notified
+    FROM result
+    ORDER BY result.ord
+""".format(
+    columns=', '.join(MESSAGE_COLUMNS),
+    existing_columns=', '.join(f'm.{c}' for c in MESSAGE_COLUMNS),
+    preview_length=PREVIEW_LENGTH,
+    max_notify=MAX_NOTIFY_PAYLOAD
+)
+
+# Параллельный повтор с тем же client_msg_id ждёт COMMIT первого в claimed и получает DO NOTHING,
+# но снимок SEND_QUERY его строку в message_client_ids не видит. Новый запрос - новый снимок
+DUPLICATES_QUERY = """
+    SELECT v.ord, {existing_columns},
+           EXISTS (
+               SELECT 1 FROM chat_participants p
+               WHERE p.chat_id = m.chat_id AND p.user_id != m.sender_id AND p.read_receipt_message_id >= m.id
+           ) AS is_read,
+           u.name AS sender_name, u.avatar_url AS sender_avatar, TRUE AS duplicate
+    FROM unnest(%(ord)s::int[], %(chat_id)s::int[], %(sender_id)s::int[], %(client_msg_id)s::text[])
+         AS v(ord, chat_id, sender_id, client_msg_id)
+    JOIN chat_participants cp ON cp.chat_id = v.chat_id AND cp.user_id = v.sender_id
+    JOIN message_client_ids k ON k.chat_id = v.chat_id
+                             AND k.sender_id = v.sender_id
+                             AND k.client_msg_id = v.client_msg_id
+    JOIN messages m ON m.id = k.message_id AND m.created_at = k.message_created_at
+    LEFT JOIN users u ON u.id = m.sender_id
+""".format(existing_columns=', '.join(f'm.{c}' for c in MESSAGE_COLUMNS))
+
+
+def _optional_int(value):
+    return None if value is None else int(value)
+
+
+def _normalize(item) -> dict:
+    """Проверяет одно сообщение пачки; ValueError с текстом ошибки при неверных данных"""
+    if not isinstance(item, dict):
+        raise ValueError('Сообщение должно быть объектом')
+    if not item.get('chat_id') or not item.get('sender_id'):
+        raise ValueError('chat_id и sender_id обязательны')
+
+    message_type = item.get('message_type', 'text')
+    if message_type not in MESSAGE_TYPES:
+        raise ValueError(f'Неизвестный message_type: {message_type}')
+
+    client_msg_id = item.get('client_msg_id')
+    if client_msg_id is not None and (not isinstance(client_msg_id, str) or len(client_msg_id) > CLIENT_MSG_ID_MAX_LENGTH):
+        raise ValueError(f'client_msg_id должен быть строкой до {CLIENT_MSG_ID_MAX_LENGTH} символов')
+
+    for field in TEXT_FIELDS:
+        if item.get(field) is not None and not isinstance(item[field], str):
+            raise ValueError(f'{field} должен быть строкой')
+    if item.get('file_name') is not None and len(item['file_name']) > FILE_NAME_MAX_LENGTH:
+        raise ValueError(f'file_name должен быть не длиннее {FILE_NAME_MAX_LENGTH} символов')
+
+    try:
+        message = {
+            'chat_id': int(item['chat_id']),
+            'sender_id': int(item['sender_id']),
+            'content': item.get('content') or '',
+            'message_type': message_type,
+            'file_url': item.get('file_url'),
+            'file_name': item.get('file_name'),
+            'file_size': _optional_int(item.get('file_size')),
+            'duration': _optional_int(item.get('duration')),
+            'reply_to_id': _optional_int(item.get('reply_to_id')),
+            'client_msg_id': client_msg_id,
+        }
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('chat_id, sender_id, file_size, duration и reply_to_id должны быть числами')
+
+    for field in INT_FIELDS:
+        if message[field] is not None and not INT_MIN <= message[field] <= INT_MAX:
+            raise ValueError(f'{field} вне диапазона от {INT_MIN} до {INT_MAX}')
+    return message
+
+
+def send_messages(cursor, items: list):
+    """Пишет пачку сообщений одним запросом к БД
+
+    Возвращает (отправленные сообщения с полями index и duplicate, ошибки [{index, error}]).
+    Ошибка одного сообщения не отменяет остальные. Повтор с уже записанным
+    client_msg_id возвращает исходное сообщение с duplicate = True.
+    """
+    errors = []
+    valid = []
+    repeats = {}
+    first_index = {}
+    for index, item in enumerate(items):
+        try:
+            message = _normalize(item)
+        except ValueError as e:
+            errors.append({'index': index, 'error': str(e)})
+            continue
+
+        if message['client_msg_id'] is not None:
+            key = (message['chat_id'], message['sender_id'], message['client_msg_id'])
+            if key in first_index:
+                # Повтор внутри одной пачки не виден снимку запроса, поэтому схлопываем его здесь
+                repeats[index] = first_index[key]
+                continue
+            first_index[key] = index
+        valid.append((index, message))
+
+    sent = []
+    if valid:
+        params = {key: [m[key] for _, m in valid] for key in valid[0][1]}
+        params['ord'] = [index for index, _ in valid]
+        params['channel'] = CHANNEL
+        cursor.execute(SEND_QUERY, params)
+
+        for row in cursor.fetchall():
+            message = dict(row)
+            message['index'] = message.pop('ord')
+            message.pop('notified')
+            sent.append(message)
+
+        found = {m['index'] for m in sent}
+        raced = [(index, m) for index, m in valid if index not in found and m['client_msg_id'] is not None]
+        if raced:
+            cursor.execute(DUPLICATES_QUERY, {
+                'ord': [index for index, _ in raced],
+                'chat_id': [m['chat_id'] for _, m in raced],
+                'sender_id': [m['sender_id'] for _, m in raced],
+                'client_msg_id': [m['client_msg_id'] for _, m in raced],
+            })
+            for row in cursor.fetchall():
+                message = dict(row)
+                message['index'] = message.pop('ord')
+                sent.append(message)
+
+    by_index = {m['index']: m for m in sent}
+    for index, _ in valid:
+        if index not in by_index:
+            errors.append({'index': index, 'error': NOT_ALLOWED_ERROR})
+    for index, original in repeats.items():
+        if original in by_index:
+            sent.append({**by_index[original], 'index': index, 'duplicate': True})
+        else:
+            errors.append({'index': index, 'error': NOT_ALLOWED_ERROR})
+    sent.sort(key=lambda m: m['index'])
+    errors.sort(key=lambda e: e['index'])
+
+    return sent, errors
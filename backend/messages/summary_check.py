@@ -0,0 +1,120 @@
+"""Проверка сводок чатов и счётчиков непрочитанных против исходных таблиц
+
+Запуск: DATABASE_URL=... python summary_check.py [--fix] [--limit 100]
+"""
+import argparse
+import json
+import os
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+CHAT_DRIFT_QUERY = """
+    SELECT c.id AS chat_id,
+           c.last_message_id, lm.id AS actual_last_message_id,
+           c.message_count, COALESCE(mc.cnt, 0) AS actual_message_count,
+           c.participant_count, COALESCE(pc.cnt, 0) AS actual_participant_count
+    FROM chats c
+    LEFT JOIN LATERAL (
+        SELECT m.id FROM messages m WHERE m.chat_id = c.id ORDER BY m.id DESC LIMIT 1
+    ) lm ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*) AS cnt FROM messages m WHERE m.chat_id = c.id
+    ) mc ON TRUE
+    LEFT JOIN LATERAL (
+        SELECT COUNT(*) AS cnt FROM chat_participants p WHERE p.chat_id = c.id
+    ) pc ON TRUE
+    WHERE c.last_message_id IS DISTINCT FROM lm.id
+       OR c.message_count != COALESCE(mc.cnt, 0)
+       OR c.participant_count != COALESCE(pc.cnt, 0)
+    ORDER BY c.id
+    LIMIT %s
+"""
+
+UNREAD_DRIFT_QUERY = """
+    SELECT cp.chat_id, cp.user_id, cp.last_read_message_id,
+           cp.unread_count, un.cnt AS actual_unread_count
+    FROM chat_participants cp
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) AS cnt FROM messages m
+        WHERE m.chat_id = cp.chat_id
+          AND m.sender_id != cp.user_id
+          AND m.id > COALESCE(cp.last_read_message_id, 0)
+    ) un
+    WHERE cp.unread_count != un.cnt
+    ORDER BY cp.chat_id, cp.user_id
+    LIMIT %s
+"""
+
+REPAIR_CHATS_QUERY = """
+    UPDATE chats c
+    SET last_message_id = lm.id,
+        last_message_preview = LEFT(lm.content, 200),
+        last_message_type = lm.message_type,
+        last_message_sender_id = lm.sender_id,
+        last_message_at = lm.created_at,
+        message_count = (SELECT COUNT(*) FROM messages m WHERE m.chat_id = c.id),
+        participant_count = (SELECT COUNT(*) FROM chat_participants p WHERE p.chat_id = c.id)
+    FROM chats c2
+    LEFT JOIN LATERAL (
+        SELECT m.id, m.content, m.message_type, m.sender_id, m.created_at
+        FROM messages m WHERE m.chat_id = c2.id ORDER BY m.id DESC LIMIT 1
+    ) lm ON TRUE
+    WHERE c2.id = c.id AND c.id = ANY(%s)
+"""
+
+REPAIR_UNREAD_QUERY = """
+    UPDATE chat_participants cp
+    SET unread_count = (
+        SELECT COUNT(*) FROM messages m
+        WHERE m.chat_id = cp.chat_id
+          AND m.sender_id != cp.user_id
+          AND m.id > COALESCE(cp.last_read_message_id, 0)
+    )
+    WHERE cp.chat_id = ANY(%s)
+"""
+
+
+def find_drift(cursor, limit: int = 100) -> dict:
+    """Возвращает расхождения сводок чатов и счётчиков участников"""
+    cursor.execute(CHAT_DRIFT_QUERY, (limit,))
+    chats = [dict(r) for r in cursor.fetchall()]
+    cursor.execute(UNREAD_DRIFT_QUERY, (limit,))
+    participants = [dict(r) for r in cursor.fetchall()]
+    return {'chats': chats, 'participants': participants}
+
+
+def repair(cursor, chat_ids: list):
+    """Пересчитывает сводки и счётчики для указанных чатов из исходных таблиц"""
+    if not chat_ids:
+        return
+    cursor.execute(REPAIR_CHATS_QUERY, (chat_ids,))
+    cursor.execute(REPAIR_UNREAD_QUERY, (chat_ids,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fix', action='store_true', help='пересчитать найденные расхождения')
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        drift = find_drift(cursor, args.limit)
+        print(json.dumps(drift, indent=2, default=str))
+
+        if args.fix:
+            chat_ids = sorted({r['chat_id'] for r in drift['chats'] + drift['participants']})
+            repair(cursor, chat_ids)
+            conn.commit()
+            print(json.dumps({'repaired_chats': len(chat_ids)}))
+
+        if (drift['chats'] or drift['participants']) and not args.fix:
+            raise SystemExit(1)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
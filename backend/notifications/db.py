@@ -0,0 +1,136 @@
+"""Пул соединений с PostgreSQL, переживающий тёплые вызовы функции"""
+import os
+import threading
+import time
+import psycopg2
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, dsn: str, max_size: int, health_check_interval: float, acquire_timeout: float):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.acquire_timeout = acquire_timeout
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.stats = {'hits': 0, 'connects': 0, 'broken': 0, 'connect_errors': 0}
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(self.dsn)
+        except psycopg2.OperationalError:
+            self.stats['connect_errors'] += 1
+            time.sleep(0.05)
+            conn = psycopg2.connect(self.dsn)
+        self.stats['connects'] += 1
+        return conn
+
+    def _is_alive(self, conn, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self.stats['broken'] += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def acquire(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted(f'Все {self.max_size} соединений заняты')
+                self._cond.wait(remaining)
+
+            while self._idle:
+                conn, idle_since = self._idle.pop()
+                if self._is_alive(conn, idle_since):
+                    self._in_use += 1
+                    self.stats['hits'] += 1
+                    return conn
+                self._discard(conn)
+
+            self._in_use += 1
+
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn):
+        healthy = not conn.closed
+        if healthy and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._discard(conn)
+            self._cond.notify()
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                **self.stats,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'max_size': self.max_size,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    os.environ['DATABASE_URL'],
+                    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', '4')),
+                    health_check_interval=float(os.environ.get('DB_POOL_HEALTH_CHECK_SECONDS', '30')),
+                    acquire_timeout=float(os.environ.get('DB_POOL_ACQUIRE_TIMEOUT_SECONDS', '5')),
+                )
+    return _pool
+
+
+def get_connection():
+    return get_pool().acquire()
+
+
+def release_connection(conn):
+    get_pool().release(conn)
+
+
+def pool_stats() -> dict:
+    if _pool is None:
+        return {'hits': 0, 'connects': 0, 'broken': 0, 'connect_errors': 0, 'idle': 0, 'in_use': 0,
+                'max_size': int(os.environ.get('DB_POOL_MAX_SIZE', '4'))}
+    return _pool.snapshot()
@@ -1,162 +1,112 @@
-import json
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from core import dispatch, HttpError
+from push import send_push, PushConfigError, MAX_RECIPIENTS
+from outbox import drain_outbox
+from subscriptions import verify_schema, subscribe, unsubscribe, SchemaError
+from auth_token import authorize, authorize_service, is_service_request, AuthError
+
+# Вызывается таймером со служебным ключом, не пользователями
+SERVICE_ACTIONS = ('drain_outbox',)
+
+SUBSCRIPTIONS_QUERY = """
+    SELECT id, endpoint, created_at FROM push_subscriptions
+    WHERE user_id = %s
+"""
+
+
+def prepare(request):
+    if request.action in SERVICE_ACTIONS:
+        authorize_service(request.event)
+    verify_schema(request.cursor)
+    if request.action not in SERVICE_ACTIONS and not is_service_request(request.event):
+        # Служебный вызов действует не от имени пользователя
+        source = request.body if request.method == 'POST' else request.params
+        request.auth_user_id = authorize(request.event, source.get('user_id'), request.cursor)
+
+
+def subscription_action(request):
+    body = request.body
+    user_id = body.get('user_id')
+
+    if request.action == 'subscribe':
+        # subscriptions - все устройства пользователя одним запросом
+        items = body.get('subscriptions') or ([body['subscription']] if body.get('subscription') else [])
+    else:
+        items = body.get('endpoints') or ([body['endpoint']] if body.get('endpoint') else [])
+
+    if not user_id or not items or not isinstance(items, list):
+        raise HttpError(400, 'user_id и subscription(s) или endpoint(s) обязательны')
+
+    try:
+        if request.action == 'subscribe':
+            ids = subscribe(request.cursor, user_id, items)
+            result = {'success': True, 'subscription_ids': ids}
+            if body.get('subscription'):
+                result['subscription_id'] = ids[0]
+        else:
+            result = {'success': True, 'removed': unsubscribe(request.cursor, user_id, items)}
+    except (TypeError, ValueError) as e:
+        raise HttpError(400, str(e))
+    request.conn.commit()
+    return result
+
+
+def send_notification(request):
+    body = request.body
+    user_ids = body.get('user_ids') or ([body['user_id']] if body.get('user_id') else [])
+
+    if not user_ids or not isinstance(user_ids, list) or len(user_ids) > MAX_RECIPIENTS:
+        raise HttpError(400, f'user_id или user_ids (до {MAX_RECIPIENTS}) обязательны')
+
+    # Чужим пользователям шлют только сервисы; клиент с токеном может отправить уведомление себе
+    if not is_service_request(request.event) and (
+        request.auth_user_id is None or any(str(user_id) != str(request.auth_user_id) for user_id in user_ids)
+    ):
+        raise AuthError('Отправка уведомлений другим пользователям требует служебного ключа', 403)
+
+    payload = {
+        'title': body.get('title', 'Новое сообщение'),
+        'body': body.get('message', ''),
+        'icon': body.get('icon', '/icon-192.png'),
+        'tag': body.get('tag', 'message-notification'),
+        'url': body.get('url', '/'),
+    }
+    if body.get('chat_id'):
+        payload['chatId'] = body['chat_id']
+
+    try:
+        report = send_push(request.cursor, user_ids, payload)
+    except (ValueError, TypeError):
+        raise HttpError(400, 'user_ids должен быть списком чисел')
+    request.conn.commit()
+    return {'success': True, **report}
+
+
+def drain(request):
+    # Вызывается по таймеру: разбирает очередь уведомлений, которую пишет send_message
+    return drain_outbox(request.conn, request.cursor)
+
+
+def get_subscriptions(request):
+    user_id = request.params.get('user_id')
+
+    if not user_id:
+        raise HttpError(400, 'user_id обязателен')
+
+    request.cursor.execute(SUBSCRIPTIONS_QUERY, (user_id,))
+    return {'subscriptions': [dict(s) for s in request.cursor.fetchall()]}
+
+
+ROUTES = {
+    ('POST', 'subscribe'): subscription_action,
+    ('POST', 'unsubscribe'): subscription_action,
+    ('POST', 'send_notification'): send_notification,
+    ('POST', 'drain_outbox'): drain,
+    ('GET', None): get_subscriptions,
+}
+
+ERRORS = {PushConfigError: 503, SchemaError: 503}
+
 
 def handler(event: dict, context) -> dict:
     """API для управления push-уведомлениями (подписка и отправка)"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'subscribe':
-                user_id = body.get('user_id')
-                subscription = body.get('subscription')
-                
-                if not user_id or not subscription:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'user_id и subscription обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS push_subscriptions (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER REFERENCES users(id),
-                        endpoint TEXT NOT NULL,
-                        p256dh TEXT NOT NULL,
-                        auth TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        UNIQUE(user_id, endpoint)
-                    )
-                """)
-                
-                cursor.execute("""
-                    INSERT INTO push_subscriptions (user_id, endpoint, p256dh, auth)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (user_id, endpoint) DO UPDATE
-                    SET p256dh = EXCLUDED.p256dh, auth = EXCLUDED.auth
-                    RETURNING id
-                """, (
-                    user_id,
-                    subscription.get('endpoint'),
-                    subscription.get('keys', {}).get('p256dh'),
-                    subscription.get('keys', {}).get('auth')
-                ))
-                
-                result = cursor.fetchone()
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'success': True, 'subscription_id': result['id']}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'send_notification':
-                user_id = body.get('user_id')
-                title = body.get('title', 'Новое сообщение')
-                message = body.get('message', '')
-                icon = body.get('icon', '/icon.png')
-                
-                if not user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'user_id обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("""
-                    SELECT endpoint, p256dh, auth FROM push_subscriptions
-                    WHERE user_id = %s
-                """, (user_id,))
-                
-                subscriptions = cursor.fetchall()
-                
-                if not subscriptions:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'success': True, 'sent': 0, 'message': 'No subscriptions found'}),
-                        'isBase64Encoded': False
-                    }
-                
-                sent_count = len(subscriptions)
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'success': True,
-                        'sent': sent_count,
-                        'subscriptions': [dict(s) for s in subscriptions]
-                    }),
-                    'isBase64Encoded': False
-                }
-        
-        elif method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                SELECT id, endpoint, created_at FROM push_subscriptions
-                WHERE user_id = %s
-            """, (user_id,))
-            
-            subscriptions = cursor.fetchall()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'subscriptions': [dict(s) for s in subscriptions]}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный запрос'}),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
+    return dispatch(event, ROUTES, before=prepare, errors=ERRORS)
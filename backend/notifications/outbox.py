@@ -0,0 +1,159 @@
+"""Разбор очереди notification_outbox: схлопывание пачек сообщений и рассылка push
+
+send_message пишет строку на каждое сообщение в той же транзакции. Воркер забирает порцию
+через FOR UPDATE SKIP LOCKED (несколько воркеров не мешают друг другу), группирует по
+получателю и чату и отправляет одно уведомление вместо серии. Удаление порции фиксируется
+до рассылки: открытая транзакция держала бы xid и задерживала get_updates всех пользователей
+(events.py отдаёт события только транзакций старше pg_snapshot_xmin) на всё время HTTP-запросов.
+Push не критичны: при падении во время рассылки остаток порции теряется, а не шлётся повторно.
+Запуск вне функции: DATABASE_URL=... python outbox.py [--loop --interval 2]
+"""
+import argparse
+import json
+import os
+import time
+from push import load_subscriptions, deliver, prune
+
+BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '500'))
+MAX_BATCHES = 20
+
+DRAIN_QUERY = """
+    WITH batch AS (
+        SELECT id FROM notification_outbox
+        ORDER BY id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ), claimed AS (
+        DELETE FROM notification_outbox o
+        USING batch
+        WHERE o.id = batch.id
+        RETURNING o.*
+    ), grouped AS (
+        SELECT cp.user_id, claimed.chat_id, COUNT(*) AS message_count,
+               MAX(claimed.message_id) AS last_message_id,
+               (array_agg(claimed.sender_id ORDER BY claimed.id DESC))[1] AS sender_id,
+               (array_agg(claimed.message_type ORDER BY claimed.id DESC))[1] AS message_type,
+               (array_agg(claimed.preview ORDER BY claimed.id DESC))[1] AS preview
+        FROM claimed
+        JOIN chat_participants cp ON cp.chat_id = claimed.chat_id
+                                 AND cp.user_id != claimed.sender_id
+                                 AND NOT cp.muted
+        GROUP BY cp.user_id, claimed.chat_id
+    ), total AS (
+        SELECT COUNT(*) AS claimed FROM claimed
+    )
+    SELECT total.claimed, g.user_id, g.chat_id, g.message_count, g.last_message_id,
+           g.message_type, g.preview, c.is_group, c.name AS chat_name, u.name AS sender_name
+    FROM total
+    LEFT JOIN grouped g ON TRUE
+    LEFT JOIN chats c ON c.id = g.chat_id
+    LEFT JOIN users u ON u.id = g.sender_id
+"""
+
+TYPE_PREVIEWS = {
+    'audio': 'Голосовое сообщение',
+    'image': 'Фото',
+    'video': 'Видео',
+    'file': 'Файл',
+}
+
+
+def plural_messages(count: int) -> str:
+    if count % 10 == 1 and count % 100 != 11:
+        return f'{count} новое сообщение'
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return f'{count} новых сообщения'
+    return f'{count} новых сообщений'
+
+
+def build_payload(row: dict) -> dict:
+    """Одно уведомление на получателя и чат; tag по чату заменяет предыдущее уведомление в браузере"""
+    if row['message_count'] > 1:
+        body = plural_messages(row['message_count'])
+    else:
+        body = row['preview'] or TYPE_PREVIEWS.get(row['message_type'], 'Новое сообщение')
+    if row['is_group'] and row['sender_name'] and row['message_count'] == 1:
+        body = f"{row['sender_name']}: {body}"
+
+    return {
+        'title': (row['chat_name'] if row['is_group'] else row['sender_name']) or 'Новое сообщение',
+        'body': body,
+        'icon': '/icon-192.png',
+        'tag': f"chat-{row['chat_id']}",
+        'chatId': row['chat_id'],
+        'url': f"/?chat={row['chat_id']}",
+    }
+
+
+def drain_batch(conn, cursor, limit: int = BATCH_SIZE) -> dict:
+    """Забирает и фиксирует одну порцию очереди, затем рассылает push вне транзакции"""
+    cursor.execute(DRAIN_QUERY, {'limit': limit})
+    rows = [dict(r) for r in cursor.fetchall()]
+    claimed = rows[0]['claimed'] if rows else 0
+    notifications = [r for r in rows if r['user_id'] is not None]
+
+    payloads = {}
+    for row in notifications:
+        payloads.setdefault(row['user_id'], []).append(build_payload(row))
+
+    # Каждое уведомление получателя уходит на все его устройства
+    targets = [
+        {**subscription, 'payload': payload}
+        for subscription in load_subscriptions(cursor, list(payloads))
+        for payload in payloads[subscription['user_id']]
+    ]
+    conn.commit()
+
+    results = deliver(targets, lambda target: target['payload']) if targets else []
+    pruned = prune(cursor, results)
+    conn.commit()
+
+    return {
+        'claimed': claimed,
+        'notifications': len(notifications),
+        'pushes': len(results),
+        'sent': sum(1 for r in results if r['status'] is not None and 200 <= r['status'] < 300),
+        'pruned': pruned,
+    }
+
+
+def drain_outbox(conn, cursor, limit: int = BATCH_SIZE, max_batches: int = MAX_BATCHES) -> dict:
+    """Разбирает очередь порциями, пока она не опустеет или не кончится max_batches"""
+    report = {'batches': 0, 'claimed': 0, 'notifications': 0, 'pushes': 0, 'sent': 0, 'pruned': 0}
+    for _ in range(max_batches):
+        batch = drain_batch(conn, cursor, limit)
+        report['batches'] += 1
+        for key, value in batch.items():
+            report[key] += value
+        if batch['claimed'] < limit:
+            break
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--loop', action='store_true', help='разбирать очередь постоянно')
+    parser.add_argument('--interval', type=float, default=2.0)
+    parser.add_argument('--limit', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        while True:
+            report = drain_outbox(conn, cursor, args.limit)
+            print(json.dumps(report))
+            if not args.loop:
+                break
+            if report['claimed'] == 0:
+                time.sleep(args.interval)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
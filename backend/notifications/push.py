@@ -0,0 +1,147 @@
+"""Доставка Web Push: VAPID-подпись, шифрование payload и параллельная отправка на все endpoint
+
+Получатели собираются одним запросом по списку пользователей с учётом
+user_settings.push_notifications. Отправка идёт в пуле потоков с общей HTTP-сессией,
+endpoint с ответом 404/410 удаляются. Адрес push-сервиса берётся из самой подписки,
+поэтому для локальной проверки достаточно подписок с endpoint на мок-сервер.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY', '')
+VAPID_SUBJECT = os.environ.get('VAPID_SUBJECT', 'mailto:admin@poehali.dev')
+PUSH_WORKERS = int(os.environ.get('PUSH_WORKERS', '16'))
+PUSH_TIMEOUT_SECONDS = float(os.environ.get('PUSH_TIMEOUT_SECONDS', '10'))
+PUSH_TTL_SECONDS = int(os.environ.get('PUSH_TTL_SECONDS', '86400'))
+MAX_RECIPIENTS = 1000
+
+# Подписка больше не существует: push-сервис не примет на неё ни одного сообщения
+GONE_STATUSES = (404, 410)
+
+SUBSCRIPTIONS_QUERY = """
+    SELECT s.id, s.user_id, s.endpoint, s.p256dh, s.auth
+    FROM push_subscriptions s
+    LEFT JOIN user_settings us ON us.user_id = s.user_id
+    WHERE s.user_id = ANY(%s) AND COALESCE(us.push_notifications, TRUE)
+    ORDER BY s.id
+"""
+
+_executor = None
+_session = None
+_lock = threading.Lock()
+
+
+class PushConfigError(Exception):
+    pass
+
+
+def _resources():
+    """Пул потоков и HTTP-сессия с keep-alive создаются один раз на процесс"""
+    global _executor, _session
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=PUSH_WORKERS, pool_maxsize=PUSH_WORKERS, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _session = session
+                _executor = ThreadPoolExecutor(max_workers=PUSH_WORKERS, thread_name_prefix='push')
+    return _executor, _session
+
+
+def load_subscriptions(cursor, user_ids) -> list:
+    """Подписки всех перечисленных пользователей, у которых push не выключен в настройках"""
+    cursor.execute(SUBSCRIPTIONS_QUERY, ([int(u) for u in user_ids],))
+    return [dict(r) for r in cursor.fetchall()]
+
+
+def _send_one(subscription: dict, data: str, vapid_key, session) -> dict:
+    from pywebpush import webpush, WebPushException
+
+    started = time.perf_counter()
+    result = {'subscription_id': subscription['id'], 'user_id': subscription['user_id']}
+    try:
+        response = webpush(
+            subscription_info={
+                'endpoint': subscription['endpoint'],
+                'keys': {'p256dh': subscription['p256dh'], 'auth': subscription['auth']},
+            },
+            data=data,
+            vapid_private_key=vapid_key,
+            vapid_claims={'sub': VAPID_SUBJECT},
+            ttl=PUSH_TTL_SECONDS,
+            timeout=PUSH_TIMEOUT_SECONDS,
+            requests_session=session,
+        )
+        result['status'] = response.status_code
+    except WebPushException as e:
+        result['status'] = e.response.status_code if e.response is not None else None
+        result['error'] = str(e)
+    except Exception as e:
+        # Битые ключи подписки или сетевые ошибки не должны ронять остальную рассылку
+        result['status'] = None
+        result['error'] = str(e)
+    result['latency_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+
+def deliver(subscriptions: list, payload, vapid_key=None) -> list:
+    """Отправляет payload на все подписки параллельно и возвращает результат по каждой
+
+    payload - общий словарь либо функция subscription -> словарь для персональных текстов.
+    """
+    vapid_key = vapid_key or VAPID_PRIVATE_KEY
+    if not vapid_key:
+        raise PushConfigError('VAPID_PRIVATE_KEY не задан')
+    if not subscriptions:
+        return []
+
+    executor, session = _resources()
+    futures = [
+        executor.submit(
+            _send_one, s, json.dumps(payload(s) if callable(payload) else payload, ensure_ascii=False),
+            vapid_key, session
+        )
+        for s in subscriptions
+    ]
+    return [f.result() for f in futures]
+
+
+def prune(cursor, results: list) -> int:
+    """Удаляет подписки, на которые push-сервис ответил 404/410"""
+    gone = [r['subscription_id'] for r in results if r['status'] in GONE_STATUSES]
+    if not gone:
+        return 0
+    cursor.execute('DELETE FROM push_subscriptions WHERE id = ANY(%s)', (gone,))
+    return cursor.rowcount
+
+
+def summarize(results: list, pruned: int) -> dict:
+    latencies = sorted(r['latency_ms'] for r in results)
+    sent = sum(1 for r in results if r['status'] is not None and 200 <= r['status'] < 300)
+    return {
+        'sent': sent,
+        'failed': len(results) - sent,
+        'pruned': pruned,
+        'latency_ms': {
+            'p50': latencies[len(latencies) // 2] if latencies else 0,
+            'max': latencies[-1] if latencies else 0,
+        },
+        'results': results,
+    }
+
+
+def send_push(cursor, user_ids, payload, vapid_key=None) -> dict:
+    """Рассылает push всем подпискам пользователей и чистит мёртвые endpoint в текущей транзакции"""
+    if len(user_ids) > MAX_RECIPIENTS:
+        raise ValueError(f'Не больше {MAX_RECIPIENTS} получателей за запрос')
+    subscriptions = load_subscriptions(cursor, user_ids)
+    results = deliver(subscriptions, payload, vapid_key)
+    return summarize(results, prune(cursor, results))
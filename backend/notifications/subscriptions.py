@@ -0,0 +1,89 @@
+"""Подписки Web Push: пакетная подписка и отписка устройств и проверка схемы раз на процесс"""
+
+MAX_SUBSCRIPTIONS = 50
+
+# Таблицы и колонки, без которых функция не работает; создаются миграциями db_migrations
+REQUIRED_COLUMNS = {
+    'push_subscriptions': ('id', 'user_id', 'endpoint', 'p256dh', 'auth', 'updated_at'),
+    'notification_outbox': ('id', 'chat_id', 'message_id', 'sender_id', 'message_type', 'preview'),
+    'chat_participants': ('muted',),
+    'user_settings': ('push_notifications',),
+}
+
+SCHEMA_QUERY = """
+    SELECT table_name, array_agg(column_name::text) AS columns
+    FROM information_schema.columns
+    WHERE table_schema::name = ANY(current_schemas(FALSE)) AND table_name::text = ANY(%s)
+    GROUP BY table_name
+"""
+
+SUBSCRIBE_QUERY = """
+    INSERT INTO push_subscriptions (user_id, endpoint, p256dh, auth)
+    SELECT %(user_id)s, s.endpoint, s.p256dh, s.auth
+    FROM unnest(%(endpoint)s::text[], %(p256dh)s::text[], %(auth)s::text[]) AS s(endpoint, p256dh, auth)
+    ON CONFLICT (user_id, endpoint) DO UPDATE
+    SET p256dh = EXCLUDED.p256dh, auth = EXCLUDED.auth, updated_at = CURRENT_TIMESTAMP
+    RETURNING id
+"""
+
+UNSUBSCRIBE_QUERY = """
+    DELETE FROM push_subscriptions
+    WHERE user_id = %s AND endpoint = ANY(%s)
+"""
+
+_schema_verified = False
+
+
+class SchemaError(Exception):
+    pass
+
+
+def verify_schema(cursor):
+    """Один раз на процесс проверяет, что миграции применены; дальше ничего не стоит"""
+    global _schema_verified
+    if _schema_verified:
+        return
+    cursor.execute(SCHEMA_QUERY, (list(REQUIRED_COLUMNS),))
+    present = {row['table_name']: set(row['columns']) for row in cursor.fetchall()}
+    missing = [
+        f'{table}.{column}'
+        for table, columns in REQUIRED_COLUMNS.items()
+        for column in columns
+        if column not in present.get(table, ())
+    ]
+    if missing:
+        raise SchemaError(f"Схема БД не соответствует миграциям, нет: {', '.join(missing)}")
+    _schema_verified = True
+
+
+def _normalize(subscription) -> tuple:
+    if not isinstance(subscription, dict):
+        raise ValueError('subscription должен быть объектом')
+    keys = subscription.get('keys') or {}
+    endpoint, p256dh, auth = subscription.get('endpoint'), keys.get('p256dh'), keys.get('auth')
+    if not endpoint or not p256dh or not auth:
+        raise ValueError('subscription: нужны endpoint, keys.p256dh и keys.auth')
+    return endpoint, p256dh, auth
+
+
+def subscribe(cursor, user_id, subscriptions: list) -> list:
+    """Сохраняет подписки всех устройств пользователя одним запросом и возвращает их id"""
+    if not subscriptions or len(subscriptions) > MAX_SUBSCRIPTIONS:
+        raise ValueError(f'Нужно от 1 до {MAX_SUBSCRIPTIONS} подписок')
+    # Повтор endpoint в одном INSERT ... ON CONFLICT дал бы ошибку, оставляем последний
+    rows = {endpoint: (endpoint, p256dh, auth) for endpoint, p256dh, auth in map(_normalize, subscriptions)}
+    cursor.execute(SUBSCRIBE_QUERY, {
+        'user_id': int(user_id),
+        'endpoint': [r[0] for r in rows.values()],
+        'p256dh': [r[1] for r in rows.values()],
+        'auth': [r[2] for r in rows.values()],
+    })
+    return [row['id'] for row in cursor.fetchall()]
+
+
+def unsubscribe(cursor, user_id, endpoints: list) -> int:
+    """Удаляет подписки пользователя по endpoint и возвращает число удалённых"""
+    if not endpoints or len(endpoints) > MAX_SUBSCRIPTIONS or not all(isinstance(e, str) for e in endpoints):
+        raise ValueError(f'Нужно от 1 до {MAX_SUBSCRIPTIONS} endpoint')
+    cursor.execute(UNSUBSCRIBE_QUERY, (int(user_id), endpoints))
+    return cursor.rowcount
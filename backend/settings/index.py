@@ -1,132 +1,67 @@
-import json
-import os
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from core import dispatch, HttpError, Response
+from auth_token import authorize, authorize_service, needs_cursor
+from store import get_settings, get_many, update_settings, invalidate, etag
+
+# Браузер сам перепроверяет настройки по ETag и получает 304 без тела, если они не менялись
+CACHE_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Expose-Headers': 'ETag',
+    'Cache-Control': 'private, no-cache',
+}
+
+
+def _if_none_match(request) -> list:
+    return [tag.strip().removeprefix('W/') for tag in request.headers.get('if-none-match', '').split(',')]
+
+
+def read_settings(request):
+    params = request.params
+    user_id = params.get('user_id')
+
+    if params.get('user_ids'):
+        # Чужие настройки пачкой читают только другие функции
+        authorize_service(request.event)
+        settings = get_many(lambda: request.cursor, [u for u in params['user_ids'].split(',') if u])
+        return {'settings': list(settings.values())}
+
+    # Соединение нужно только для обновления списка отзыва и промаха кэша: 304 из кэша обходится без него
+    authorize(request.event, user_id, request.cursor if needs_cursor(request.event) else None)
+
+    if not user_id:
+        raise HttpError(400, 'user_id обязателен')
+
+    settings = get_settings(lambda: request.cursor, user_id)
+    version = etag(settings)
+
+    if version in _if_none_match(request):
+        return Response(304, headers={**CACHE_HEADERS, 'ETag': version})
+    return Response(200, {'settings': settings, 'version': version}, {**CACHE_HEADERS, 'ETag': version})
+
+
+def save_settings(request):
+    user_id = request.body.get('user_id')
+    authorize(request.event, user_id, request.cursor)
+
+    if not user_id:
+        raise HttpError(400, 'user_id обязателен')
+
+    settings = update_settings(request.cursor, user_id, request.body)
+
+    if not settings:
+        raise HttpError(400, 'Нет данных для обновления')
+
+    request.conn.commit()
+    invalidate(user_id)
+    version = etag(settings)
+    return Response(200, {'settings': settings, 'version': version}, {**CACHE_HEADERS, 'ETag': version})
+
+
+ROUTES = {
+    ('GET', None): read_settings,
+    ('POST', None): save_settings,
+}
+
 
 def handler(event: dict, context) -> dict:
     """API для управления настройками пользователя"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        
-        if method == 'GET':
-            user_id = event.get('queryStringParameters', {}).get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            cursor.execute("""
-                SELECT * FROM user_settings WHERE user_id = %s
-            """, (user_id,))
-            
-            settings = cursor.fetchone()
-            
-            if not settings:
-                cursor.execute("""
-                    INSERT INTO user_settings (user_id)
-                    VALUES (%s)
-                    RETURNING *
-                """, (user_id,))
-                settings = cursor.fetchone()
-                conn.commit()
-            
-            return {
-                'statusCode': 200,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'settings': dict(settings)}, default=str),
-                'isBase64Encoded': False
-            }
-        
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            user_id = body.get('user_id')
-            
-            if not user_id:
-                return {
-                    'statusCode': 400,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'user_id обязателен'}),
-                    'isBase64Encoded': False
-                }
-            
-            updates = []
-            params = []
-            
-            setting_fields = [
-                'message_sound', 'call_sound', 'push_notifications',
-                'show_online_status', 'send_read_receipts', 'two_factor_auth',
-                'dark_theme', 'animations',
-                'hd_quality', 'noise_cancellation', 'auto_answer'
-            ]
-            
-            for field in setting_fields:
-                if field in body:
-                    updates.append(f"{field} = %s")
-                    params.append(body[field])
-            
-            if updates:
-                update_clause = ', '.join(updates)
-                
-                cursor.execute(f"""
-                    INSERT INTO user_settings (user_id)
-                    VALUES (%s)
-                    ON CONFLICT (user_id) DO UPDATE
-                    SET {update_clause}, updated_at = CURRENT_TIMESTAMP
-                    RETURNING *
-                """, [user_id] + params)
-                
-                settings = cursor.fetchone()
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'settings': dict(settings)}, default=str),
-                    'isBase64Encoded': False
-                }
-            
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Нет данных для обновления'}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 400,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Неверный запрос'}),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
-    finally:
-        if 'cursor' in locals():
-            cursor.close()
-        if 'conn' in locals():
-            conn.close()
\ No newline at end of file
+    return dispatch(event, ROUTES, errors={ValueError: 400})
@@ -0,0 +1,124 @@
+"""Чтение и запись user_settings с кэшем процесса и версиями для ETag
+
+Пользователь без строки в user_settings получает DEFAULT_SETTINGS - строка появляется
+только при первом сохранении. Прочитанные настройки держатся в LRU с TTL по user_id;
+POST в этом процессе сбрасывает запись сразу, остальные экземпляры увидят изменение
+не позже чем через SETTINGS_CACHE_TTL_SECONDS.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_TTL_SECONDS = float(os.environ.get('SETTINGS_CACHE_TTL_SECONDS', '30'))
+CACHE_SIZE = 10000
+MAX_BATCH_SIZE = 500
+
+# Значения по умолчанию совпадают с DEFAULT в V0002__add_user_settings.sql
+DEFAULT_SETTINGS = {
+    'message_sound': True,
+    'call_sound': True,
+    'push_notifications': True,
+    'show_online_status': True,
+    'send_read_receipts': True,
+    'two_factor_auth': False,
+    'dark_theme': False,
+    'animations': True,
+    'hd_quality': True,
+    'noise_cancellation': True,
+    'auto_answer': False,
+}
+SETTING_FIELDS = tuple(DEFAULT_SETTINGS)
+
+SELECT_QUERY = "SELECT * FROM user_settings WHERE user_id = ANY(%s)"
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def defaults(user_id: int) -> dict:
+    return {'id': None, 'user_id': user_id, **DEFAULT_SETTINGS, 'updated_at': None}
+
+
+def etag(settings: dict) -> str:
+    """Версия настроек: меняется при каждом сохранении, у значений по умолчанию - своя"""
+    updated_at = settings.get('updated_at')
+    version = int(updated_at.timestamp() * 1000000) if updated_at else 0
+    return f'"{settings["user_id"]}-{version}"'
+
+
+def _cached(user_id: int):
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] >= CACHE_TTL_SECONDS:
+            del _cache[user_id]
+            return None
+        _cache.move_to_end(user_id)
+        return entry[1]
+
+
+def _remember(settings: dict):
+    with _lock:
+        _cache[settings['user_id']] = (time.monotonic(), settings)
+        _cache.move_to_end(settings['user_id'])
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def invalidate(user_id):
+    with _lock:
+        _cache.pop(int(user_id), None)
+
+
+def get_many(get_cursor, user_ids) -> dict:
+    """Настройки пачки пользователей {user_id: settings}; в БД идут только промахи кэша
+
+    get_cursor вызывается только при промахе, попадания в кэш не берут соединение из пула.
+    """
+    user_ids = list(dict.fromkeys(int(u) for u in user_ids))
+    if len(user_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f'Не больше {MAX_BATCH_SIZE} пользователей за запрос')
+
+    result = {}
+    missing = []
+    for user_id in user_ids:
+        settings = _cached(user_id)
+        if settings is None:
+            missing.append(user_id)
+        else:
+            result[user_id] = settings
+
+    if missing:
+        cursor = get_cursor()
+        cursor.execute(SELECT_QUERY, (missing,))
+        found = {row['user_id']: dict(row) for row in cursor.fetchall()}
+        for user_id in missing:
+            settings = found.get(user_id) or defaults(user_id)
+            _remember(settings)
+            result[user_id] = settings
+    return result
+
+
+def get_settings(get_cursor, user_id) -> dict:
+    """Настройки пользователя без записи в БД: если строки нет, отдаются значения по умолчанию"""
+    user_id = int(user_id)
+    return get_many(get_cursor, [user_id])[user_id]
+
+
+def update_settings(cursor, user_id, values: dict):
+    """Сохраняет переданные поля; None, если менять нечего. После COMMIT нужен invalidate"""
+    fields = [f for f in SETTING_FIELDS if f in values]
+    if not fields:
+        return None
+
+    update_clause = ', '.join(f'{f} = EXCLUDED.{f}' for f in fields)
+    cursor.execute(f"""
+        INSERT INTO user_settings (user_id, {', '.join(fields)})
+        VALUES (%s{', %s' * len(fields)})
+        ON CONFLICT (user_id) DO UPDATE
+        SET {update_clause}, updated_at = CURRENT_TIMESTAMP
+        RETURNING *
+    """, [int(user_id)] + [values[f] for f in fields])
+    return dict(cursor.fetchone())
@@ -0,0 +1,262 @@
+"""Дедупликация загрузок по SHA-256 и размеру: таблица uploads, счётчик ссылок, сборка мусора
+
+Файл, содержимое которого уже есть в хранилище, повторно не записывается: клиент получает
+URL существующего объекта, а ref_count растёт. Ссылки пользователей лежат в upload_refs: у каждого
+не больше одной на объект, и снять можно только свою. По одному хешу URL не выдаётся - клиент
+доказывает, что у него есть байты, хешем случайного фрагмента из challenge.
+Объекты без ссылок удаляет сборщик мусора:
+DATABASE_URL=... python dedup.py gc [--grace-hours 24] [--limit 500]
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import time
+from storage import BUCKET, cdn_url
+from auth_token import SECRET
+
+HASH_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+HASH_CHUNK_SIZE = 1024 * 1024
+GC_GRACE_HOURS = int(os.environ.get('UPLOAD_GC_GRACE_HOURS', '24'))
+PROOF_BYTES = 64 * 1024
+CHALLENGE_TTL_SECONDS = 300
+
+FIND_QUERY = "SELECT storage_key, size FROM uploads WHERE sha256 = %s AND size = %s"
+
+OWNER_QUERY = """
+    SELECT 1 FROM uploads u
+    JOIN upload_refs r ON r.upload_id = u.id
+    WHERE u.storage_key = %s AND r.user_id = %s
+"""
+
+# Ссылка добавляется, только если у пользователя её ещё нет; без user_id (запрос без токена)
+# ссылка не берётся: снять её было бы некому. Повторная вставка того же владельца
+# дождётся параллельной и ничего не добавит
+ACQUIRE_QUERY = """
+    WITH target AS (
+        SELECT id FROM uploads WHERE sha256 = %(sha256)s AND size = %(size)s FOR UPDATE
+    ), ref AS (
+        INSERT INTO upload_refs (upload_id, user_id)
+        SELECT id, %(user_id)s::integer FROM target WHERE %(user_id)s::integer IS NOT NULL
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    UPDATE uploads u
+    SET ref_count = u.ref_count + (SELECT COUNT(*) FROM ref),
+        last_referenced_at = CURRENT_TIMESTAMP
+    FROM target
+    WHERE u.id = target.id
+    RETURNING u.storage_key, u.size
+"""
+
+# Новая строка появляется без ссылок, ссылку владельца затем берёт acquire в той же транзакции.
+# Объект, сохранённый без токена, получает одну ничью ссылку, иначе его удалил бы сборщик
+REGISTER_QUERY = """
+    INSERT INTO uploads (sha256, size, storage_key, content_type, ref_count)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (sha256, size) DO UPDATE
+    SET last_referenced_at = CURRENT_TIMESTAMP
+    RETURNING storage_key, size, (xmax = 0) AS created
+"""
+
+RELEASE_QUERY = """
+    WITH target AS (
+        SELECT id FROM uploads WHERE storage_key = %(key)s FOR UPDATE
+    ), ref AS (
+        DELETE FROM upload_refs r
+        USING target
+        WHERE r.upload_id = target.id AND r.user_id = %(user_id)s
+        RETURNING 1
+    )
+    UPDATE uploads u
+    SET ref_count = GREATEST(u.ref_count - (SELECT COUNT(*) FROM ref), 0), last_referenced_at = CURRENT_TIMESTAMP
+    FROM target
+    WHERE u.id = target.id
+    RETURNING u.ref_count, (SELECT COUNT(*) FROM ref) > 0 AS released
+"""
+
+# Строки блокируются до удаления объектов из хранилища: параллельный acquire дождётся
+# COMMIT и уже не найдёт запись, поэтому не получит ссылку на удаляемый объект
+GC_QUERY = """
+    DELETE FROM uploads WHERE id IN (
+        SELECT id FROM uploads
+        WHERE ref_count = 0
+          AND last_referenced_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+        ORDER BY last_referenced_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING storage_key
+"""
+
+
+def check_hash(sha256, size) -> tuple:
+    """Проверяет пару (sha256, size) из запроса; ValueError при неверных данных"""
+    if not isinstance(sha256, str) or not HASH_PATTERN.match(sha256.lower()):
+        raise ValueError('sha256 должен быть hex-строкой из 64 символов')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise ValueError('size должен быть числом')
+    if size < 0:
+        raise ValueError('size должен быть неотрицательным')
+    return sha256.lower(), size
+
+
+def describe(storage_key: str, size: int) -> dict:
+    return {
+        'key': storage_key,
+        'url': cdn_url(storage_key),
+        'file_name': storage_key.rsplit('/', 1)[-1],
+        'file_size': size
+    }
+
+
+def find(cursor, sha256: str, size: int):
+    """Ключ сохранённого объекта с таким содержимым без взятия ссылки; None, если его нет"""
+    cursor.execute(FIND_QUERY, (sha256, size))
+    row = cursor.fetchone()
+    return row['storage_key'] if row else None
+
+
+def is_owner(cursor, key: str, user_id: int) -> bool:
+    """У пользователя есть ссылка на объект key"""
+    cursor.execute(OWNER_QUERY, (key, user_id))
+    return cursor.fetchone() is not None
+
+
+def acquire(cursor, sha256: str, size: int, user_id=None):
+    """Берёт ссылку user_id на уже сохранённый объект; None, если такого содержимого нет"""
+    cursor.execute(ACQUIRE_QUERY, {'sha256': sha256, 'size': size, 'user_id': user_id})
+    row = cursor.fetchone()
+    return describe(row['storage_key'], row['size']) if row else None
+
+
+def register(cursor, s3, sha256: str, size: int, key: str, content_type: str, user_id=None) -> dict:
+    """Записывает только что сохранённый объект и берёт на него ссылку user_id
+
+    Если то же содержимое успели сохранить параллельно, новый объект удаляется
+    и возвращается существующий с deduplicated = True. Повторная регистрация того же key
+    (повтор запроса клиентом) объект не трогает.
+    """
+    cursor.execute(REGISTER_QUERY, (sha256, size, key, content_type, 1 if user_id is None else 0))
+    row = cursor.fetchone()
+    if not row['created'] and row['storage_key'] != key:
+        s3.delete_object(Bucket=BUCKET, Key=key)
+    if user_id is not None:
+        acquire(cursor, sha256, size, user_id)
+    return {**describe(row['storage_key'], row['size']), 'deduplicated': row['storage_key'] != key}
+
+
+def release(cursor, key: str, user_id: int) -> tuple:
+    """Снимает ссылку user_id: (снята ли, ref_count); ref_count None для объектов вне uploads"""
+    cursor.execute(RELEASE_QUERY, {'key': key, 'user_id': user_id})
+    row = cursor.fetchone()
+    return (row['released'], row['ref_count']) if row else (False, None)
+
+
+def _challenge_signature(sha256: str, size: int, user_id: int, expires_at: int, offset: int, length: int) -> str:
+    message = f'{sha256}:{size}:{user_id}:{expires_at}:{offset}:{length}'
+    return hmac.new(SECRET, message.encode(), hashlib.sha256).hexdigest()
+
+
+def issue_challenge(sha256: str, size: int, user_id: int) -> dict:
+    """Случайный фрагмент файла, хеш которого клиент должен прислать вместе с challenge
+
+    proof = sha256(challenge + байты [offset, offset + length)): challenge в хеше не даёт
+    подставить известный хеш файла, когда фрагмент совпадает с файлом целиком.
+    """
+    length = min(PROOF_BYTES, size)
+    offset = secrets.randbelow(size - length + 1)
+    expires_at = int(time.time()) + CHALLENGE_TTL_SECONDS
+    signature = _challenge_signature(sha256, size, user_id, expires_at, offset, length)
+    return {'challenge': f'{expires_at}.{offset}.{length}.{signature}', 'offset': offset, 'length': length}
+
+
+def read_range(s3, key: str, offset: int, length: int) -> bytes:
+    return s3.get_object(Bucket=BUCKET, Key=key, Range=f'bytes={offset}-{offset + length - 1}')['Body'].read()
+
+
+def verify_proof(s3, key: str, sha256: str, size: int, user_id: int, challenge, proof) -> None:
+    """Проверяет ответ на issue_challenge по байтам объекта key; ValueError, если он неверен"""
+    try:
+        expires_at, offset, length, signature = challenge.split('.')
+        expires_at, offset, length = int(expires_at), int(offset), int(length)
+    except (AttributeError, ValueError):
+        raise ValueError('Неверный challenge')
+    expected = _challenge_signature(sha256, size, user_id, expires_at, offset, length)
+    if not hmac.compare_digest(signature, expected):
+        raise ValueError('Неверный challenge')
+    if expires_at < time.time():
+        raise ValueError('Срок действия challenge истёк')
+    digest = hashlib.sha256(challenge.encode() + read_range(s3, key, offset, length)).hexdigest()
+    if not isinstance(proof, str) or not hmac.compare_digest(proof.lower().encode(), digest.encode()):
+        raise ValueError('Файл не совпадает с сохранённым')
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_object(s3, key: str) -> tuple:
+    """(sha256, size) объекта в хранилище; читается потоком, память ограничена HASH_CHUNK_SIZE"""
+    digest = hashlib.sha256()
+    size = 0
+    body = s3.get_object(Bucket=BUCKET, Key=key)['Body']
+    for chunk in body.iter_chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _delete_with_renditions(s3, key: str) -> int:
+    """Удаляет объект вместе с рендишенами и манифестом media.py (все они начинаются с <base>.)"""
+    prefix = key.rsplit('.', 1)[0] + '.'
+    keys = [o['Key'] for o in s3.list_objects_v2(Bucket=BUCKET, Prefix=prefix).get('Contents', [])]
+    if keys:
+        s3.delete_objects(Bucket=BUCKET, Delete={'Objects': [{'Key': k} for k in keys], 'Quiet': True})
+    return len(keys)
+
+
+def collect_garbage(conn, s3, grace_hours: int = GC_GRACE_HOURS, limit: int = 500) -> dict:
+    """Удаляет объекты без ссылок старше grace_hours
+
+    Строки удаляются в той же транзакции и фиксируются даже при ошибке хранилища:
+    осиротевший объект лишь занимает место, а строка без объекта выдала бы битый URL.
+    """
+    errors = []
+    deleted_objects = 0
+    with conn.cursor() as cursor:
+        cursor.execute(GC_QUERY, (grace_hours, limit))
+        keys = [row[0] for row in cursor.fetchall()]
+        for key in keys:
+            try:
+                deleted_objects += _delete_with_renditions(s3, key)
+            except Exception as e:
+                errors.append({'key': key, 'error': str(e)})
+    conn.commit()
+    return {'uploads': len(keys), 'objects': deleted_objects, 'errors': errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('command', choices=['gc'])
+    parser.add_argument('--grace-hours', type=int, default=GC_GRACE_HOURS)
+    parser.add_argument('--limit', type=int, default=500)
+    args = parser.parse_args()
+
+    import psycopg2
+    from storage import s3_client
+
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    try:
+        print(json.dumps(collect_garbage(conn, s3_client(), args.grace_hours, args.limit)))
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,95 +1,214 @@
-import json
-import os
 import base64
-import uuid
-import boto3
-from datetime import datetime
+from core import dispatch, HttpError
+from storage import BUCKET, s3_client, new_key, key_from_url
+from multipart import (
+    KEY_PATTERN, UploadError, presign_put, create_multipart, presign_parts, upload_part,
+    list_parts, complete_multipart, abort_multipart
+)
+from media import MediaError, media_kind, schedule, read_manifest, content_type_of, is_stale
+from dedup import (
+    check_hash, find, acquire, register, release, hash_bytes, hash_object, issue_challenge, verify_proof, is_owner
+)
+from auth_token import AuthError, authorize, is_service_request
+
+DB_ACTIONS = ('upload', 'check_upload', 'register_upload', 'release_upload', 'process_media')
+
+
+def authorize_request(request):
+    if is_service_request(request.event):
+        # Служебный вызов действует не от имени пользователя
+        return
+    # Список отзыва обновляется только на действиях с БД, остальным хватает подписи и срока
+    request.auth_user_id = authorize(request.event, None, request.cursor if request.action in DB_ACTIONS else None)
+
+
+def require_user(request) -> int:
+    # Ссылки на общие объекты принадлежат пользователям, анонимно их не взять и не снять
+    if request.auth_user_id is None:
+        raise AuthError('Требуется авторизация')
+    return request.auth_user_id
+
+
+def requested_key(request):
+    """key из запроса или из CDN-ссылки url; multipart проверяет его формат сам"""
+    return request.body.get('key') or key_from_url(request.body.get('url'))
+
+
+def object_key(request) -> str:
+    key = requested_key(request)
+    if not key or not KEY_PATTERN.match(key):
+        raise UploadError('Неверный key или url')
+    return key
+
+
+def upload(request):
+    body = request.body
+    file_data = body.get('file_data')
+    file_type = body.get('file_type', 'application/octet-stream')
+
+    if not file_data:
+        raise HttpError(400, 'file_data обязателен (base64)')
 
-def handler(event: dict, context) -> dict:
-    """API для загрузки файлов (аватары, голосовые сообщения, изображения, видео)"""
-    method = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-User-Id'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    if method != 'POST':
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
-    
     try:
-        body = json.loads(event.get('body', '{}'))
-        
-        file_data = body.get('file_data')
-        file_name = body.get('file_name', 'file')
-        file_type = body.get('file_type', 'application/octet-stream')
-        folder = body.get('folder', 'files')
-        
-        if not file_data:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'file_data обязателен (base64)'}),
-                'isBase64Encoded': False
-            }
-        
-        try:
-            file_bytes = base64.b64decode(file_data)
-        except Exception:
-            return {
-                'statusCode': 400,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({'error': 'Неверный формат base64'}),
-                'isBase64Encoded': False
-            }
-        
-        s3 = boto3.client(
-            's3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-        )
-        
-        ext = file_name.split('.')[-1] if '.' in file_name else 'bin'
-        unique_name = f"{uuid.uuid4()}.{ext}"
-        key = f"{folder}/{unique_name}"
-        
-        s3.put_object(
-            Bucket='files',
+        file_bytes = base64.b64decode(file_data)
+    except Exception:
+        raise HttpError(400, 'Неверный формат base64')
+
+    cursor = request.cursor
+    sha256 = hash_bytes(file_bytes)
+    result = acquire(cursor, sha256, len(file_bytes), request.auth_user_id)
+    if result:
+        result['deduplicated'] = True
+    else:
+        key, _ = new_key(body.get('folder', 'files'), body.get('file_name', 'file'))
+
+        s3_client().put_object(
+            Bucket=BUCKET,
             Key=key,
             Body=file_bytes,
             ContentType=file_type
         )
-        
-        cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({
-                'url': cdn_url,
-                'file_name': unique_name,
-                'file_size': len(file_bytes)
-            }),
-            'isBase64Encoded': False
-        }
-        
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': str(e)}),
-            'isBase64Encoded': False
-        }
+        result = register(cursor, s3_client(), sha256, len(file_bytes), key, file_type, request.auth_user_id)
+    request.conn.commit()
+
+    if body.get('process') and media_kind(file_type):
+        media = read_manifest(s3_client(), result['key']) if result['deduplicated'] else None
+        if media is None or is_stale(media):
+            # Файл целиком в теле запроса, значит невелик; задача из пула могла бы
+            # не пережить заморозку процесса после ответа и оставить манифест в pending
+            media = schedule(s3_client(), result['key'], file_type)[1].result()
+        result['media'] = media
+    return result
+
+
+def presign_put_action(request):
+    body = request.body
+    return presign_put(
+        s3_client(), body.get('folder', 'files'), body.get('file_name', 'file'),
+        body.get('file_type', 'application/octet-stream')
+    )
+
+
+def create_multipart_action(request):
+    body = request.body
+    return create_multipart(
+        s3_client(), body.get('folder', 'files'), body.get('file_name', 'file'),
+        body.get('file_type', 'application/octet-stream')
+    )
+
+
+def presign_parts_action(request):
+    body = request.body
+    return presign_parts(s3_client(), requested_key(request), body.get('upload_id'), body.get('part_numbers'))
+
+
+def upload_part_action(request):
+    body = request.body
+    return upload_part(
+        s3_client(), requested_key(request), body.get('upload_id'), body.get('part_number'), body.get('chunk_data')
+    )
+
+
+def list_parts_action(request):
+    key, upload_id = requested_key(request), request.body.get('upload_id')
+    return {'key': key, 'upload_id': upload_id, 'parts': list_parts(s3_client(), key, upload_id)}
+
+
+def complete_multipart_action(request):
+    body = request.body
+    key = requested_key(request)
+    file_type = body.get('file_type', 'application/octet-stream')
+    result = complete_multipart(s3_client(), key, body.get('upload_id'), body.get('parts'))
+    if body.get('process') and media_kind(file_type):
+        result['media'], _ = schedule(s3_client(), key, file_type)
+    return result
+
+
+def abort_multipart_action(request):
+    return abort_multipart(s3_client(), requested_key(request), request.body.get('upload_id'))
+
+
+def check_upload(request):
+    # Клиент присылает хеш до загрузки: если содержимое уже есть, байты не передаются.
+    # Первый вызов возвращает challenge, URL выдаётся на второй - с proof по фрагменту файла
+    user_id = require_user(request)
+    body = request.body
+    sha256, size = check_hash(body.get('sha256'), body.get('size'))
+    key = find(request.cursor, sha256, size)
+    if key is None:
+        return {'exists': False}
+    # Пустой файл известен всем, доказывать нечего
+    if size:
+        if not body.get('proof'):
+            return {'exists': True, **issue_challenge(sha256, size, user_id)}
+        verify_proof(s3_client(), key, sha256, size, user_id, body.get('challenge'), body.get('proof'))
+    existing = acquire(request.cursor, sha256, size, user_id)
+    request.conn.commit()
+    return {'exists': True, **existing} if existing else {'exists': False}
+
+
+def register_upload(request):
+    # После presigned или multipart загрузки: хеш считается по самому объекту, а не со слов клиента
+    user_id = require_user(request)
+    key = object_key(request)
+    sha256, size = hash_object(s3_client(), key)
+    result = register(request.cursor, s3_client(), sha256, size, key, content_type_of(s3_client(), key), user_id)
+    request.conn.commit()
+    return result
+
+
+def release_upload(request):
+    user_id = require_user(request)
+    key = object_key(request)
+    released, ref_count = release(request.cursor, key, user_id)
+    request.conn.commit()
+    return {'key': key, 'released': released, 'ref_count': ref_count}
+
+
+def process_media(request):
+    key = object_key(request)
+    # Манифест перезаписывается, поэтому запускать обработку может только владелец объекта
+    if not is_service_request(request.event) and not is_owner(request.cursor, key, require_user(request)):
+        raise AuthError('Файл принадлежит другому пользователю', 403)
+    manifest = read_manifest(s3_client(), key)
+    if manifest and (manifest['status'] == 'ready' or manifest['status'] == 'pending' and not is_stale(manifest)):
+        return manifest
+    # Тип берётся у самого объекта: присланный file_type позволил бы обработать картинку как голосовое
+    result, future = schedule(s3_client(), key, content_type_of(s3_client(), key))
+    if request.body.get('wait'):
+        # Ожидание нужно там, где процесс функции замораживается сразу после ответа
+        result = future.result()
+    return result
+
+
+def get_media(request):
+    key = object_key(request)
+    manifest = read_manifest(s3_client(), key)
+    if manifest and is_stale(manifest):
+        # Фоновая обработка потерялась вместе с процессом: повторяем её в этом запросе
+        manifest = schedule(s3_client(), key, manifest['content_type'])[1].result()
+    return manifest or {'key': key, 'status': 'none', 'renditions': {}}
+
+
+ROUTES = {
+    ('POST', 'upload'): upload,
+    ('POST', 'presign_put'): presign_put_action,
+    ('POST', 'create_multipart'): create_multipart_action,
+    ('POST', 'presign_parts'): presign_parts_action,
+    ('POST', 'upload_part'): upload_part_action,
+    ('POST', 'list_parts'): list_parts_action,
+    ('POST', 'complete_multipart'): complete_multipart_action,
+    ('POST', 'abort_multipart'): abort_multipart_action,
+    ('POST', 'check_upload'): check_upload,
+    ('POST', 'register_upload'): register_upload,
+    ('POST', 'release_upload'): release_upload,
+    ('POST', 'process_media'): process_media,
+    ('POST', 'get_media'): get_media,
+}
+
+ERRORS = {UploadError: 400, MediaError: 400, ValueError: 400}
+
+
+def handler(event: dict, context) -> dict:
+    """API для загрузки файлов (аватары, голосовые сообщения, изображения, видео)"""
+    return dispatch(event, ROUTES, before=authorize_request, errors=ERRORS, default_action='upload')
@@ -0,0 +1,232 @@
+"""Обработка медиа после загрузки: превью изображений и сжатие голосовых в Opus
+
+Рендишены складываются рядом с исходным объектом, их URL и размеры записываются
+в манифест <key>.media.json. Задачи выполняются в пуле потоков процесса функции;
+для офлайн-обработки то же самое запускает CLI: python media.py <key> [<key> ...]
+Процесс функции могут заморозить сразу после ответа, и задача из пула не завершится:
+манифест, висящий в pending дольше PENDING_STALE_SECONDS, обрабатывается заново (is_stale).
+Pillow и ffmpeg подключаются лениво: без них соответствующие рендишены помечаются ошибкой.
+"""
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from storage import BUCKET, s3_client, cdn_url
+
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', '2'))
+MAX_SOURCE_BYTES = int(os.environ.get('MEDIA_MAX_SOURCE_BYTES', str(100 * 1024 * 1024)))
+FFMPEG_BIN = os.environ.get('FFMPEG_BIN', 'ffmpeg')
+FFPROBE_BIN = os.environ.get('FFPROBE_BIN', 'ffprobe')
+FFMPEG_TIMEOUT_SECONDS = int(os.environ.get('FFMPEG_TIMEOUT_SECONDS', '120'))
+# С запасом на два запуска ffmpeg (перекодирование и ffprobe) и обмен с хранилищем
+PENDING_STALE_SECONDS = int(os.environ.get('MEDIA_PENDING_STALE_SECONDS', str(2 * FFMPEG_TIMEOUT_SECONDS + 60)))
+
+# name -> (максимальная сторона, формат Pillow, content type, расширение, качество)
+IMAGE_RENDITIONS = {
+    'thumb': (320, 'WEBP', 'image/webp', 'webp', 70),
+    'preview': (1280, 'WEBP', 'image/webp', 'webp', 80),
+}
+VOICE_BITRATE = os.environ.get('MEDIA_VOICE_BITRATE', '24k')
+
+MANIFEST_SUFFIX = '.media.json'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class MediaError(Exception):
+    pass
+
+
+def media_kind(content_type: str):
+    if content_type.startswith('image/') and content_type != 'image/svg+xml':
+        return 'image'
+    if content_type.startswith('audio/'):
+        return 'audio'
+    return None
+
+
+def manifest_key(key: str) -> str:
+    return key + MANIFEST_SUFFIX
+
+
+def rendition_key(key: str, name: str, ext: str) -> str:
+    base = key.rsplit('.', 1)[0]
+    return f"{base}.{name}.{ext}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _executor_instance() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MEDIA_WORKERS, thread_name_prefix='media')
+    return _executor
+
+
+def content_type_of(s3, key: str) -> str:
+    return s3.head_object(Bucket=BUCKET, Key=key).get('ContentType', '')
+
+
+def write_manifest(s3, key: str, manifest: dict):
+    s3.put_object(
+        Bucket=BUCKET,
+        Key=manifest_key(key),
+        Body=json.dumps(manifest).encode(),
+        ContentType='application/json'
+    )
+
+
+def read_manifest(s3, key: str):
+    """Манифест объекта или None, если обработка не запускалась"""
+    try:
+        body = s3.get_object(Bucket=BUCKET, Key=manifest_key(key))['Body']
+    except s3.exceptions.NoSuchKey:
+        return None
+    return json.loads(body.read())
+
+
+def is_stale(manifest: dict) -> bool:
+    """Обработка поставлена в очередь слишком давно и, скорее всего, уже не завершится"""
+    if manifest.get('status') != 'pending' or not manifest.get('queued_at'):
+        return False
+    queued_at = datetime.fromisoformat(manifest['queued_at'])
+    return (datetime.now(timezone.utc) - queued_at).total_seconds() > PENDING_STALE_SECONDS
+
+
+def _put(s3, key: str, data: bytes, content_type: str):
+    s3.put_object(Bucket=BUCKET, Key=key, Body=data, ContentType=content_type)
+
+
+def image_renditions(s3, key: str, source: bytes) -> dict:
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise MediaError('Pillow не установлен')
+
+    renditions = {}
+    with Image.open(io.BytesIO(source)) as original:
+        # Ориентация из EXIF применяется до масштабирования, иначе превью с телефона лежат на боку
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        width, height = image.size
+        renditions['original'] = {'url': cdn_url(key), 'key': key, 'width': width, 'height': height}
+
+        for name, (max_side, fmt, content_type, ext, quality) in IMAGE_RENDITIONS.items():
+            copy = image.copy()
+            copy.thumbnail((max_side, max_side), Image.LANCZOS)
+            out = io.BytesIO()
+            copy.save(out, fmt, quality=quality, method=4)
+            target = rendition_key(key, name, ext)
+            _put(s3, target, out.getvalue(), content_type)
+            renditions[name] = {
+                'url': cdn_url(target), 'key': target, 'content_type': content_type,
+                'width': copy.width, 'height': copy.height, 'size': out.tell()
+            }
+    return renditions
+
+
+def _probe_duration(path: str):
+    if not shutil.which(FFPROBE_BIN):
+        return None
+    result = subprocess.run(
+        [FFPROBE_BIN, '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+        capture_output=True, text=True, timeout=FFMPEG_TIMEOUT_SECONDS
+    )
+    try:
+        return round(float(result.stdout.strip()), 2)
+    except ValueError:
+        return None
+
+
+def audio_renditions(s3, key: str, source: bytes) -> dict:
+    if not shutil.which(FFMPEG_BIN):
+        raise MediaError('ffmpeg не найден')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src_path = os.path.join(tmp, 'source')
+        out_path = os.path.join(tmp, 'voice.ogg')
+        with open(src_path, 'wb') as f:
+            f.write(source)
+        result = subprocess.run(
+            [FFMPEG_BIN, '-v', 'error', '-y', '-i', src_path, '-vn', '-ac', '1', '-ar', '48000',
+             '-c:a', 'libopus', '-b:a', VOICE_BITRATE, '-application', 'voip', out_path],
+            capture_output=True, text=True, timeout=FFMPEG_TIMEOUT_SECONDS
+        )
+        if result.returncode != 0:
+            raise MediaError(f'ffmpeg: {result.stderr.strip()[-500:]}')
+
+        with open(out_path, 'rb') as f:
+            data = f.read()
+        target = rendition_key(key, 'opus', 'ogg')
+        _put(s3, target, data, 'audio/ogg')
+        return {
+            'original': {'url': cdn_url(key), 'key': key, 'size': len(source)},
+            'opus': {
+                'url': cdn_url(target), 'key': target, 'content_type': 'audio/ogg; codecs=opus',
+                'size': len(data), 'duration': _probe_duration(out_path)
+            }
+        }
+
+
+def process(key: str, content_type: str) -> dict:
+    """Строит рендишены объекта и записывает итоговый манифест"""
+    s3 = s3_client()
+    kind = media_kind(content_type)
+    manifest = {'key': key, 'content_type': content_type, 'kind': kind, 'renditions': {}}
+    try:
+        if kind is None:
+            raise MediaError(f'Тип {content_type} не обрабатывается')
+        head = s3.head_object(Bucket=BUCKET, Key=key)
+        if head['ContentLength'] > MAX_SOURCE_BYTES:
+            raise MediaError(f'Файл больше {MAX_SOURCE_BYTES} байт')
+        source = s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+
+        build = image_renditions if kind == 'image' else audio_renditions
+        manifest['renditions'] = build(s3, key, source)
+        manifest['status'] = 'ready'
+    except Exception as e:
+        manifest['status'] = 'failed'
+        manifest['error'] = str(e)
+    manifest['processed_at'] = _now()
+    write_manifest(s3, key, manifest)
+    return manifest
+
+
+def schedule(s3, key: str, content_type: str):
+    """Ставит обработку в пул и сразу возвращает (манифест со статусом pending, future)"""
+    kind = media_kind(content_type)
+    if kind is None:
+        raise MediaError(f'Тип {content_type} не обрабатывается')
+    manifest = {'key': key, 'content_type': content_type, 'kind': kind, 'status': 'pending',
+                'renditions': {}, 'queued_at': _now()}
+    write_manifest(s3, key, manifest)
+    return manifest, _executor_instance().submit(process, key, content_type)
+
+
+def main():
+    keys = sys.argv[1:]
+    if not keys:
+        raise SystemExit('usage: python media.py <key> [<key> ...]')
+    s3 = s3_client()
+    futures = []
+    for key in keys:
+        content_type = content_type_of(s3, key)
+        futures.append(_executor_instance().submit(process, key, content_type))
+    for future in futures:
+        print(json.dumps(future.result(), ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""Метрики обработчиков: время действия, время в БД, число запросов, строки и размер ответа
+
+Файл одинаковый во всех функциях. core.dispatch оборачивает курсор запроса в
+InstrumentedCursor и после ответа вызывает observe: каждое действие пишет одну
+JSON-строку в stdout, запросы дольше SLOW_QUERY_MS - отдельную строку с формой
+параметров (типы и длины, без значений). Накопленные счётчики процесса отдаются в формате
+Prometheus через GET ?action=metrics.
+"""
+import json
+import os
+import re
+import threading
+import time
+
+FUNCTION_NAME = os.environ.get('FUNCTION_NAME') or os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+LOG_REQUESTS = os.environ.get('METRICS_LOG', '1').lower() not in ('0', 'false', 'no')
+MAX_QUERY_CHARS = 300
+
+# Границы гистограммы длительности действия, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_actions = {}
+_lock = threading.Lock()
+
+
+class QueryStats:
+    __slots__ = ('action', 'queries', 'db_seconds', 'rows', 'slow')
+
+    def __init__(self):
+        self.action = None
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.slow = 0
+
+
+def param_shape(params):
+    """Форма параметров запроса для лога: типы и длины вместо значений"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: param_shape(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        if len(params) > 10:
+            return f'{type(params).__name__}[{len(params)}]'
+        return [param_shape(value) for value in params]
+    if isinstance(params, (str, bytes)):
+        return f'{type(params).__name__}({len(params)})'
+    return type(params).__name__
+
+
+def _log(line: dict):
+    print(json.dumps(line, ensure_ascii=False, default=str), flush=True)
+
+
+class InstrumentedCursor:
+    """Курсор, который считает запросы, время в БД и полученные строки"""
+
+    def __init__(self, cursor, stats: QueryStats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def execute(self, query, params=None):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(query, params)
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self._stats
+            stats.queries += 1
+            stats.db_seconds += elapsed
+            if self._cursor.description is not None and self._cursor.rowcount > 0:
+                stats.rows += self._cursor.rowcount
+            if elapsed * 1000 >= SLOW_QUERY_MS:
+                stats.slow += 1
+                text = query.decode() if isinstance(query, bytes) else str(query)
+                _log({
+                    'event': 'slow_query',
+                    'function': FUNCTION_NAME,
+                    'action': stats.action,
+                    'ms': round(elapsed * 1000, 2),
+                    'query': re.sub(r'\s+', ' ', text).strip()[:MAX_QUERY_CHARS],
+                    'params': param_shape(params),
+                })
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def observe(method: str, action: str, status: int, seconds: float, stats: QueryStats, response_bytes: int):
+    """Учитывает один вызов обработчика в счётчиках процесса и пишет строку лога"""
+    key = (method, action)
+    with _lock:
+        entry = _actions.get(key)
+        if entry is None:
+            entry = _actions[key] = {
+                'statuses': {}, 'buckets': [0] * len(LATENCY_BUCKETS), 'count': 0, 'seconds': 0.0,
+                'db_seconds': 0.0, 'queries': 0, 'rows': 0, 'slow_queries': 0, 'response_bytes': 0,
+            }
+        entry['statuses'][status] = entry['statuses'].get(status, 0) + 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                entry['buckets'][i] += 1
+        entry['count'] += 1
+        entry['seconds'] += seconds
+        entry['db_seconds'] += stats.db_seconds
+        entry['queries'] += stats.queries
+        entry['rows'] += stats.rows
+        entry['slow_queries'] += stats.slow
+        entry['response_bytes'] += response_bytes
+
+    if LOG_REQUESTS:
+        _log({
+            'event': 'request',
+            'function': FUNCTION_NAME,
+            'method': method,
+            'action': action,
+            'status': status,
+            'ms': round(seconds * 1000, 2),
+            'db_ms': round(stats.db_seconds * 1000, 2),
+            'queries': stats.queries,
+            'rows': stats.rows,
+            'response_bytes': response_bytes,
+        })
+
+
+def _labels(**labels) -> str:
+    return ','.join(f'{k}="{v}"' for k, v in labels.items())
+
+
+def render(pool: dict = None) -> str:
+    """Счётчики процесса в текстовом формате Prometheus; pool - pool_stats() функции"""
+    with _lock:
+        actions = {key: {**entry, 'statuses': dict(entry['statuses']), 'buckets': list(entry['buckets'])}
+                   for key, entry in _actions.items()}
+
+    lines = [
+        '# HELP handler_requests_total Вызовы обработчика по действию и статусу ответа',
+        '# TYPE handler_requests_total counter',
+    ]
+    for (method, action), entry in sorted(actions.items()):
+        for status, count in sorted(entry['statuses'].items()):
+            labels = _labels(function=FUNCTION_NAME, method=method, action=action, status=status)
+            lines.append(f'handler_requests_total{{{labels}}} {count}')
+
+    lines += [
+        '# HELP handler_duration_seconds Время обработки действия',
+        '# TYPE handler_duration_seconds histogram',
+    ]
+    for (method, action), entry in sorted(actions.items()):
+        labels = _labels(function=FUNCTION_NAME, method=method, action=action)
+        for bound, count in zip(LATENCY_BUCKETS, entry['buckets']):
+            lines.append(f'handler_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'handler_duration_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f'handler_duration_seconds_sum{{{labels}}} {entry["seconds"]:.6f}')
+        lines.append(f'handler_duration_seconds_count{{{labels}}} {entry["count"]}')
+
+    for name, field, help_text in (
+        ('handler_db_seconds_total', 'db_seconds', 'Время в запросах к БД'),
+        ('handler_queries_total', 'queries', 'Запросы к БД'),
+        ('handler_rows_total', 'rows', 'Строки, полученные из БД'),
+        ('handler_slow_queries_total', 'slow_queries', f'Запросы дольше {SLOW_QUERY_MS:g} мс'),
+        ('handler_response_bytes_total', 'response_bytes', 'Размер тел ответов'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (method, action), entry in sorted(actions.items()):
+            labels = _labels(function=FUNCTION_NAME, method=method, action=action)
+            value = f'{entry[field]:.6f}' if isinstance(entry[field], float) else entry[field]
+            lines.append(f'{name}{{{labels}}} {value}')
+
+    for key, value in sorted((pool or {}).items()):
+        kind = 'gauge' if key in ('idle', 'in_use', 'max_size') else 'counter'
+        name = f'db_pool_{key}' if kind == 'gauge' else f'db_pool_{key}_total'
+        lines += [f'# TYPE {name} {kind}', f'{name}{{{_labels(function=FUNCTION_NAME)}}} {value}']
+
+    return '\n'.join(lines) + '\n'
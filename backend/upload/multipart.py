@@ -0,0 +1,148 @@
+"""Потоковая загрузка: multipart upload частями и presigned URL для прямой загрузки в бакет"""
+import base64
+import re
+from storage import BUCKET, new_key, cdn_url
+
+PART_SIZE = 8 * 1024 * 1024
+MAX_PARTS = 10000
+MAX_PRESIGN_PARTS = 100
+PRESIGN_EXPIRES_SECONDS = 3600
+KEY_PATTERN = re.compile(r'^[\w-]+/[0-9a-f-]{36}\.[\w]+$')
+
+
+class UploadError(Exception):
+    pass
+
+
+def _check_key(key):
+    if not key or not KEY_PATTERN.match(key):
+        raise UploadError('Неверный key')
+    return key
+
+
+def _part_number(value) -> int:
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise UploadError('part_number должен быть числом')
+    if not 1 <= number <= MAX_PARTS:
+        raise UploadError(f'part_number должен быть от 1 до {MAX_PARTS}')
+    return number
+
+
+def presign_put(s3, folder: str, file_name: str, file_type: str) -> dict:
+    """URL для загрузки файла целиком одним PUT напрямую в бакет"""
+    key, unique_name = new_key(folder, file_name)
+    upload_url = s3.generate_presigned_url(
+        'put_object',
+        Params={'Bucket': BUCKET, 'Key': key, 'ContentType': file_type},
+        ExpiresIn=PRESIGN_EXPIRES_SECONDS
+    )
+    return {
+        'key': key,
+        'file_name': unique_name,
+        'upload_url': upload_url,
+        'url': cdn_url(key),
+        'expires_in': PRESIGN_EXPIRES_SECONDS
+    }
+
+
+def create_multipart(s3, folder: str, file_name: str, file_type: str) -> dict:
+    key, unique_name = new_key(folder, file_name)
+    upload = s3.create_multipart_upload(Bucket=BUCKET, Key=key, ContentType=file_type)
+    return {
+        'key': key,
+        'file_name': unique_name,
+        'upload_id': upload['UploadId'],
+        'part_size': PART_SIZE
+    }
+
+
+def presign_parts(s3, key: str, upload_id: str, part_numbers: list) -> dict:
+    """Presigned URL для загрузки частей напрямую в бакет, сервер байтов не видит"""
+    _check_key(key)
+    if not upload_id:
+        raise UploadError('upload_id обязателен')
+    if not part_numbers or len(part_numbers) > MAX_PRESIGN_PARTS:
+        raise UploadError(f'part_numbers: от 1 до {MAX_PRESIGN_PARTS} номеров')
+
+    urls = {}
+    for value in part_numbers:
+        number = _part_number(value)
+        urls[str(number)] = s3.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': BUCKET, 'Key': key, 'UploadId': upload_id, 'PartNumber': number},
+            ExpiresIn=PRESIGN_EXPIRES_SECONDS
+        )
+    return {'key': key, 'upload_id': upload_id, 'urls': urls, 'expires_in': PRESIGN_EXPIRES_SECONDS}
+
+
+def upload_part(s3, key: str, upload_id: str, part_number, chunk_data: str) -> dict:
+    """Загрузка одной части через функцию; память ограничена размером части"""
+    _check_key(key)
+    number = _part_number(part_number)
+    if not upload_id or not chunk_data:
+        raise UploadError('upload_id и chunk_data обязательны')
+    if len(chunk_data) > (PART_SIZE * 4) // 3 + 4:
+        raise UploadError(f'Часть больше {PART_SIZE} байт')
+    try:
+        chunk = base64.b64decode(chunk_data)
+    except Exception:
+        raise UploadError('Неверный формат base64')
+
+    part = s3.upload_part(Bucket=BUCKET, Key=key, UploadId=upload_id, PartNumber=number, Body=chunk)
+    return {'part_number': number, 'etag': part['ETag'], 'size': len(chunk)}
+
+
+def list_parts(s3, key: str, upload_id: str) -> list:
+    """Уже загруженные части: по ним клиент продолжает прерванную загрузку"""
+    _check_key(key)
+    if not upload_id:
+        raise UploadError('upload_id обязателен')
+
+    parts = []
+    marker = 0
+    while True:
+        page = s3.list_parts(Bucket=BUCKET, Key=key, UploadId=upload_id, PartNumberMarker=marker)
+        parts.extend(
+            {'part_number': p['PartNumber'], 'etag': p['ETag'], 'size': p['Size']}
+            for p in page.get('Parts', [])
+        )
+        if not page.get('IsTruncated'):
+            return parts
+        marker = page['NextPartNumberMarker']
+
+
+def complete_multipart(s3, key: str, upload_id: str, parts=None) -> dict:
+    """Собирает объект; без parts список частей берётся из хранилища"""
+    if not parts:
+        parts = list_parts(s3, key, upload_id)
+    _check_key(key)
+    if not parts:
+        raise UploadError('Нет загруженных частей')
+
+    try:
+        ordered = sorted(
+            ({'PartNumber': _part_number(p['part_number']), 'ETag': p['etag']} for p in parts),
+            key=lambda p: p['PartNumber']
+        )
+    except (KeyError, TypeError):
+        raise UploadError('parts: ожидается список {part_number, etag}')
+    s3.complete_multipart_upload(
+        Bucket=BUCKET, Key=key, UploadId=upload_id, MultipartUpload={'Parts': ordered}
+    )
+    head = s3.head_object(Bucket=BUCKET, Key=key)
+    return {
+        'key': key,
+        'url': cdn_url(key),
+        'file_name': key.rsplit('/', 1)[-1],
+        'file_size': head['ContentLength']
+    }
+
+
+def abort_multipart(s3, key: str, upload_id: str) -> dict:
+    _check_key(key)
+    if not upload_id:
+        raise UploadError('upload_id обязателен')
+    s3.abort_multipart_upload(Bucket=BUCKET, Key=key, UploadId=upload_id)
+    return {'key': key, 'aborted': True}
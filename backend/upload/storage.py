@@ -0,0 +1,70 @@
+"""Доступ к S3-совместимому хранилищу файлов
+
+Клиент создаётся один раз на процесс и переиспользуется между вызовами:
+boto3 импортируется лениво, чтобы OPTIONS и ошибки валидации не платили за загрузку botocore.
+"""
+import os
+import threading
+import uuid
+
+BUCKET = 'files'
+DEFAULT_ENDPOINT_URL = 'https://bucket.poehali.dev'
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '10'))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('S3_CONNECT_TIMEOUT_SECONDS', '5'))
+READ_TIMEOUT_SECONDS = float(os.environ.get('S3_READ_TIMEOUT_SECONDS', '60'))
+MAX_ATTEMPTS = int(os.environ.get('S3_MAX_ATTEMPTS', '3'))
+
+_client = None
+_client_key = None
+_lock = threading.Lock()
+
+
+def _create_client(endpoint_url: str):
+    import boto3
+    from botocore.config import Config
+
+    config = Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_SECONDS,
+        tcp_keepalive=True,
+        retries={'max_attempts': MAX_ATTEMPTS, 'mode': 'standard'}
+    )
+    # Своя сессия: boto3.client() на сессии по умолчанию не потокобезопасен
+    session = boto3.session.Session(
+        aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+        aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+    )
+    return session.client('s3', endpoint_url=endpoint_url, config=config)
+
+
+def s3_client():
+    """Возвращает общий для процесса клиент S3, создавая его при первом обращении"""
+    global _client, _client_key
+    key = (os.environ.get('S3_ENDPOINT_URL', DEFAULT_ENDPOINT_URL), os.environ.get('AWS_ACCESS_KEY_ID'))
+    if _client is not None and _client_key == key:
+        return _client
+    with _lock:
+        if _client is None or _client_key != key:
+            _client = _create_client(key[0])
+            _client_key = key
+        return _client
+
+
+def new_key(folder: str, file_name: str) -> tuple:
+    """Возвращает (key, unique_name) для нового объекта в папке folder"""
+    ext = file_name.split('.')[-1] if '.' in file_name else 'bin'
+    unique_name = f"{uuid.uuid4()}.{ext}"
+    return f"{folder}/{unique_name}", unique_name
+
+
+def cdn_url(key: str) -> str:
+    return f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{key}"
+
+
+def key_from_url(url):
+    """Ключ объекта по CDN URL из cdn_url; None для чужих URL"""
+    if not url or '/bucket/' not in url:
+        return None
+    return url.split('/bucket/', 1)[1]
@@ -0,0 +1,113 @@
+"""Бенчмарк get_chats: старый путь (коррелированные подзапросы + N+1) против fetch_chat_page
+
+Запуск: DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_chat_list.py
+Данные создаются в отдельной схеме (по умолчанию bench_chat_list) и не трогают рабочие таблицы.
+"""
+import argparse
+from common import use_backend, connect, reset_schema, dict_cursor, measure, summarize, CountingCursor
+
+use_backend('messages')
+from chat_list import fetch_chat_page, MAX_LIMIT  # noqa: E402
+from summary_check import repair  # noqa: E402
+
+USER_ID = 1
+
+
+def legacy_get_chats(cursor, user_id):
+    cursor.execute(
+        """SELECT c.id, c.name, c.is_group, c.avatar_url, c.updated_at,
+                  (SELECT content FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message,
+                  (SELECT created_at FROM messages WHERE chat_id = c.id ORDER BY created_at DESC LIMIT 1) as last_message_time,
+                  (SELECT COUNT(*) FROM messages WHERE chat_id = c.id AND is_read = FALSE AND sender_id != %s) as unread_count,
+                  (SELECT COUNT(*) FROM chat_participants WHERE chat_id = c.id) as participants_count
+           FROM chats c
+           JOIN chat_participants cp ON c.id = cp.chat_id
+           WHERE cp.user_id = %s
+           ORDER BY c.updated_at DESC""",
+        (user_id, user_id)
+    )
+    result = []
+    for chat in cursor.fetchall():
+        chat_dict = dict(chat)
+        if not chat_dict['is_group']:
+            cursor.execute(
+                """SELECT u.id, u.name, u.avatar_url, u.is_online
+                   FROM users u
+                   JOIN chat_participants cp ON u.id = cp.user_id
+                   WHERE cp.chat_id = %s AND u.id != %s
+                   LIMIT 1""",
+                (chat_dict['id'], user_id)
+            )
+            cursor.fetchone()
+        result.append(chat_dict)
+    return result
+
+
+def engine_get_chats(cursor, user_id):
+    chats, after = fetch_chat_page(cursor, user_id, limit=MAX_LIMIT)
+    while after:
+        page, after = fetch_chat_page(cursor, user_id, limit=MAX_LIMIT, after=after)
+        chats.extend(page)
+    return chats
+
+
+def seed(conn, chat_count: int, messages_per_chat: int):
+    """Пользователь 1 состоит в chat_count чатах: каждый пятый групповой, остальные личные"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO users (phone, name) SELECT '+7' || g, 'User ' || g FROM generate_series(1, %s) g",
+            (chat_count + 1,)
+        )
+        cursor.execute(
+            """INSERT INTO chats (name, is_group, updated_at)
+               SELECT 'Chat ' || g, g %% 5 = 0, now() - g * interval '1 minute'
+               FROM generate_series(1, %s) g""",
+            (chat_count,)
+        )
+        cursor.execute(
+            """INSERT INTO chat_participants (chat_id, user_id, is_admin)
+               SELECT id, 1, TRUE FROM chats
+               UNION ALL
+               SELECT id, id + 1, FALSE FROM chats"""
+        )
+        cursor.execute(
+            """INSERT INTO messages (chat_id, sender_id, content, created_at)
+               SELECT c.id, CASE WHEN g %% 2 = 0 THEN 1 ELSE c.id + 1 END, 'Message ' || g,
+                      now() - (c.id * 1000 + g) * interval '1 second'
+               FROM chats c CROSS JOIN generate_series(1, %s) g""",
+            (messages_per_chat,)
+        )
+        cursor.execute('SELECT array_agg(id) FROM chats')
+        repair(cursor, cursor.fetchone()[0])
+        cursor.execute('ANALYZE')
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schema', default='bench_chat_list')
+    parser.add_argument('--chats', default='10,50,100,300,1000')
+    parser.add_argument('--messages-per-chat', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'chats':>6} | {'legacy p50 ms':>13} | {'legacy queries':>14} | {'engine p50 ms':>13} | {'engine queries':>14}")
+    for chat_count in [int(c) for c in args.chats.split(',')]:
+        reset_schema(args.schema)
+        conn = connect(args.schema)
+        seed(conn, chat_count, args.messages_per_chat)
+
+        row = []
+        for fn in (legacy_get_chats, engine_get_chats):
+            counting = CountingCursor(dict_cursor(conn))
+            fn(counting, USER_ID)
+            queries = counting.queries
+            samples = measure(lambda: fn(counting, USER_ID), repeat=args.repeat)
+            row.extend([summarize(samples)['p50'], queries])
+        conn.close()
+
+        print(f"{chat_count:>6} | {row[0]:>13.2f} | {row[1]:>14} | {row[2]:>13.2f} | {row[3]:>14}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Бенчмарк get_contacts: выгрузка всей таблицы users против справочника с keyset-пагинацией и поиском
+
+Запуск: DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_contacts.py --users 100000,1000000
+"""
+import argparse
+import json
+from common import use_backend, connect, reset_schema, dict_cursor, measure, summarize
+
+use_backend('messages')
+from contacts import fetch_contacts  # noqa: E402
+
+USER_ID = 1
+
+
+def legacy_contacts(cursor):
+    cursor.execute(
+        """SELECT DISTINCT u.id, u.name, u.phone, u.avatar_url, u.is_online, u.last_seen
+           FROM users u
+           WHERE u.id != %s
+           ORDER BY u.name""",
+        (USER_ID,)
+    )
+    return [dict(c) for c in cursor.fetchall()]
+
+
+def seed(conn, user_count: int):
+    """Пользователи с псевдослучайными именами; пользователь 1 делит чаты с 200 из них"""
+    with conn.cursor() as cursor:
+        cursor.execute(
+            """INSERT INTO users (phone, name)
+               SELECT '+7' || (9000000000 + g), initcap(md5(g::text)) || ' ' || g
+               FROM generate_series(1, %s) g""",
+            (user_count,)
+        )
+        cursor.execute(
+            """INSERT INTO chats (is_group, participant_count)
+               SELECT FALSE, 2 FROM generate_series(1, 200)"""
+        )
+        cursor.execute(
+            """INSERT INTO chat_participants (chat_id, user_id)
+               SELECT id, 1 FROM chats
+               UNION ALL
+               SELECT id, id * 37 %% %s + 2 FROM chats""",
+            (user_count - 1,)
+        )
+        cursor.execute('ANALYZE')
+    conn.commit()
+
+
+def payload_size(rows) -> int:
+    return len(json.dumps(rows, default=str).encode())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schema', default='bench_contacts')
+    parser.add_argument('--users', default='100000,1000000')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    scenarios = [
+        ('legacy full dump', lambda c: legacy_contacts(c)),
+        ('first page', lambda c: fetch_contacts(c, USER_ID)[0]),
+        ('deep page', None),
+        ('search name', lambda c: fetch_contacts(c, USER_ID, q='abc')[0]),
+        ('search phone', lambda c: fetch_contacts(c, USER_ID, q='900000123')[0]),
+        ('shared chats', lambda c: fetch_contacts(c, USER_ID, mode='shared')[0]),
+    ]
+
+    print(f"{'users':>8} | {'scenario':<16} | {'p50 ms':>9} | {'p95 ms':>9} | {'rows':>8} | {'bytes':>11}")
+    for user_count in [int(u) for u in args.users.split(',')]:
+        reset_schema(args.schema)
+        conn = connect(args.schema)
+        seed(conn, user_count)
+        cursor = dict_cursor(conn)
+
+        cursor.execute('SELECT name, id FROM users ORDER BY name, id OFFSET %s LIMIT 1', (user_count // 2,))
+        middle = cursor.fetchone()
+        deep_cursor = f"{middle['name']}|{middle['id']}"
+
+        for title, fn in scenarios:
+            if fn is None:
+                fn = lambda c: fetch_contacts(c, USER_ID, after=deep_cursor)[0]  # noqa: E731
+            rows = fn(cursor)
+            stats = summarize(measure(lambda: fn(cursor), repeat=args.repeat, warmup=1))
+            print(f"{user_count:>8} | {title:<16} | {stats['p50']:>9.2f} | {stats['p95']:>9.2f} | {len(rows):>8} | {payload_size(rows):>11}")
+
+        cursor.close()
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Нагрузочный прогон обработчиков по сценариям из backend/*/tests.json
+
+Запуск:
+  DATABASE_URL=... python benchmarks/seed.py --users 100000 --messages 5000000
+  DATABASE_URL=... python benchmarks/bench_handlers.py --concurrency 8 --requests 500 --users 100000
+  ... --save-baseline benchmarks/baseline.json     # сохранить результаты как эталон
+  ... --baseline benchmarks/baseline.json          # выход с кодом 1, если действие стало медленнее
+
+Каждая функция загружается отдельно (common.load_handler) и вызывается напрямую:
+handler(event, None) из пула потоков. Соединения идут в схему seed.py через PGOPTIONS,
+S3 для upload заменяется s3_stub. Число запросов к БД на вызов берётся из metrics.py
+самой функции. С --users user_id в запросах заменяется случайным пользователем из
+засеянных, чтобы нагрузка не упиралась в одни и те же строки. Сценарии с "service": true
+идут с заголовком X-Service-Key из SERVICE_KEY функции.
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl
+from common import BACKEND_DIR, load_handler, use_schema, summarize
+from s3_stub import local_s3
+
+FUNCTIONS = ('auth', 'messages', 'notifications', 'settings', 'upload')
+
+# Сценарии, которые при повторе должны отличаться, иначе второй вызов уже проверяет другую ветку
+_unique = itertools.count(1)
+VARIATIONS = {
+    'register': lambda body: {**body, 'phone': f'+8{os.getpid() % 1000:03d}{next(_unique):08d}'},
+}
+
+
+def load_cases(functions, only=None) -> list:
+    """Сценарии из tests.json: событие handler и ожидаемый статус"""
+    cases = []
+    seen = {}
+    for function in functions:
+        path = os.path.join(BACKEND_DIR, function, 'tests.json')
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            tests = json.load(f)['tests']
+        for test in tests:
+            url = urlsplit(test.get('path', '/'))
+            params = dict(parse_qsl(url.query))
+            body = test.get('body')
+            action = (body or params).get('action') or 'default'
+            if only and action not in only:
+                continue
+            # Ключ в результатах и эталоне; одинаковые действия одной функции нумеруются по порядку
+            key = f"{function}.{test.get('method', 'GET')}.{action}"
+            seen[key] = seen.get(key, 0) + 1
+            cases.append({
+                'key': key if seen[key] == 1 else f'{key}#{seen[key]}',
+                'function': function,
+                'name': test['name'],
+                'action': action,
+                'method': test.get('method', 'GET'),
+                'params': params,
+                'body': body,
+                'expected_status': test.get('expectedStatus', 200),
+                'service': test.get('service', False),
+            })
+    return cases
+
+
+def build_event(case: dict, users: int = 0, issue_token=None, service_key: bytes = b'') -> dict:
+    params = dict(case['params'])
+    body = copy.deepcopy(case['body'])
+    if users:
+        user_id = random.randint(1, users)
+        if 'user_id' in params:
+            params['user_id'] = str(user_id)
+        if body and 'user_id' in body:
+            body['user_id'] = user_id
+    if body and case['action'] in VARIATIONS:
+        body = VARIATIONS[case['action']](body)
+
+    event = {'httpMethod': case['method'], 'headers': {'Accept-Encoding': 'gzip, br'}}
+    if case['service'] and service_key:
+        event['headers']['X-Service-Key'] = service_key.decode()
+    user_id = params.get('user_id') or (body or {}).get('user_id')
+    if issue_token and user_id:
+        event['headers']['X-Auth-Token'] = issue_token(user_id)['token']
+    if params:
+        event['queryStringParameters'] = params
+    if body is not None:
+        event['body'] = json.dumps(body)
+    return event
+
+
+def query_totals(metrics) -> tuple:
+    """(вызовы, запросы к БД) по всем действиям функции из её metrics.py"""
+    with metrics._lock:
+        return (
+            sum(entry['count'] for entry in metrics._actions.values()),
+            sum(entry['queries'] for entry in metrics._actions.values()),
+        )
+
+
+def run_case(handler, modules, case: dict, requests: int, concurrency: int, users: int) -> dict:
+    metrics = modules['metrics']
+    # С AUTH_TOKEN_SECRET запросы подписываются как настоящим клиентом, это работает и при AUTH_ENFORCE
+    auth_token = modules.get('auth_token')
+    issue_token = auth_token.issue_token if auth_token and auth_token.SECRET else None
+    service_key = auth_token.SERVICE_KEY if auth_token else b''
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def call(_):
+        event = build_event(case, users, issue_token, service_key)
+        started = time.perf_counter()
+        response = handler(event, None)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            statuses[response['statusCode']] = statuses.get(response['statusCode'], 0) + 1
+
+    # Прогрев: соединения пула, кэши процесса, ленивые импорты
+    for _ in range(min(concurrency, requests)):
+        call(None)
+    latencies.clear()
+    statuses.clear()
+
+    calls_before, queries_before = query_totals(metrics)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(requests)))
+    total = time.perf_counter() - started
+    calls_after, queries_after = query_totals(metrics)
+
+    errors = sum(count for status, count in statuses.items() if status != case['expected_status'])
+    return {
+        **summarize(latencies),
+        'rps': requests / total,
+        'queries': (queries_after - queries_before) / max(calls_after - calls_before, 1),
+        'errors': errors,
+        'statuses': statuses,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Действия, которые стали медленнее эталона по p95 или делают больше запросов к БД"""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if result['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {base['p95']:.2f} -> {result['p95']:.2f} ms")
+        if result['queries'] > base['queries'] + 0.01:
+            regressions.append(f"{key}: запросов на вызов {base['queries']:.2f} -> {result['queries']:.2f}")
+        if result['errors'] > base.get('errors', 0):
+            regressions.append(f"{key}: ошибок {base.get('errors', 0)} -> {result['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--schema', default='bench_load')
+    parser.add_argument('--functions', default=','.join(FUNCTIONS))
+    parser.add_argument('--actions', default='', help='только эти action через запятую')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='вызовов на сценарий')
+    parser.add_argument('--users', type=int, default=0, help='подставлять случайный user_id из 1..N')
+    parser.add_argument('--json', help='записать результаты в файл')
+    parser.add_argument('--save-baseline', help='сохранить результаты как эталон')
+    parser.add_argument('--baseline', help='сравнить с эталоном и завершиться с кодом 1 при регрессии')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='допустимый рост p95, доля')
+    args = parser.parse_args()
+
+    use_schema(args.schema)
+    # Пул соединений каждой функции не должен быть уже пула потоков, логи запросов не нужны
+    os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+    os.environ['METRICS_LOG'] = '0'
+    # Служебные сценарии подписываются этим ключом; функции читают его при загрузке
+    os.environ.setdefault('SERVICE_KEY', 'bench-service-key')
+    random.seed(1)
+
+    functions = [f for f in args.functions.split(',') if f]
+    cases = load_cases(functions, {a for a in args.actions.split(',') if a})
+    results = {}
+
+    with local_s3():
+        loaded = {}
+        for function in functions:
+            loaded[function] = load_handler(function)
+
+        print(f"concurrency: {args.concurrency}, requests per case: {args.requests}, schema: {args.schema}")
+        print(f"{'case':<34} | {'p50 ms':>8} | {'p95 ms':>8} | {'p99 ms':>8} | "
+              f"{'req/s':>8} | {'queries':>7} | {'errors':>6}")
+        for case in cases:
+            handler, modules = loaded[case['function']]
+            result = run_case(handler, modules, case, args.requests, args.concurrency, args.users)
+            results[case['key']] = result
+            print(f"{case['key']:<34} | {result['p50']:>8.2f} | {result['p95']:>8.2f} | "
+                  f"{result['p99']:>8.2f} | {result['rps']:>8.1f} | {result['queries']:>7.2f} | {result['errors']:>6}")
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('\nрегрессии относительно эталона:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\nрегрессий относительно эталона нет')
+
+
+if __name__ == '__main__':
+    main()
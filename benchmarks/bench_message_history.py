@@ -0,0 +1,84 @@
+"""Бенчмарк истории чата: LIMIT/OFFSET против курсора before_id на чате из 1M сообщений
+
+Запуск: DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_message_history.py
+Листает чат с конца и печатает задержку страницы на разной глубине: у OFFSET она растёт
+линейно, у курсора остаётся плоской.
+"""
+import argparse
+from common import use_backend, connect, reset_schema, dict_cursor, measure, summarize
+
+use_backend('messages')
+from history import fetch_message_page, encode_cursor  # noqa: E402
+
+CHAT_ID = 1
+
+
+def offset_page(cursor, page: int, limit: int):
+    cursor.execute(
+        """SELECT m.*, u.name as sender_name, u.avatar_url as sender_avatar
+           FROM messages m
+           JOIN users u ON m.sender_id = u.id
+           WHERE m.chat_id = %s
+           ORDER BY m.created_at DESC
+           LIMIT %s OFFSET %s""",
+        (CHAT_ID, limit, page * limit)
+    )
+    return cursor.fetchall()
+
+
+def seed(conn, message_count: int):
+    with conn.cursor() as cursor:
+        cursor.execute("INSERT INTO users (phone, name) VALUES ('+71', 'Alice'), ('+72', 'Bob')")
+        cursor.execute("INSERT INTO chats (name, is_group) VALUES ('History', TRUE)")
+        cursor.execute("INSERT INTO chat_participants (chat_id, user_id) VALUES (1, 1), (1, 2)")
+        cursor.execute(
+            """INSERT INTO messages (chat_id, sender_id, content, created_at)
+               SELECT 1, 1 + g %% 2, 'Message ' || g, now() - (%s - g) * interval '1 second'
+               FROM generate_series(1, %s) g""",
+            (message_count, message_count)
+        )
+        cursor.execute('ANALYZE')
+    conn.commit()
+
+
+def cursor_for_page(cursor, page: int, limit: int):
+    """before_id, с которого начинается страница page (считается один раз, вне замера)"""
+    if page == 0:
+        return None
+    cursor.execute(
+        'SELECT id, created_at FROM messages WHERE chat_id = %s ORDER BY id DESC OFFSET %s LIMIT 1',
+        (CHAT_ID, page * limit - 1)
+    )
+    return encode_cursor(cursor.fetchone())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schema', default='bench_message_history')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--pages', default='0,10,100,1000,5000,19000')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    reset_schema(args.schema)
+    conn = connect(args.schema)
+    seed(conn, args.messages)
+    cursor = dict_cursor(conn)
+
+    print(f"{'page':>6} | {'offset p50 ms':>13} | {'keyset p50 ms':>13}")
+    for page in [int(p) for p in args.pages.split(',')]:
+        before_id = cursor_for_page(cursor, page, args.limit)
+        offset = summarize(measure(lambda: offset_page(cursor, page, args.limit), repeat=args.repeat))
+        keyset = summarize(measure(
+            lambda: fetch_message_page(cursor, CHAT_ID, limit=args.limit, before_id=before_id),
+            repeat=args.repeat
+        ))
+        print(f"{page:>6} | {offset['p50']:>13.2f} | {keyset['p50']:>13.2f}")
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
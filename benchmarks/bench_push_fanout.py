@@ -0,0 +1,80 @@
+"""Рассылка Web Push: последовательная отправка против пула потоков push.deliver
+
+Запуск: python benchmarks/bench_push_fanout.py --subscriptions 200 --latency-ms 50
+Push-сервис заменяется локальным моком (push_mock.py), база не нужна.
+Нужны pywebpush и cryptography из requirements функции notifications.
+"""
+import argparse
+import base64
+import json
+import os
+import time
+from common import use_backend, summarize
+from push_mock import MockPushService
+
+use_backend('notifications')
+import push  # noqa: E402
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def fake_subscriptions(base_url: str, count: int, gone_every: int) -> list:
+    """Подписки с настоящими ключами браузера, чтобы шифрование payload шло как в проде"""
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.hazmat.primitives import serialization
+
+    subscriptions = []
+    for i in range(count):
+        key = ec.generate_private_key(ec.SECP256R1())
+        public = key.public_key().public_bytes(
+            serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+        )
+        prefix = 'gone-' if gone_every and i % gone_every == 0 else ''
+        subscriptions.append({
+            'id': i + 1, 'user_id': i // 2 + 1,
+            'endpoint': f'{base_url}/push/{prefix}{i}',
+            'p256dh': b64url(public), 'auth': b64url(os.urandom(16)),
+        })
+    return subscriptions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--subscriptions', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--gone-every', type=int, default=10, help='каждая N-я подписка отвечает 410')
+    args = parser.parse_args()
+
+    from py_vapid import Vapid
+    vapid = Vapid()
+    vapid.generate_keys()
+
+    payload = {'title': 'Bench', 'body': 'Новое сообщение', 'chatId': 1}
+    with MockPushService(args.latency_ms) as service:
+        subscriptions = fake_subscriptions(service.url, args.subscriptions, args.gone_every)
+        _, session = push._resources()
+        data = json.dumps(payload, ensure_ascii=False)
+
+        started = time.perf_counter()
+        serial = [push._send_one(s, data, vapid, session) for s in subscriptions]
+        serial_s = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pooled = push.deliver(subscriptions, payload, vapid)
+        pooled_s = time.perf_counter() - started
+
+        print(f"subscriptions: {args.subscriptions}, mock latency: {args.latency_ms} ms, workers: {push.PUSH_WORKERS}")
+        print(f"{'mode':<8} | {'total s':>8} | {'push/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'gone':>5} | {'errors':>6}")
+        for label, results, total in (('serial', serial, serial_s), ('pool', pooled, pooled_s)):
+            stats = summarize([r['latency_ms'] for r in results])
+            gone = sum(1 for r in results if r['status'] in push.GONE_STATUSES)
+            errors = sum(1 for r in results if r['status'] is None)
+            print(f"{label:<8} | {total:>8.2f} | {len(results) / total:>8.1f} | {stats['p50']:>8.2f} | "
+                  f"{stats['p99']:>8.2f} | {gone:>5} | {errors:>6}")
+        print(f"mock accepted: {service.received}, rejected: {service.rejected}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Бенчмарк search_messages на синтетическом корпусе из нескольких миллионов сообщений
+
+Запуск: DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_search.py --messages 3000000
+Корпус смешивает русские и английские слова; пользователь 1 состоит в части чатов.
+"""
+import argparse
+from common import use_backend, connect, reset_schema, dict_cursor, measure, summarize
+
+use_backend('messages')
+from search import search_messages  # noqa: E402
+
+USER_ID = 1
+
+WORDS = [
+    'привет', 'встреча', 'завтра', 'документы', 'отчёт', 'проект', 'звонок', 'фотографии', 'билеты',
+    'поездка', 'работа', 'договор', 'собака', 'дача', 'кофе', 'праздник', 'подарок', 'оплата',
+    'meeting', 'tomorrow', 'report', 'project', 'deploy', 'release', 'invoice', 'ticket', 'flight',
+    'coffee', 'weekend', 'birthday', 'payment', 'contract', 'holiday', 'server', 'database', 'photos',
+]
+
+QUERIES = ['встреча завтра', 'отчёты', 'билет', 'deploy release', 'payments', 'кофе OR coffee', '"договор оплата"']
+
+
+def seed(conn, message_count: int, chat_count: int):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO users (phone, name) SELECT '+7' || g, 'User ' || g FROM generate_series(1, 1000) g"
+        )
+        cursor.execute(
+            'INSERT INTO chats (is_group) SELECT TRUE FROM generate_series(1, %s)', (chat_count,)
+        )
+        cursor.execute(
+            """INSERT INTO chat_participants (chat_id, user_id)
+               SELECT id, 1 FROM chats WHERE id %% 10 = 0
+               UNION ALL
+               SELECT id, 2 + id %% 999 FROM chats"""
+        )
+        cursor.execute(
+            """INSERT INTO messages (chat_id, sender_id, content)
+               SELECT 1 + g %% %(chats)s, 2 + (g %% %(chats)s) %% 999,
+                      (SELECT string_agg(w, ' ')
+                       FROM (SELECT (%(words)s::text[])[1 + floor(random() * %(n)s)::int] AS w
+                             FROM generate_series(1, 4 + g %% 8)) ws)
+               FROM generate_series(1, %(messages)s) g""",
+            {'chats': chat_count, 'words': WORDS, 'n': len(WORDS), 'messages': message_count}
+        )
+        cursor.execute('ANALYZE')
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schema', default='bench_search')
+    parser.add_argument('--messages', type=int, default=3_000_000)
+    parser.add_argument('--chats', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--skip-seed', action='store_true', help='использовать уже заполненную схему')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        reset_schema(args.schema)
+        seed_conn = connect(args.schema)
+        seed(seed_conn, args.messages, args.chats)
+        seed_conn.close()
+
+    conn = connect(args.schema)
+    cursor = dict_cursor(conn)
+
+    print(f"{'query':<20} | {'page':>4} | {'p50 ms':>9} | {'p95 ms':>9} | {'hits':>5}")
+    for q in QUERIES:
+        after = None
+        for page in range(1, args.pages + 1):
+            hits, next_cursor = search_messages(cursor, USER_ID, q, after=after)
+            stats = summarize(measure(
+                lambda: search_messages(cursor, USER_ID, q, after=after), repeat=args.repeat, warmup=1
+            ))
+            print(f"{q:<20} | {page:>4} | {stats['p50']:>9.2f} | {stats['p95']:>9.2f} | {len(hits):>5}")
+            if not next_cursor:
+                break
+            after = next_cursor
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
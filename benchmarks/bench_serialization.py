@@ -0,0 +1,95 @@
+"""Сериализация ответов: json.dumps(default=str) против core.dumps (orjson) и сжатия тела
+
+Запуск: python benchmarks/bench_serialization.py --chats 500 --contacts 1000
+Ответы get_chats и get_contacts собираются синтетически в форме, которую отдают
+chat_list.py и contacts.py, база не нужна. Для br нужен пакет Brotli, иначе строка пропускается.
+"""
+import argparse
+import base64
+import json
+import random
+from datetime import datetime, timedelta
+from common import use_backend, measure, summarize
+
+use_backend('messages')
+import core  # noqa: E402
+
+WORDS = ['привет', 'как дела', 'созвонимся', 'отправил файл', 'ок', 'завтра в 10', 'спасибо', 'hello']
+
+
+def chats_payload(count: int) -> dict:
+    now = datetime(2026, 1, 1, 12, 0, 0)
+    chats = []
+    for i in range(count):
+        updated = now - timedelta(minutes=i * 7, microseconds=i)
+        chats.append({
+            'id': i + 1,
+            'name': f'Чат {i + 1}' if i % 5 == 0 else f'Пользователь {i + 1}',
+            'is_group': i % 5 == 0,
+            'avatar_url': f'https://cdn.poehali.dev/avatars/{i + 1}.webp' if i % 3 else None,
+            'last_message': ' '.join(random.choices(WORDS, k=random.randint(1, 8))),
+            'last_message_time': updated,
+            'updated_at': updated,
+            'unread_count': random.randint(0, 30),
+            'participants_count': random.randint(2, 40) if i % 5 == 0 else 2,
+            'is_online': bool(i % 2),
+            'last_seen': updated - timedelta(minutes=3),
+        })
+    return {'chats': chats, 'next_cursor': f"{chats[-1]['updated_at'].isoformat()}|{count}"}
+
+
+def contacts_payload(count: int) -> dict:
+    now = datetime(2026, 1, 1, 12, 0, 0)
+    contacts = [{
+        'id': i + 1,
+        'phone': f'+7999{i:07d}',
+        'name': f'Пользователь {i + 1}',
+        'avatar_url': f'https://cdn.poehali.dev/avatars/{i + 1}.webp' if i % 3 else None,
+        'bio': random.choice(WORDS) if i % 4 == 0 else None,
+        'is_online': bool(i % 2),
+        'last_seen': now - timedelta(minutes=i),
+    } for i in range(count)]
+    return {'contacts': contacts, 'next_cursor': None}
+
+
+def legacy_dumps(data) -> bytes:
+    """Как отвечали обработчики до core.py"""
+    return json.dumps(data, default=str).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--contacts', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    random.seed(1)
+
+    print(f"orjson: {'да' if core.orjson else 'нет'}, brotli: {'да' if core.brotli else 'нет'}, "
+          f"порог сжатия: {core.COMPRESS_MIN_BYTES} байт")
+    print(f"{'payload':<10} | {'mode':<14} | {'p50 ms':>8} | {'p99 ms':>8} | {'body KB':>8} | {'wire KB':>8}")
+
+    for label, payload in (('get_chats', chats_payload(args.chats)), ('contacts', contacts_payload(args.contacts))):
+        # wire - то, что уходит в ответе функции: сжатое тело передаётся в base64
+        modes = [
+            ('json', lambda: legacy_dumps(payload), None),
+            ('core.dumps', lambda: core.dumps(payload), None),
+            ('core + gzip', lambda: core.respond(200, payload, 'gzip'), 'gzip'),
+        ]
+        if core.brotli is not None:
+            modes.append(('core + br', lambda: core.respond(200, payload, 'br'), 'br'))
+
+        for mode, fn, encoding in modes:
+            stats = summarize(measure(fn, repeat=args.repeat))
+            result = fn()
+            if encoding:
+                body = len(base64.b64decode(result['body']))
+                wire = len(result['body'])
+            else:
+                body = wire = len(result)
+            print(f"{label:<10} | {mode:<14} | {stats['p50']:>8.2f} | {stats['p99']:>8.2f} | "
+                  f"{body / 1024:>8.1f} | {wire / 1024:>8.1f}")
+
+
+if __name__ == '__main__':
+    main()
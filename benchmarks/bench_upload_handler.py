@@ -0,0 +1,110 @@
+"""Время холодного старта и тёплых вызовов upload: общий клиент S3 против нового клиента на каждый вызов
+
+Запуск: python benchmarks/bench_upload_handler.py --repeat 50
+Холодный старт меряется в отдельном интерпретаторе: импорт index, первый OPTIONS и первый POST.
+Тёплые вызовы идут в moto (pip install moto) или во внешний MinIO через S3_ENDPOINT_URL;
+upload пишет в таблицу uploads, поэтому нужен DATABASE_URL (схема по умолчанию bench_upload).
+"""
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+from common import use_backend, reset_schema, use_schema, measure, summarize, BACKEND_DIR
+from s3_stub import local_s3
+
+use_backend('upload')
+
+COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+from index import handler
+imported = time.perf_counter()
+handler({'httpMethod': 'OPTIONS'}, None)
+options = time.perf_counter()
+boto3_after_options = 'boto3' in sys.modules
+handler({'httpMethod': 'POST', 'body': json.dumps({'action': 'presign_put', 'file_name': 'a.jpg', 'file_type': 'image/jpeg'})}, None)
+first_post = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'options_ms': (options - imported) * 1000,
+    'first_post_ms': (first_post - options) * 1000,
+    'boto3_after_options': boto3_after_options,
+}))
+"""
+
+
+def cold_start(runs: int) -> tuple:
+    env = {
+        **os.environ,
+        'AWS_ACCESS_KEY_ID': os.environ.get('AWS_ACCESS_KEY_ID', 'bench'),
+        'AWS_SECRET_ACCESS_KEY': os.environ.get('AWS_SECRET_ACCESS_KEY', 'bench'),
+    }
+    samples = {'import_ms': [], 'options_ms': [], 'first_post_ms': []}
+    boto3_after_options = False
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, '-c', COLD_START_SCRIPT],
+            cwd=os.path.join(BACKEND_DIR, 'upload'), env=env, capture_output=True, text=True, check=True
+        ).stdout
+        result = json.loads(out)
+        boto3_after_options |= result['boto3_after_options']
+        for name in samples:
+            samples[name].append(result[name])
+    return {name: summarize(values) for name, values in samples.items()}, boto3_after_options
+
+
+def call(handler, body: dict):
+    response = handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    assert response['statusCode'] == 200, response['body']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--cold-runs', type=int, default=5)
+    parser.add_argument('--size-kb', type=int, default=64)
+    parser.add_argument('--schema', default='bench_upload')
+    args = parser.parse_args()
+
+    print(f"{'cold start':<28} | {'p50 ms':>8} | {'p95 ms':>8}")
+    stats_by_name, boto3_after_options = cold_start(args.cold_runs)
+    for name, stats in stats_by_name.items():
+        print(f"{name:<28} | {stats['p50']:>8.2f} | {stats['p95']:>8.2f}")
+    print(f"boto3 imported by OPTIONS: {boto3_after_options}")
+
+    reset_schema(args.schema)
+    use_schema(args.schema)
+    with local_s3():
+        import index
+        import storage
+        from index import handler
+
+        def upload_body():
+            # Каждый раз новое содержимое, иначе дедупликация пропустит запись в хранилище
+            return {
+                'file_data': base64.b64encode(os.urandom(args.size_kb * 1024)).decode(),
+                'file_name': 'photo.jpg', 'file_type': 'image/jpeg', 'folder': 'bench'
+            }
+        presign = {'action': 'presign_put', 'file_name': 'photo.jpg', 'file_type': 'image/jpeg'}
+        shared_client = index.s3_client
+
+        def per_call_client():
+            return storage._create_client(os.environ.get('S3_ENDPOINT_URL', storage.DEFAULT_ENDPOINT_URL))
+
+        print()
+        print(f"{'warm call':<28} | {'p50 ms':>8} | {'p95 ms':>8}")
+        for label, factory in (('shared client', shared_client), ('new client per call', per_call_client)):
+            index.s3_client = factory
+            try:
+                for action, make_body in (('upload', upload_body), ('presign_put', lambda: presign)):
+                    bodies = [make_body() for _ in range(args.repeat + 2)]
+                    stats = summarize(measure(lambda: call(handler, bodies.pop()), repeat=args.repeat))
+                    print(f"{label + ' / ' + action:<28} | {stats['p50']:>8.2f} | {stats['p95']:>8.2f}")
+            finally:
+                index.s3_client = shared_client
+
+
+if __name__ == '__main__':
+    main()
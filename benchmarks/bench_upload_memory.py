@@ -0,0 +1,72 @@
+"""Пиковая память upload: base64 в JSON целиком против multipart-загрузки частями
+
+Запуск: DATABASE_URL=postgresql://localhost/bench python benchmarks/bench_upload_memory.py --size-mb 64
+S3 заменяется moto (pip install moto) или внешним MinIO через S3_ENDPOINT_URL,
+таблица uploads создаётся в отдельной схеме (по умолчанию bench_upload).
+"""
+import argparse
+import base64
+import json
+import os
+import tracemalloc
+from common import use_backend, reset_schema, use_schema
+from s3_stub import local_s3
+
+use_backend('upload')
+
+
+def peak_mb(fn) -> float:
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def call(handler, body: dict) -> dict:
+    response = handler({'httpMethod': 'POST', 'body': json.dumps(body)}, None)
+    assert response['statusCode'] == 200, response['body']
+    return json.loads(response['body'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size-mb', type=int, default=64)
+    parser.add_argument('--schema', default='bench_upload')
+    args = parser.parse_args()
+
+    reset_schema(args.schema)
+    use_schema(args.schema)
+
+    with local_s3():
+        from index import handler
+        from multipart import PART_SIZE
+
+        payload = os.urandom(args.size_mb * 1024 * 1024)
+
+        def legacy():
+            call(handler, {
+                'file_data': base64.b64encode(payload).decode(),
+                'file_name': 'video.mp4', 'file_type': 'video/mp4', 'folder': 'bench'
+            })
+
+        def multipart():
+            upload = call(handler, {
+                'action': 'create_multipart', 'file_name': 'video.mp4', 'file_type': 'video/mp4', 'folder': 'bench'
+            })
+            for number, offset in enumerate(range(0, len(payload), PART_SIZE), start=1):
+                call(handler, {
+                    'action': 'upload_part', 'key': upload['key'], 'upload_id': upload['upload_id'],
+                    'part_number': number,
+                    'chunk_data': base64.b64encode(payload[offset:offset + PART_SIZE]).decode()
+                })
+            call(handler, {'action': 'complete_multipart', 'key': upload['key'], 'upload_id': upload['upload_id']})
+
+        print(f"file size: {args.size_mb} MB, part size: {PART_SIZE // 1024 // 1024} MB")
+        print(f"legacy base64 peak:   {peak_mb(legacy):8.1f} MB")
+        print(f"multipart relay peak: {peak_mb(multipart):8.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Общие утилиты бенчмарков: подключение к локальному Postgres, изолированная схема, замеры"""
+import os
+import statistics
+import sys
+import time
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS_DIR = os.path.join(ROOT, 'db_migrations')
+BACKEND_DIR = os.path.join(ROOT, 'backend')
+
+
+def use_backend(function_name: str):
+    """Делает модули функции backend/<function_name> импортируемыми"""
+    path = os.path.join(BACKEND_DIR, function_name)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+def load_handler(function_name: str):
+    """handler функции backend/<function_name>, загруженный отдельно от остальных функций
+
+    В каждой функции свои db.py, core.py, auth_token.py и index.py с одинаковыми именами.
+    После импорта модули функции убираются из sys.modules, поэтому следующая функция
+    загружает свои копии, а уже загруженный handler продолжает ссылаться на свои.
+    Возвращает (handler, {имя: модуль}) - модули нужны, например, чтобы читать metrics.
+    """
+    import importlib
+
+    path = os.path.join(BACKEND_DIR, function_name)
+    sys.path.insert(0, path)
+    try:
+        index = importlib.import_module('index')
+        modules = {
+            name: module for name, module in list(sys.modules.items())
+            if os.path.dirname(os.path.abspath(getattr(module, '__file__', None) or '')) == path
+        }
+        for name in modules:
+            del sys.modules[name]
+    finally:
+        sys.path.remove(path)
+    return index.handler, modules
+
+
+def connect(schema: str):
+    return psycopg2.connect(os.environ['DATABASE_URL'], options=f'-c search_path={schema},public')
+
+
+def reset_schema(schema: str):
+    """Пересоздаёт схему и накатывает в неё все миграции из db_migrations"""
+    conn = psycopg2.connect(os.environ['DATABASE_URL'])
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+        cursor.execute(f'CREATE SCHEMA {schema}')
+        # Расширения ставятся в public, чтобы их не удалял DROP SCHEMA ... CASCADE
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public')
+        cursor.execute(f'SET search_path = {schema}, public')
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if name.endswith('.sql'):
+                with open(os.path.join(MIGRATIONS_DIR, name)) as f:
+                    cursor.execute(f.read())
+    conn.close()
+
+
+def use_schema(schema: str):
+    """Направляет соединения самих функций (db.get_connection) в схему бенчмарка через PGOPTIONS"""
+    os.environ['PGOPTIONS'] = f'-c search_path={schema},public'
+
+
+def dict_cursor(conn):
+    return conn.cursor(cursor_factory=RealDictCursor)
+
+
+def measure(fn, repeat: int = 20, warmup: int = 2) -> list:
+    """Запускает fn() repeat раз и возвращает длительности в миллисекундах"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def percentile(samples: list, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples: list) -> dict:
+    return {
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+        'mean': statistics.fmean(samples),
+    }
+
+
+class CountingCursor:
+    """Обёртка над курсором, считающая запросы (round trips) к БД"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.queries = 0
+
+    def execute(self, *args, **kwargs):
+        self.queries += 1
+        return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
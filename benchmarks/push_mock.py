@@ -0,0 +1,57 @@
+"""Локальный мок push-сервиса для проверки push.py без FCM/Mozilla
+
+POST /push/<id> отвечает 201 через --latency-ms миллисекунд, а для id с префиксом gone- отвечает 410.
+Запросы без VAPID-заголовка Authorization или без шифрования aes128gcm отклоняются с 400.
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockPushService:
+    def __init__(self, latency_ms: float = 50):
+        self.latency_ms = latency_ms
+        self.received = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self._server.server_address[1]}'
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(service.latency_ms / 1000)
+                valid = self.headers.get('Authorization', '').startswith('vapid ') \
+                    and self.headers.get('Content-Encoding') == 'aes128gcm'
+                with service._lock:
+                    if valid:
+                        service.received += 1
+                    else:
+                        service.rejected += 1
+                status = 400 if not valid else 410 if self.path.startswith('/push/gone-') else 201
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,30 @@
+"""Локальная замена S3 для бенчмарков upload: moto в процессе или внешний MinIO/moto_server"""
+import os
+from contextlib import contextmanager
+
+
+@contextmanager
+def local_s3():
+    """Без S3_ENDPOINT_URL поднимает moto в процессе и создаёт бакет files"""
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'bench')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    if os.environ.get('S3_ENDPOINT_URL'):
+        yield
+        return
+
+    try:
+        from moto import mock_aws
+    except ImportError:
+        from moto import mock_s3 as mock_aws
+
+    with mock_aws():
+        # moto перехватывает вызовы только к стандартному эндпоинту AWS
+        os.environ['S3_ENDPOINT_URL'] = 'https://s3.amazonaws.com'
+        import boto3
+        boto3.client('s3', endpoint_url=os.environ['S3_ENDPOINT_URL']).create_bucket(Bucket='files')
+        try:
+            yield
+        finally:
+            del os.environ['S3_ENDPOINT_URL']
@@ -0,0 +1,236 @@
+"""Генератор данных для нагрузочных прогонов: пользователи, чаты, участники и сообщения
+
+Запуск: DATABASE_URL=postgresql://localhost/bench python benchmarks/seed.py --users 1000000 --messages 50000000
+Данные пишутся в отдельную схему (по умолчанию bench_load) пачками по --batch строк,
+всё генерируется на стороне Postgres через generate_series. Распределение как в жизни:
+сообщений в чатах с меньшим id заметно больше, у пользователя 1 --hot-chats личных чатов,
+id сообщений растут вместе с created_at. Сводки чатов и счётчики непрочитанных
+заполняются в конце одним проходом, как в миграции V0004.
+"""
+import argparse
+import time
+from common import connect, reset_schema
+
+USERS_QUERY = """
+    INSERT INTO users (phone, name, bio, created_at, last_seen)
+    SELECT '+7' || lpad(g::text, 10, '0'),
+           (ARRAY['Анна', 'Иван', 'Мария', 'Пётр', 'Ольга', 'Дмитрий', 'Елена', 'Алексей'])[1 + g %% 8] || ' ' || g,
+           CASE WHEN g %% 4 = 0 THEN 'bio ' || g END,
+           %(start)s::timestamp + (g * interval '1 second'),
+           %(start)s::timestamp + (g * interval '1 second')
+    FROM generate_series(%(lo)s, %(hi)s) g
+"""
+
+# Первые hot чатов - пользователь 1 с пользователями 2..hot+1. Остальные - пары (x, x + k)
+# по модулю числа пользователей, x = i % users, k = i / users + 1: для разных i пары различны
+DIRECT_CHATS_QUERY = """
+    INSERT INTO chats (is_group, direct_user_low, direct_user_high, created_at, updated_at)
+    SELECT FALSE, LEAST(a, b), GREATEST(a, b), %(start)s::timestamp, %(start)s::timestamp
+    FROM (
+        SELECT CASE WHEN i < %(hot)s THEN 1 ELSE i %% %(users)s + 1 END AS a,
+               CASE WHEN i < %(hot)s THEN i + 2
+                    ELSE (i %% %(users)s + i / %(users)s + 1) %% %(users)s + 1 END AS b
+        FROM generate_series(%(lo)s - 1, %(hi)s - 1) i
+    ) pairs
+    WHERE a != b
+    ON CONFLICT (direct_user_low, direct_user_high) WHERE direct_user_low IS NOT NULL DO NOTHING
+"""
+
+GROUP_CHATS_QUERY = """
+    INSERT INTO chats (name, is_group, created_at, updated_at)
+    SELECT 'Группа ' || g, TRUE, %(start)s::timestamp, %(start)s::timestamp
+    FROM generate_series(%(lo)s, %(hi)s) g
+"""
+
+DIRECT_PARTICIPANTS_QUERY = """
+    INSERT INTO chat_participants (chat_id, user_id, joined_at)
+    SELECT c.id, u.user_id, c.created_at
+    FROM chats c
+    CROSS JOIN LATERAL (VALUES (c.direct_user_low), (c.direct_user_high)) u(user_id)
+    WHERE NOT c.is_group AND c.id BETWEEN %(lo)s AND %(hi)s
+"""
+
+GROUP_PARTICIPANTS_QUERY = """
+    INSERT INTO chat_participants (chat_id, user_id, is_admin, joined_at)
+    SELECT c.id, (c.id * 31 + j * 97) %% %(users)s + 1, j = 0, c.created_at
+    FROM chats c
+    CROSS JOIN generate_series(0, %(group_size)s - 1) j
+    WHERE c.is_group AND c.id BETWEEN %(lo)s AND %(hi)s
+    ON CONFLICT (chat_id, user_id) DO NOTHING
+"""
+
+# rn нумерует чаты без пропусков: id чатов идут с дырами из-за ON CONFLICT DO NOTHING
+MEMBERS_QUERY = """
+    CREATE TEMP TABLE seed_members AS
+    SELECT row_number() OVER (ORDER BY chat_id) AS rn, chat_id, array_agg(user_id ORDER BY user_id) AS members
+    FROM chat_participants
+    GROUP BY chat_id;
+    ALTER TABLE seed_members ADD PRIMARY KEY (rn);
+"""
+
+# Чат выбирается как 1 + chats * random()^skew: при skew > 1 ранние чаты получают больше сообщений
+MESSAGES_QUERY = """
+    INSERT INTO messages (chat_id, sender_id, content, message_type, created_at, is_read)
+    SELECT sm.chat_id,
+           sm.members[1 + picked.n %% cardinality(sm.members)],
+           (ARRAY['привет', 'как дела?', 'созвонимся завтра', 'отправил документы', 'ок',
+                  'встречаемся в 10', 'спасибо!', 'hello there', 'посмотри отчёт', 'буду через час'])[1 + picked.n %% 10]
+               || ' #' || picked.n,
+           CASE WHEN picked.n %% 50 = 0 THEN 'image' WHEN picked.n %% 70 = 0 THEN 'audio' ELSE 'text' END,
+           %(start)s::timestamp + picked.n * %(step)s * interval '1 millisecond',
+           FALSE
+    FROM (
+        SELECT n, 1 + floor(%(chats)s * power(random(), %(skew)s))::int AS rn
+        FROM generate_series(%(lo)s, %(hi)s) n
+    ) picked
+    JOIN seed_members sm ON sm.rn = picked.rn
+    ORDER BY picked.n
+"""
+
+SUMMARY_QUERIES = (
+    """
+    UPDATE chats c
+    SET last_message_id = lm.id,
+        last_message_preview = LEFT(lm.content, 200),
+        last_message_type = lm.message_type,
+        last_message_sender_id = lm.sender_id,
+        last_message_at = lm.created_at,
+        updated_at = lm.created_at,
+        message_count = lm.cnt
+    FROM (
+        SELECT DISTINCT ON (chat_id) chat_id, id, content, message_type, sender_id, created_at,
+               COUNT(*) OVER (PARTITION BY chat_id) AS cnt
+        FROM messages
+        ORDER BY chat_id, id DESC
+    ) lm
+    WHERE lm.chat_id = c.id
+    """,
+    """
+    UPDATE chats c
+    SET participant_count = pc.cnt
+    FROM (SELECT chat_id, COUNT(*) AS cnt FROM chat_participants GROUP BY chat_id) pc
+    WHERE pc.chat_id = c.id
+    """,
+    # Примерно у трети участников остаются непрочитанные: отметка на пару сообщений раньше последнего
+    """
+    UPDATE chat_participants cp
+    SET last_read_message_id = CASE WHEN cp.user_id %% 3 = 0
+                                    THEN (SELECT m.id FROM messages m
+                                          WHERE m.chat_id = cp.chat_id AND m.id < c.last_message_id
+                                          ORDER BY m.id DESC OFFSET 2 LIMIT 1)
+                                    ELSE c.last_message_id END
+    FROM chats c
+    WHERE c.id = cp.chat_id AND c.last_message_id IS NOT NULL
+    """,
+    "UPDATE chat_participants SET read_receipt_message_id = last_read_message_id",
+    """
+    UPDATE chat_participants cp
+    SET unread_count = un.cnt
+    FROM (
+        SELECT cp2.chat_id, cp2.user_id, COUNT(m.id) AS cnt
+        FROM chat_participants cp2
+        JOIN messages m ON m.chat_id = cp2.chat_id
+                       AND m.sender_id != cp2.user_id
+                       AND m.id > COALESCE(cp2.last_read_message_id, 0)
+        GROUP BY cp2.chat_id, cp2.user_id
+    ) un
+    WHERE un.chat_id = cp.chat_id AND un.user_id = cp.user_id
+    """,
+)
+
+PRESENCE_QUERY = """
+    INSERT INTO user_presence (user_id, last_seen, online_until)
+    SELECT id, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP + interval '1 hour'
+    FROM users
+    WHERE id %% 10 = 0
+    ON CONFLICT (user_id) DO NOTHING
+"""
+
+
+def batched(conn, label: str, query: str, total: int, batch: int, **params):
+    """Выполняет query для диапазонов [lo, hi] от 1 до total по batch строк с фиксацией после каждой пачки"""
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        for lo in range(1, total + 1, batch):
+            hi = min(total, lo + batch - 1)
+            cursor.execute(query, {**params, 'lo': lo, 'hi': hi})
+            conn.commit()
+            rate = hi / max(time.perf_counter() - started, 1e-9)
+            print(f'\r{label}: {hi}/{total} ({rate:,.0f}/s)', end='', flush=True)
+    print()
+
+
+def seed(conn, users: int, direct_chats: int, group_chats: int, group_size: int, messages: int,
+         batch: int = 100000, hot_chats: int = 200, skew: float = 2.0, days: int = 365):
+    start = '2025-01-01 00:00:00'
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT setseed(0.42)')
+
+    # id пользователей совпадают с g: пользователи создаются в пустой схеме
+    batched(conn, 'users', USERS_QUERY, users, batch, start=start)
+    batched(conn, 'direct chats', DIRECT_CHATS_QUERY, direct_chats, batch,
+            start=start, users=users, hot=min(hot_chats, users - 1))
+    batched(conn, 'group chats', GROUP_CHATS_QUERY, group_chats, batch, start=start)
+
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM chats')
+        max_chat_id = cursor.fetchone()[0]
+    batched(conn, 'direct participants', DIRECT_PARTICIPANTS_QUERY, max_chat_id, batch)
+    batched(conn, 'group participants', GROUP_PARTICIPANTS_QUERY, max_chat_id, batch,
+            users=users, group_size=group_size)
+
+    with conn.cursor() as cursor:
+        cursor.execute(MEMBERS_QUERY)
+        cursor.execute('SELECT COUNT(*) FROM seed_members')
+        chats = cursor.fetchone()[0]
+        # Секции messages на весь засеваемый период, иначе история ляжет в messages_default
+        cursor.execute('SELECT ensure_message_partitions(%s::regclass, %s::date, 0)', ('messages', start))
+    conn.commit()
+    step = days * 86400 * 1000 / max(messages, 1)
+    batched(conn, 'messages', MESSAGES_QUERY, messages, batch, start=start, chats=chats, skew=skew, step=step)
+
+    started = time.perf_counter()
+    with conn.cursor() as cursor:
+        for query in SUMMARY_QUERIES:
+            cursor.execute(query)
+        cursor.execute(PRESENCE_QUERY)
+        cursor.execute('DROP TABLE seed_members')
+    conn.commit()
+    print(f'summaries: {time.perf_counter() - started:.1f} s')
+
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE')
+    conn.autocommit = False
+    return {'users': users, 'chats': chats, 'messages': messages}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schema', default='bench_load')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--direct-chats', type=int, default=None, help='по умолчанию 2 на пользователя')
+    parser.add_argument('--group-chats', type=int, default=None, help='по умолчанию 1 на 20 пользователей')
+    parser.add_argument('--group-size', type=int, default=12)
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--hot-chats', type=int, default=200, help='личных чатов у пользователя 1')
+    parser.add_argument('--skew', type=float, default=2.0)
+    parser.add_argument('--days', type=int, default=365, help='за сколько дней растянуть сообщения')
+    parser.add_argument('--batch', type=int, default=100000)
+    args = parser.parse_args()
+
+    direct_chats = args.users * 2 if args.direct_chats is None else args.direct_chats
+    group_chats = args.users // 20 if args.group_chats is None else args.group_chats
+
+    reset_schema(args.schema)
+    conn = connect(args.schema)
+    try:
+        report = seed(conn, args.users, direct_chats, group_chats, args.group_size, args.messages,
+                      args.batch, args.hot_chats, args.skew, args.days)
+    finally:
+        conn.close()
+    print(f"schema {args.schema}: {report['users']} users, {report['chats']} chats, {report['messages']} messages")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+-- Последнее сообщение чата берётся одним проходом по индексу
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_created_at ON messages(chat_id, created_at DESC);
+
+-- Счётчик непрочитанных сканирует только непрочитанные сообщения
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_unread ON messages(chat_id, sender_id) WHERE is_read = FALSE;
+
+-- Страница чатов пользователя: участие -> чат, сортировка по (updated_at, id)
+CREATE INDEX IF NOT EXISTS idx_chat_participants_user_id_chat_id ON chat_participants(user_id, chat_id);
+CREATE INDEX IF NOT EXISTS idx_chats_updated_at_id ON chats(updated_at DESC, id DESC);
@@ -0,0 +1,52 @@
+-- Денормализованная сводка чата, обновляется при отправке сообщения
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_id INTEGER;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_preview TEXT;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_type VARCHAR(20);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_sender_id INTEGER;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS participant_count INTEGER NOT NULL DEFAULT 0;
+
+-- Счётчик непрочитанных и отметка прочтения для каждого участника
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS last_read_message_id INTEGER;
+
+-- Заполнение сводок по существующим данным
+UPDATE chats c
+SET last_message_id = lm.id,
+    last_message_preview = LEFT(lm.content, 200),
+    last_message_type = lm.message_type,
+    last_message_sender_id = lm.sender_id,
+    last_message_at = lm.created_at
+FROM (
+    SELECT DISTINCT ON (chat_id) chat_id, id, content, message_type, sender_id, created_at
+    FROM messages
+    ORDER BY chat_id, id DESC
+) lm
+WHERE lm.chat_id = c.id;
+
+UPDATE chats c
+SET message_count = mc.cnt
+FROM (SELECT chat_id, COUNT(*) AS cnt FROM messages GROUP BY chat_id) mc
+WHERE mc.chat_id = c.id;
+
+UPDATE chats c
+SET participant_count = pc.cnt
+FROM (SELECT chat_id, COUNT(*) AS cnt FROM chat_participants GROUP BY chat_id) pc
+WHERE pc.chat_id = c.id;
+
+-- Отметка прочтения: всё до первого непрочитанного чужого сообщения
+UPDATE chat_participants cp
+SET last_read_message_id = COALESCE(
+    (SELECT MIN(m.id) - 1 FROM messages m
+     WHERE m.chat_id = cp.chat_id AND m.sender_id != cp.user_id AND m.is_read = FALSE),
+    (SELECT MAX(m.id) FROM messages m WHERE m.chat_id = cp.chat_id)
+);
+
+UPDATE chat_participants cp
+SET unread_count = (
+    SELECT COUNT(*) FROM messages m
+    WHERE m.chat_id = cp.chat_id
+      AND m.sender_id != cp.user_id
+      AND m.id > COALESCE(cp.last_read_message_id, 0)
+);
@@ -0,0 +1,2 @@
+-- Курсорная пагинация истории чата по (chat_id, id)
+CREATE INDEX IF NOT EXISTS idx_messages_chat_id_id ON messages(chat_id, id DESC);
@@ -0,0 +1,11 @@
+-- Отметка прочтения, видимая собеседникам (не двигается при send_read_receipts = FALSE)
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS read_receipt_message_id INTEGER;
+
+UPDATE chat_participants cp
+SET read_receipt_message_id = cp.last_read_message_id
+WHERE NOT EXISTS (
+    SELECT 1 FROM user_settings s WHERE s.user_id = cp.user_id AND s.send_read_receipts = FALSE
+);
+
+-- Непрочитанные считаются по отметке через idx_messages_chat_id_id, флаг is_read больше не используется
+DROP INDEX IF EXISTS idx_messages_chat_id_unread;
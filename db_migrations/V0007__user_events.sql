@@ -0,0 +1,12 @@
+-- Журнал событий пользователя для long-poll get_updates
+CREATE TABLE IF NOT EXISTS user_events (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    event_type VARCHAR(20) NOT NULL,
+    chat_id INTEGER REFERENCES chats(id),
+    payload JSONB NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_user_events_user_id_id ON user_events(user_id, id);
+CREATE INDEX IF NOT EXISTS idx_user_events_created_at ON user_events(created_at);
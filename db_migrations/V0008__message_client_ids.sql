@@ -0,0 +1,6 @@
+-- Идемпотентная отправка: клиентский идентификатор сообщения
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS client_msg_id VARCHAR(64);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_messages_client_msg_id
+    ON messages(chat_id, sender_id, client_msg_id)
+    WHERE client_msg_id IS NOT NULL;
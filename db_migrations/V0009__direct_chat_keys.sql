@@ -0,0 +1,26 @@
+-- Канонический ключ личного чата: пара (меньший, больший) user_id
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS direct_user_low INTEGER REFERENCES users(id);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS direct_user_high INTEGER REFERENCES users(id);
+
+-- Заполнение для существующих личных чатов; при дублях ключ получает самый ранний чат
+WITH pairs AS (
+    SELECT cp.chat_id, MIN(cp.user_id) AS low, MAX(cp.user_id) AS high
+    FROM chat_participants cp
+    JOIN chats c ON c.id = cp.chat_id
+    WHERE c.is_group = FALSE
+    GROUP BY cp.chat_id
+    HAVING COUNT(DISTINCT cp.user_id) = 2
+), canonical AS (
+    SELECT DISTINCT ON (low, high) chat_id, low, high
+    FROM pairs
+    ORDER BY low, high, chat_id
+)
+UPDATE chats c
+SET direct_user_low = canonical.low,
+    direct_user_high = canonical.high
+FROM canonical
+WHERE c.id = canonical.chat_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_chats_direct_pair
+    ON chats(direct_user_low, direct_user_high)
+    WHERE direct_user_low IS NOT NULL;
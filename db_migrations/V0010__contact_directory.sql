@@ -0,0 +1,6 @@
+-- Справочник контактов: keyset-пагинация по (name, id) и поиск по подстроке
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_users_name_id ON users(name, id);
+CREATE INDEX IF NOT EXISTS idx_users_name_trgm ON users USING gin (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_users_phone_digits_trgm ON users USING gin ((regexp_replace(phone, '\D', '', 'g')) gin_trgm_ops);
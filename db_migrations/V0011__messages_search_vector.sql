@@ -0,0 +1,5 @@
+-- Полнотекстовый поиск по сообщениям: русская и английская морфология
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (
+        to_tsvector('russian', coalesce(content, '')) || to_tsvector('english', coalesce(content, ''))
+    ) STORED;
@@ -0,0 +1,2 @@
+-- Строится без блокировки записи; CONCURRENTLY требует отдельной миграции вне транзакции
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_messages_search_tsv ON messages USING gin (search_tsv);
@@ -0,0 +1,17 @@
+-- Загруженные объекты по содержимому: одинаковые файлы хранятся один раз
+CREATE TABLE IF NOT EXISTS uploads (
+    id SERIAL PRIMARY KEY,
+    sha256 CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    storage_key TEXT NOT NULL,
+    content_type VARCHAR(255),
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_referenced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (sha256, size)
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_uploads_storage_key ON uploads(storage_key);
+
+-- Кандидаты на сборку мусора: объекты без ссылок
+CREATE INDEX IF NOT EXISTS idx_uploads_unreferenced ON uploads(last_referenced_at) WHERE ref_count = 0;
@@ -0,0 +1,13 @@
+-- Очередь push-уведомлений: send_message пишет строку в той же транзакции, воркер notifications её разбирает
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id BIGSERIAL PRIMARY KEY,
+    chat_id INTEGER NOT NULL REFERENCES chats(id),
+    message_id INTEGER NOT NULL,
+    sender_id INTEGER NOT NULL REFERENCES users(id),
+    message_type VARCHAR(20),
+    preview TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Участник с выключенными уведомлениями чата
+ALTER TABLE chat_participants ADD COLUMN IF NOT EXISTS muted BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,8 @@
+-- Присутствие пользователей: узкая UNLOGGED-таблица вместо обновления широкой строки users.
+-- После сбоя сервера таблица очищается, и все считаются не в сети до следующего heartbeat.
+-- fillfactor оставляет место на странице для HOT-обновлений без роста индекса.
+CREATE UNLOGGED TABLE IF NOT EXISTS user_presence (
+    user_id INTEGER PRIMARY KEY,
+    last_seen TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    online_until TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+) WITH (fillfactor = 50);
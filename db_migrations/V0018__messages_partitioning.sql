@@ -0,0 +1,172 @@
+-- Секционирование messages по месяцам created_at.
+-- Миграция не переносит историю: она создаёт секционированную messages_partitioned, зеркалит в неё
+-- новые строки триггером, а старые строки переносит пачками backend/messages/partitions.py --migrate,
+-- пока старая таблица принимает запись. Он же меняет таблицы местами; прежняя остаётся как messages_legacy.
+-- На пустой базе таблицы меняются местами сразу.
+
+-- Уникальный индекс секционированной таблицы обязан включать created_at,
+-- поэтому повтор client_msg_id проверяется по отдельной таблице
+CREATE TABLE IF NOT EXISTS message_client_ids (
+    chat_id INTEGER NOT NULL,
+    sender_id INTEGER NOT NULL,
+    client_msg_id VARCHAR(64) NOT NULL,
+    message_id INTEGER NOT NULL,
+    message_created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (chat_id, sender_id, client_msg_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_client_ids_created_at ON message_client_ids(message_created_at);
+
+-- id по-прежнему из messages_id_seq; ответ на сообщение проверяет send.py, внешний ключ
+-- на секционированную таблицу потребовал бы created_at в каждой ссылке
+CREATE TABLE IF NOT EXISTS messages_partitioned (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'::regclass),
+    chat_id INTEGER REFERENCES chats(id),
+    sender_id INTEGER REFERENCES users(id),
+    content TEXT,
+    message_type VARCHAR(20) DEFAULT 'text',
+    file_url TEXT,
+    file_name VARCHAR(255),
+    file_size INTEGER,
+    duration INTEGER,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    is_read BOOLEAN DEFAULT FALSE,
+    reply_to_id INTEGER,
+    client_msg_id VARCHAR(64),
+    search_tsv tsvector GENERATED ALWAYS AS (
+        to_tsvector('russian', coalesce(content, '')) || to_tsvector('english', coalesce(content, ''))
+    ) STORED,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+CREATE INDEX IF NOT EXISTS idx_messages_part_chat_id_id ON messages_partitioned(chat_id, id DESC);
+CREATE INDEX IF NOT EXISTS idx_messages_part_sender_id ON messages_partitioned(sender_id);
+CREATE INDEX IF NOT EXISTS idx_messages_part_search_tsv ON messages_partitioned USING gin (search_tsv);
+
+-- Страховка на случай, если секции вперёд не создавались дольше запаса
+CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages_partitioned DEFAULT;
+
+-- Секции messages_pYYYY_MM от from_month до текущего месяца + months_ahead, существующие пропускаются.
+-- Строки месяца, успевшие попасть в messages_default, переносятся в новую секцию.
+CREATE OR REPLACE FUNCTION ensure_message_partitions(parent regclass, from_month DATE, months_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    column_list TEXT := 'id, chat_id, sender_id, content, message_type, file_url, file_name, file_size, '
+                       'duration, created_at, is_read, reply_to_id, client_msg_id';
+    part_start DATE := date_trunc('month', from_month)::date;
+    last_start DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => months_ahead))::date;
+    part_end DATE;
+    part_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE part_start <= last_start LOOP
+        part_end := (part_start + interval '1 month')::date;
+        part_name := 'messages_p' || to_char(part_start, 'YYYY_MM');
+        IF to_regclass(part_name) IS NULL THEN
+            IF EXISTS (SELECT 1 FROM messages_default WHERE created_at >= part_start AND created_at < part_end) THEN
+                EXECUTE format(
+                    'CREATE TEMP TABLE messages_moved ON COMMIT DROP AS SELECT %s FROM messages_default '
+                    'WHERE created_at >= %L AND created_at < %L', column_list, part_start, part_end);
+                DELETE FROM messages_default WHERE created_at >= part_start AND created_at < part_end;
+                EXECUTE format('CREATE TABLE %I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                               part_name, parent, part_start, part_end);
+                EXECUTE format('INSERT INTO %s (%s) SELECT %s FROM messages_moved', parent, column_list, column_list);
+                DROP TABLE messages_moved;
+            ELSE
+                EXECUTE format('CREATE TABLE %I PARTITION OF %s FOR VALUES FROM (%L) TO (%L)',
+                               part_name, parent, part_start, part_end);
+            END IF;
+            created := created + 1;
+        END IF;
+        part_start := part_end;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_message_partitions(
+    'messages_partitioned',
+    COALESCE((SELECT MIN(created_at) FROM messages), CURRENT_TIMESTAMP)::date,
+    3
+);
+
+-- Новые строки старой таблицы сразу попадают и в новую; перенос пачками пропускает уже скопированные.
+-- client_msg_id заносится и в message_client_ids: старый код, ещё работающий при выкладке, его не пишет,
+-- а новый занимает его раньше вставки сообщения, и повтор здесь ничего не меняет
+CREATE OR REPLACE FUNCTION messages_partition_sync() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO messages_partitioned (id, chat_id, sender_id, content, message_type, file_url, file_name,
+                                      file_size, duration, created_at, is_read, reply_to_id, client_msg_id)
+    SELECT id, chat_id, sender_id, content, message_type, file_url, file_name,
+           file_size, duration, COALESCE(created_at, TIMESTAMP 'epoch'), is_read, reply_to_id, client_msg_id
+    FROM new_rows
+    ON CONFLICT DO NOTHING;
+    INSERT INTO message_client_ids (chat_id, sender_id, client_msg_id, message_id, message_created_at)
+    SELECT chat_id, sender_id, client_msg_id, id, COALESCE(created_at, TIMESTAMP 'epoch')
+    FROM new_rows
+    WHERE client_msg_id IS NOT NULL
+    ON CONFLICT DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS messages_partition_sync ON messages;
+CREATE TRIGGER messages_partition_sync
+    AFTER INSERT ON messages
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION messages_partition_sync();
+
+-- Существующие client_msg_id - после создания триггера: он дождался открытых вставок и держит
+-- блокировку до конца миграции, так что ни одна строка не проходит мимо обоих
+INSERT INTO message_client_ids (chat_id, sender_id, client_msg_id, message_id, message_created_at)
+SELECT chat_id, sender_id, client_msg_id, id, COALESCE(created_at, TIMESTAMP 'epoch')
+FROM messages
+WHERE client_msg_id IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+-- Состояние переноса: строки старой таблицы с id до target_id копируются пачками,
+-- более новые уже зеркалит триггер (CREATE TRIGGER дождался всех открытых вставок)
+CREATE TABLE IF NOT EXISTS message_partition_migration (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    copied_through INTEGER NOT NULL DEFAULT 0,
+    target_id INTEGER NOT NULL,
+    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    swapped_at TIMESTAMP
+);
+
+INSERT INTO message_partition_migration (target_id)
+SELECT COALESCE(MAX(id), 0) FROM messages
+ON CONFLICT DO NOTHING;
+
+-- Замена таблиц местами одной короткой транзакцией после переноса
+CREATE OR REPLACE FUNCTION swap_messages_partitioned() RETURNS BOOLEAN AS $$
+BEGIN
+    IF to_regclass('messages_partitioned') IS NULL THEN
+        RETURN FALSE;
+    END IF;
+    LOCK TABLE messages, messages_partitioned IN ACCESS EXCLUSIVE MODE;
+    IF EXISTS (SELECT 1 FROM message_partition_migration WHERE copied_through < target_id) THEN
+        RAISE EXCEPTION 'Перенос messages не завершён';
+    END IF;
+    DROP TRIGGER IF EXISTS messages_partition_sync ON messages;
+    ALTER TABLE messages RENAME TO messages_legacy;
+    ALTER TABLE messages_partitioned RENAME TO messages;
+    -- pg_get_serial_sequence('messages', 'id') в send.py и DROP TABLE messages_legacy без потери sequence
+    ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+    UPDATE message_partition_migration SET swapped_at = CURRENT_TIMESTAMP;
+    RETURN TRUE;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT swap_messages_partitioned() FROM message_partition_migration WHERE target_id = 0;
+
+-- Секции, выгруженные в S3 и удалённые из базы (partitions.py --archive-months)
+CREATE TABLE IF NOT EXISTS message_archives (
+    partition_name VARCHAR(63) PRIMARY KEY,
+    range_start TIMESTAMP NOT NULL,
+    range_end TIMESTAMP NOT NULL,
+    object_key TEXT NOT NULL,
+    row_count BIGINT NOT NULL,
+    size_bytes BIGINT NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
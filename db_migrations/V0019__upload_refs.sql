@@ -0,0 +1,9 @@
+-- Ссылки на загруженные объекты по владельцам: пользователь держит не больше одной ссылки
+-- на объект и снимает только свою. uploads.ref_count - число владельцев плюс ссылки,
+-- взятые до этой миграции или без токена: у них владельца нет, и сборщик их не трогает.
+CREATE TABLE IF NOT EXISTS upload_refs (
+    upload_id INTEGER NOT NULL REFERENCES uploads(id) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (upload_id, user_id)
+);
@@ -0,0 +1,8 @@
+-- Курсор get_updates по (xid, id) вместо id: id из BIGSERIAL выдаётся до COMMIT, и транзакция
+-- с меньшим id, зафиксированная позже, оказывалась за курсором клиента. Отдаются только события
+-- транзакций старше pg_snapshot_xmin - все они уже завершены, а новые получат xid не меньше.
+-- Существующие строки получают xid этой миграции и остаются упорядочены по id.
+ALTER TABLE user_events ADD COLUMN IF NOT EXISTS xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE INDEX IF NOT EXISTS idx_user_events_user_id_xid_id ON user_events(user_id, xid, id);
+DROP INDEX IF EXISTS idx_user_events_user_id_id;
@@ -31,7 +31,7 @@ export default function AddContactModal({ open, onOpenChange, userId, onContactA
 
     setLoading(true);
     try {
-      const contacts = await messagesAPI.getContacts(userId);
+      const { contacts } = await messagesAPI.getContacts(userId, { q: cleanPhone, limit: 20 });
       const existingContact = contacts.find(c => c.phone.replace(/\D/g, '') === cleanPhone);
       
       if (existingContact) {
@@ -3,41 +3,69 @@ import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { ScrollArea } from "@/components/ui/scroll-area";
 import Icon from "@/components/ui/icon";
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { messagesAPI, User } from "@/lib/api";
 import AddContactModal from "./AddContactModal";
 import InviteModal from "./InviteModal";
 
+const PAGE_SIZE = 50;
+const SEARCH_DEBOUNCE_MS = 300;
+
 interface ContactsProps {
   userId: number;
 }
 
 export default function Contacts({ userId }: ContactsProps) {
   const [search, setSearch] = useState("");
+  const [query, setQuery] = useState("");
   const [contacts, setContacts] = useState<User[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [addModalOpen, setAddModalOpen] = useState(false);
   const [inviteModalOpen, setInviteModalOpen] = useState(false);
+  // Ответ на устаревший запрос (пользователь уже ввёл другой поиск) не должен перезаписать список
+  const requestId = useRef(0);
+
+  useEffect(() => {
+    const timer = setTimeout(() => setQuery(search.trim()), SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [search]);
 
   useEffect(() => {
     loadContacts();
-  }, [userId]);
+  }, [userId, query]);
 
   const loadContacts = async () => {
+    const id = ++requestId.current;
+    setLoading(true);
     try {
-      const data = await messagesAPI.getContacts(userId);
-      setContacts(data);
+      const page = await messagesAPI.getContacts(userId, { q: query || undefined, limit: PAGE_SIZE });
+      if (id !== requestId.current) return;
+      setContacts(page.contacts);
+      setNextCursor(page.next_cursor ?? null);
     } catch (error) {
       console.error('Ошибка загрузки контактов:', error);
     } finally {
-      setLoading(false);
+      if (id === requestId.current) setLoading(false);
     }
   };
 
-  const filteredContacts = contacts.filter(contact =>
-    contact.name.toLowerCase().includes(search.toLowerCase()) ||
-    contact.phone.includes(search)
-  );
+  const loadMore = async () => {
+    if (!nextCursor || loadingMore) return;
+    const id = requestId.current;
+    setLoadingMore(true);
+    try {
+      const page = await messagesAPI.getContacts(userId, { q: query || undefined, cursor: nextCursor, limit: PAGE_SIZE });
+      if (id !== requestId.current) return;
+      setContacts((prev) => [...prev, ...page.contacts]);
+      setNextCursor(page.next_cursor ?? null);
+    } catch (error) {
+      console.error('Ошибка загрузки контактов:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   return (
     <div className="flex flex-col h-full">
@@ -57,11 +85,11 @@ export default function Contacts({ userId }: ContactsProps) {
       <ScrollArea className="flex-1 p-4">
         {loading ? (
           <div className="text-center py-8 text-muted-foreground">Загрузка...</div>
-        ) : filteredContacts.length === 0 ? (
+        ) : contacts.length === 0 ? (
           <div className="text-center py-8 text-muted-foreground">Контакты не найдены</div>
         ) : (
           <div className="space-y-2">
-            {filteredContacts.map((contact) => (
+            {contacts.map((contact) => (
               <div
                 key={contact.id}
                 className="flex items-center gap-3 p-3 rounded-xl hover:bg-gradient-card transition-all cursor-pointer"
@@ -98,6 +126,16 @@ export default function Contacts({ userId }: ContactsProps) {
                 </div>
               </div>
             ))}
+            {nextCursor && (
+              <Button
+                variant="ghost"
+                className="w-full rounded-full"
+                disabled={loadingMore}
+                onClick={loadMore}
+              >
+                {loadingMore ? "Загрузка..." : "Показать ещё"}
+              </Button>
+            )}
           </div>
         )}
       </ScrollArea>
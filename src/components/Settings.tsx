@@ -55,7 +55,7 @@ export default function Settings() {
           await updateSetting('push_notifications', true);
         }
       } else {
-        await notificationsAPI.unsubscribe();
+        await notificationsAPI.unsubscribe(user.id);
         await updateSetting('push_notifications', false);
       }
     } catch (error) {
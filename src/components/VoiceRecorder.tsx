@@ -27,7 +27,7 @@ export default function VoiceRecorder({ onRecordingComplete, onCancel }: VoiceRe
         reader.readAsDataURL(blob);
         reader.onloadend = async () => {
           const base64 = (reader.result as string).split(',')[1];
-          const result = await uploadAPI.uploadFile(base64, 'voice.webm', 'audio/webm', 'voice');
+          const result = await uploadAPI.uploadFile(base64, 'voice.webm', 'audio/webm', 'voice', true);
           onRecordingComplete(result.url, duration, result.file_size);
         };
       } catch (error) {
@@ -0,0 +1,31 @@
+import { useEffect } from "react";
+import { messagesAPI } from "@/lib/api";
+
+const HEARTBEAT_INTERVAL_MS = 30000;
+
+export function usePresence(userId: number | undefined) {
+  useEffect(() => {
+    if (!userId) return;
+
+    const beat = () => {
+      if (document.visibilityState === "visible") {
+        messagesAPI.heartbeat(userId).catch(() => undefined);
+      }
+    };
+    const onVisibilityChange = () => {
+      if (document.visibilityState === "visible") beat();
+      else messagesAPI.goOffline(userId);
+    };
+    const onPageHide = () => messagesAPI.goOffline(userId);
+
+    beat();
+    const timer = setInterval(beat, HEARTBEAT_INTERVAL_MS);
+    document.addEventListener("visibilitychange", onVisibilityChange);
+    window.addEventListener("pagehide", onPageHide);
+    return () => {
+      clearInterval(timer);
+      document.removeEventListener("visibilitychange", onVisibilityChange);
+      window.removeEventListener("pagehide", onPageHide);
+    };
+  }, [userId]);
+}
@@ -5,6 +5,15 @@ const API_URLS = {
   settings: 'https://functions.poehali.dev/86864550-5817-4044-a37b-89ed3e2016e7',
 };
 
+const SEND_RETRIES = 3;
+
+export function authHeaders(json = false): Record<string, string> {
+  const headers: Record<string, string> = json ? { 'Content-Type': 'application/json' } : {};
+  const token = localStorage.getItem('token');
+  if (token) headers['X-Auth-Token'] = token;
+  return headers;
+}
+
 export interface User {
   id: number;
   phone: string;
@@ -30,6 +39,8 @@ export interface Message {
   created_at: string;
   is_read: boolean;
   reply_to_id?: number;
+  client_msg_id?: string;
+  duplicate?: boolean;
 }
 
 export interface Chat {
@@ -44,11 +55,76 @@ export interface Chat {
   is_online?: boolean;
 }
 
+export interface MessagesPage {
+  messages: Message[];
+  next_cursor: string | null;
+  prev_cursor: string | null;
+}
+
+export interface OutgoingMessage {
+  chat_id: number;
+  sender_id: number;
+  content: string;
+  message_type?: Message['message_type'];
+  file_url?: string;
+  file_name?: string;
+  file_size?: number;
+  duration?: number;
+  reply_to_id?: number;
+  client_msg_id?: string;
+}
+
+export interface SendMessagesResult {
+  messages: (Message & { index: number })[];
+  errors: { index: number; error: string }[];
+}
+
+export interface UpdateEvent {
+  id: number;
+  type: 'message' | 'read' | 'read_receipt' | 'presence';
+  chat_id: number | null;
+  payload: Record<string, unknown>;
+  created_at: string;
+}
+
+export interface UpdatesPage {
+  events: UpdateEvent[];
+  cursor: string;
+}
+
+export interface SearchResult {
+  id: number;
+  chat_id: number;
+  sender_id: number;
+  sender_name?: string;
+  sender_avatar?: string;
+  content: string;
+  message_type: Message['message_type'];
+  created_at: string;
+  rank: number;
+  highlight: string;
+}
+
+export interface SearchPage {
+  results: SearchResult[];
+  next_cursor: string | null;
+}
+
+export interface ContactsPage {
+  contacts: User[];
+  next_cursor: string | null;
+}
+
+export interface ChatsPage {
+  chats: Chat[];
+  next_cursor: string | null;
+}
+
 export const authAPI = {
   async register(phone: string, name: string): Promise<{ user: User; token: string }> {
     const response = await fetch(API_URLS.auth, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({ action: 'register', phone, name }),
     });
     const data = await response.json();
@@ -59,7 +135,7 @@ export const authAPI = {
   async login(phone: string): Promise<{ user: User; token: string }> {
     const response = await fetch(API_URLS.auth, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({ action: 'login', phone }),
     });
     const data = await response.json();
@@ -70,35 +146,81 @@ export const authAPI = {
   async updateProfile(userId: number, updates: Partial<User>): Promise<{ user: User }> {
     const response = await fetch(API_URLS.auth, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({ action: 'update_profile', user_id: userId, ...updates }),
     });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Ошибка обновления профиля');
     return data;
   },
+
+  async logout(): Promise<void> {
+    await fetch(API_URLS.auth, {
+      method: 'POST',
+      headers: authHeaders(true),
+      body: JSON.stringify({ action: 'logout' }),
+      keepalive: true,
+    });
+  },
 };
 
 export const messagesAPI = {
-  async getChats(userId: number): Promise<Chat[]> {
-    const response = await fetch(`${API_URLS.messages}?action=get_chats&user_id=${userId}`);
+  async getChats(userId: number, cursor?: string, limit = 100): Promise<ChatsPage> {
+    const params = new URLSearchParams({ action: 'get_chats', user_id: String(userId), limit: String(limit) });
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_URLS.messages}?${params}`, { headers: authHeaders() });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Ошибка загрузки чатов');
-    return data.chats;
+    return { chats: data.chats, next_cursor: data.next_cursor };
   },
 
-  async getMessages(chatId: number, limit = 50, offset = 0): Promise<Message[]> {
-    const response = await fetch(`${API_URLS.messages}?action=get_messages&chat_id=${chatId}&limit=${limit}&offset=${offset}`);
+  async getMessages(
+    chatId: number,
+    { limit = 50, beforeId, afterId }: { limit?: number; beforeId?: string; afterId?: string } = {}
+  ): Promise<MessagesPage> {
+    const params = new URLSearchParams({ action: 'get_messages', chat_id: String(chatId), limit: String(limit) });
+    if (beforeId) params.set('before_id', beforeId);
+    if (afterId) params.set('after_id', afterId);
+    const response = await fetch(`${API_URLS.messages}?${params}`, { headers: authHeaders() });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Ошибка загрузки сообщений');
-    return data.messages;
+    return { messages: data.messages, next_cursor: data.next_cursor, prev_cursor: data.prev_cursor };
+  },
+
+  async getUpdates(userId: number, since?: string, timeout = 25): Promise<UpdatesPage> {
+    const params = new URLSearchParams({ action: 'get_updates', user_id: String(userId), timeout: String(timeout) });
+    if (since) params.set('since', since);
+    const response = await fetch(`${API_URLS.messages}?${params}`, { headers: authHeaders() });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Ошибка получения обновлений');
+    return data;
+  },
+
+  async searchMessages(
+    userId: number,
+    q: string,
+    { chatId, cursor, limit = 20 }: { chatId?: number; cursor?: string; limit?: number } = {}
+  ): Promise<SearchPage> {
+    const params = new URLSearchParams({ action: 'search_messages', user_id: String(userId), q, limit: String(limit) });
+    if (chatId) params.set('chat_id', String(chatId));
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_URLS.messages}?${params}`, { headers: authHeaders() });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Ошибка поиска сообщений');
+    return data;
   },
 
-  async getContacts(userId: number): Promise<User[]> {
-    const response = await fetch(`${API_URLS.messages}?action=get_contacts&user_id=${userId}`);
+  async getContacts(
+    userId: number,
+    { q, cursor, limit = 50, mode = 'all' }: { q?: string; cursor?: string; limit?: number; mode?: 'all' | 'shared' } = {}
+  ): Promise<ContactsPage> {
+    const params = new URLSearchParams({ action: 'get_contacts', user_id: String(userId), limit: String(limit), mode });
+    if (q) params.set('q', q);
+    if (cursor) params.set('cursor', cursor);
+    const response = await fetch(`${API_URLS.messages}?${params}`, { headers: authHeaders() });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Ошибка загрузки контактов');
-    return data.contacts;
+    return { contacts: data.contacts, next_cursor: data.next_cursor };
   },
 
   async sendMessage(
@@ -109,11 +231,12 @@ export const messagesAPI = {
     fileUrl?: string,
     fileName?: string,
     fileSize?: number,
-    duration?: number
+    duration?: number,
+    clientMsgId: string = crypto.randomUUID()
   ): Promise<Message> {
-    const response = await fetch(API_URLS.messages, {
+    const request = {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({
         action: 'send_message',
         chat_id: chatId,
@@ -124,17 +247,87 @@ export const messagesAPI = {
         file_name: fileName,
         file_size: fileSize,
         duration,
+        client_msg_id: clientMsgId,
       }),
-    });
+    };
+    // Повтор с тем же client_msg_id не создаёт дубликат на сервере
+    let response: Response | undefined;
+    for (let attempt = 0; !response; attempt++) {
+      try {
+        response = await fetch(API_URLS.messages, request);
+      } catch (error) {
+        if (attempt >= SEND_RETRIES) throw error;
+        await new Promise((resolve) => setTimeout(resolve, 500 * 2 ** attempt));
+      }
+    }
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Ошибка отправки сообщения');
     return data.message;
   },
 
+  async sendMessages(messages: OutgoingMessage[]): Promise<SendMessagesResult> {
+    const response = await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: authHeaders(true),
+      body: JSON.stringify({ action: 'send_messages', messages }),
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Ошибка отправки сообщений');
+    return data;
+  },
+
+  async markRead(chatId: number, userId: number, messageId?: number): Promise<{ last_read_message_id: number; unread_count: number }> {
+    const response = await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: authHeaders(true),
+      body: JSON.stringify({ action: 'mark_read', chat_id: chatId, user_id: userId, message_id: messageId }),
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Ошибка отметки прочтения');
+    return data;
+  },
+
+  async heartbeat(userId: number): Promise<void> {
+    await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: authHeaders(true),
+      body: JSON.stringify({ action: 'heartbeat', user_id: userId }),
+    });
+  },
+
+  goOffline(userId: number): void {
+    // keepalive доходит и при закрытии вкладки; sendBeacon не умеет передавать X-Auth-Token
+    fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: authHeaders(true),
+      body: JSON.stringify({ action: 'offline', user_id: userId }),
+      keepalive: true,
+    }).catch(() => undefined);
+  },
+
+  async getPresence(userIds: number[]): Promise<{ user_id: number; is_online: boolean; last_seen: string | null }[]> {
+    const params = new URLSearchParams({ action: 'get_presence', user_ids: userIds.join(',') });
+    const response = await fetch(`${API_URLS.messages}?${params}`, { headers: authHeaders() });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Ошибка получения статусов');
+    return data.presence;
+  },
+
+  async muteChat(chatId: number, userId: number, muted = true): Promise<{ chat_id: number; user_id: number; muted: boolean }> {
+    const response = await fetch(API_URLS.messages, {
+      method: 'POST',
+      headers: authHeaders(true),
+      body: JSON.stringify({ action: 'mute_chat', chat_id: chatId, user_id: userId, muted }),
+    });
+    const data = await response.json();
+    if (!response.ok) throw new Error(data.error || 'Ошибка настройки уведомлений чата');
+    return data;
+  },
+
   async createChat(userId: number, participantIds: number[], isGroup = false, name?: string): Promise<number> {
     const response = await fetch(API_URLS.messages, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({
         action: 'create_chat',
         user_id: userId,
@@ -149,26 +342,170 @@ export const messagesAPI = {
   },
 };
 
+export interface MultipartUpload {
+  key: string;
+  upload_id: string;
+  part_size: number;
+}
+
+export interface MediaRendition {
+  url: string;
+  key: string;
+  content_type?: string;
+  width?: number;
+  height?: number;
+  size?: number;
+  duration?: number | null;
+}
+
+export interface MediaManifest {
+  key: string;
+  status: 'none' | 'pending' | 'ready' | 'failed';
+  kind?: 'image' | 'audio' | null;
+  renditions: Record<string, MediaRendition>;
+  error?: string;
+}
+
+const DEDUP_CHECK_MAX_BYTES = 64 * 1024 * 1024;
+
+type UploadResult = { url: string; file_name: string; file_size: number; key?: string; deduplicated?: boolean };
+
+async function sha256Hex(data: BufferSource): Promise<string | null> {
+  if (!globalThis.crypto?.subtle) return null;
+  const digest = await crypto.subtle.digest('SHA-256', data);
+  return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('');
+}
+
+type UploadCheck = UploadResult & { exists: boolean; challenge?: string; offset?: number; length?: number };
+
+async function findUploaded(data: Uint8Array, size: number): Promise<UploadResult | null> {
+  // Ссылки на общие объекты сервер выдаёт только по токену
+  if (!localStorage.getItem('token')) return null;
+  const sha256 = await sha256Hex(data);
+  if (!sha256) return null;
+  let result = await callUpload<UploadCheck>({ action: 'check_upload', sha256, size }, 'Ошибка проверки файла');
+  if (result.exists && result.challenge) {
+    // Доказательство, что байты есть у клиента: хеш challenge и запрошенного фрагмента
+    const salt = new TextEncoder().encode(result.challenge);
+    const offset = result.offset ?? 0;
+    const fragment = data.subarray(offset, offset + (result.length ?? 0));
+    const salted = new Uint8Array(salt.length + fragment.length);
+    salted.set(salt);
+    salted.set(fragment, salt.length);
+    result = await callUpload<UploadCheck>(
+      { action: 'check_upload', sha256, size, challenge: result.challenge, proof: await sha256Hex(salted) },
+      'Ошибка проверки файла'
+    );
+  }
+  return result.exists ? { ...result, deduplicated: true } : null;
+}
+
+async function callUpload<T>(body: Record<string, unknown>, errorMessage: string): Promise<T> {
+  const response = await fetch(API_URLS.upload, {
+    method: 'POST',
+    headers: authHeaders(true),
+    body: JSON.stringify(body),
+  });
+  const data = await response.json();
+  if (!response.ok) throw new Error(data.error || errorMessage);
+  return data;
+}
+
 export const uploadAPI = {
-  async uploadFile(fileData: string, fileName: string, fileType: string, folder = 'files'): Promise<{ url: string; file_name: string; file_size: number }> {
+  async uploadLargeFile(
+    file: Blob,
+    fileName: string,
+    fileType: string,
+    folder = 'files',
+    resume?: MultipartUpload,
+    onProgress?: (uploaded: number, total: number) => void
+  ): Promise<UploadResult> {
+    if (!resume && file.size <= DEDUP_CHECK_MAX_BYTES) {
+      const existing = await findUploaded(new Uint8Array(await file.arrayBuffer()), file.size);
+      if (existing) return existing;
+    }
+
+    const upload = resume ?? await callUpload<MultipartUpload>(
+      { action: 'create_multipart', file_name: fileName, file_type: fileType, folder },
+      'Ошибка начала загрузки'
+    );
+    const { parts } = await callUpload<{ parts: { part_number: number }[] }>(
+      { action: 'list_parts', key: upload.key, upload_id: upload.upload_id },
+      'Ошибка получения частей'
+    );
+    const done = new Set(parts.map((p) => p.part_number));
+    const totalParts = Math.max(1, Math.ceil(file.size / upload.part_size));
+    const pending = Array.from({ length: totalParts }, (_, i) => i + 1).filter((n) => !done.has(n));
+
+    for (let i = 0; i < pending.length; i += 100) {
+      const batch = pending.slice(i, i + 100);
+      const { urls } = await callUpload<{ urls: Record<string, string> }>(
+        { action: 'presign_parts', key: upload.key, upload_id: upload.upload_id, part_numbers: batch },
+        'Ошибка подписи частей'
+      );
+      for (const number of batch) {
+        const chunk = file.slice((number - 1) * upload.part_size, number * upload.part_size);
+        const response = await fetch(urls[number], { method: 'PUT', body: chunk });
+        if (!response.ok) throw new Error('Ошибка загрузки части файла');
+        done.add(number);
+        onProgress?.(Math.min(done.size * upload.part_size, file.size), file.size);
+      }
+    }
+
+    await callUpload(
+      { action: 'complete_multipart', key: upload.key, upload_id: upload.upload_id },
+      'Ошибка завершения загрузки'
+    );
+    return callUpload(
+      { action: 'register_upload', key: upload.key },
+      'Ошибка регистрации файла'
+    );
+  },
+
+  async uploadFile(
+    fileData: string,
+    fileName: string,
+    fileType: string,
+    folder = 'files',
+    process = false
+  ): Promise<UploadResult & { media?: MediaManifest }> {
+    const bytes = Uint8Array.from(atob(fileData), (c) => c.charCodeAt(0));
+    const existing = await findUploaded(bytes, bytes.length);
+    if (existing) {
+      return process ? { ...existing, media: await uploadAPI.getMedia(existing.url) } : existing;
+    }
+
     const response = await fetch(API_URLS.upload, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({
         file_data: fileData,
         file_name: fileName,
         file_type: fileType,
         folder,
+        process,
       }),
     });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Ошибка загрузки файла');
     return data;
   },
+
+  async releaseUpload(url: string): Promise<{ key: string; released: boolean; ref_count: number | null }> {
+    return callUpload({ action: 'release_upload', url }, 'Ошибка освобождения файла');
+  },
+
+  async processMedia(url: string, wait = false): Promise<MediaManifest> {
+    return callUpload({ action: 'process_media', url, wait }, 'Ошибка обработки файла');
+  },
+
+  async getMedia(url: string): Promise<MediaManifest> {
+    return callUpload({ action: 'get_media', url }, 'Ошибка получения превью');
+  },
 };
 
 export interface UserSettings {
-  id: number;
+  id: number | null;
   user_id: number;
   message_sound: boolean;
   call_sound: boolean;
@@ -181,12 +518,12 @@ export interface UserSettings {
   hd_quality: boolean;
   noise_cancellation: boolean;
   auto_answer: boolean;
-  updated_at: string;
+  updated_at: string | null;
 }
 
 export const settingsAPI = {
   async getSettings(userId: number): Promise<UserSettings> {
-    const response = await fetch(`${API_URLS.settings}?user_id=${userId}`);
+    const response = await fetch(`${API_URLS.settings}?user_id=${userId}`, { headers: authHeaders() });
     const data = await response.json();
     if (!response.ok) throw new Error(data.error || 'Ошибка загрузки настроек');
     return data.settings;
@@ -195,7 +532,7 @@ export const settingsAPI = {
   async updateSettings(userId: number, settings: Partial<UserSettings>): Promise<UserSettings> {
     const response = await fetch(API_URLS.settings, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({ user_id: userId, ...settings }),
     });
     const data = await response.json();
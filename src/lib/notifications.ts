@@ -1,3 +1,5 @@
+import { authHeaders } from './api';
+
 const NOTIFICATIONS_API = 'https://functions.poehali.dev/d1ce564b-3ec4-4603-be2d-3a52d3f4ece8';
 
 export const notificationsAPI = {
@@ -39,7 +41,7 @@ export const notificationsAPI = {
 
     await fetch(NOTIFICATIONS_API, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({
         action: 'subscribe',
         user_id: userId,
@@ -51,11 +53,20 @@ export const notificationsAPI = {
     return subscription;
   },
 
-  async unsubscribe(): Promise<void> {
+  async unsubscribe(userId: number): Promise<void> {
     const registration = await navigator.serviceWorker.ready;
     const subscription = await registration.pushManager.getSubscription();
     
     if (subscription) {
+      await fetch(NOTIFICATIONS_API, {
+        method: 'POST',
+        headers: authHeaders(true),
+        body: JSON.stringify({
+          action: 'unsubscribe',
+          user_id: userId,
+          endpoint: subscription.endpoint,
+        }),
+      });
       await subscription.unsubscribe();
       console.log('Отписка от push выполнена');
     }
@@ -64,7 +75,7 @@ export const notificationsAPI = {
   async sendTestNotification(userId: number): Promise<void> {
     await fetch(NOTIFICATIONS_API, {
       method: 'POST',
-      headers: { 'Content-Type': 'application/json' },
+      headers: authHeaders(true),
       body: JSON.stringify({
         action: 'send_notification',
         user_id: userId,
@@ -11,7 +11,8 @@ import Calls from "@/components/Calls";
 import Settings from "@/components/Settings";
 import LoginScreen from "@/components/LoginScreen";
 import NotificationPrompt from "@/components/NotificationPrompt";
-import { User } from "@/lib/api";
+import { User, authAPI, messagesAPI } from "@/lib/api";
+import { usePresence } from "@/hooks/usePresence";
 
 type Tab = "chats" | "contacts" | "profile" | "gallery" | "calls" | "settings";
 
@@ -32,6 +33,8 @@ const Index = () => {
     }
   }, []);
 
+  usePresence(user?.id);
+
   const handleLogin = (userData: User, userToken: string) => {
     setUser(userData);
     setToken(userToken);
@@ -41,6 +44,8 @@ const Index = () => {
   };
 
   const handleLogout = () => {
+    if (user) messagesAPI.goOffline(user.id);
+    authAPI.logout().catch(() => undefined);
     setUser(null);
     setToken(null);
     localStorage.removeItem('user');